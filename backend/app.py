@@ -24,12 +24,15 @@ except ImportError:
 from src.auth.jwt_handler import generate_jwt, verify_jwt
 from src.auth.decorators import require_auth, require_admin
 from src.error_tracking import init_sentry, capture_exception, add_breadcrumb, set_user_context
+from src.fanout import StageTimings, run_parallel
 from sentry_sdk import set_context, set_user
 
 # Heavy imports will be done lazily inside initialization functions
 # This prevents slow module loading from blocking port binding
 import bcrypt
 import secrets
+import json
+import base64
 import logging
 import threading
 import time
@@ -332,6 +335,17 @@ _components.register('password_reset', LazyLoader(
     )(__import__('src.auth.password_reset', fromlist=['PasswordResetService']).PasswordResetService)
 ))
 
+_components.register('user_purger', LazyLoader(
+    'User Purger',
+    lambda: (
+        lambda UserDataPurger: UserDataPurger(
+            _components.get('rag_system'),
+            upload_folder=app.config['UPLOAD_FOLDER'],
+            audio_folder=app.config['AUDIO_FOLDER']
+        ) if _components.get('rag_system') else None
+    )(__import__('src.user_purge', fromlist=['UserDataPurger']).UserDataPurger)
+))
+
 # Backward compatibility - proxy objects that lazy-load on attribute access
 class _LazyProxy:
     """Proxy that lazy-loads component on first attribute access"""
@@ -368,6 +382,7 @@ user_limits = _LazyProxy('user_limits')
 email_service = _LazyProxy('email_service')
 analytics = _LazyProxy('analytics')
 password_reset_service = _LazyProxy('password_reset')
+user_purger = _LazyProxy('user_purger')
 
 # Getter functions for explicit access
 def get_config(): return _components.get('config')
@@ -379,6 +394,7 @@ def get_user_limits(): return _components.get('user_limits')
 def get_email_svc(): return _components.get('email_service')
 def get_analytics_svc(): return _components.get('analytics')
 def get_password_reset(): return _components.get('password_reset')
+def get_user_purger(): return _components.get('user_purger')
 
 # Eagerly initialize critical components (Database and Analytics)
 # These are lightweight and needed for every auth request
@@ -831,22 +847,14 @@ def delete_account():
 
         logger.info(f"Deleting account for user {request.user_id}")
 
-        # Delete user documents from vector store
+        # Purge vectors, uploaded PDFs, audio and cache keys in the background
+        # (large accounts can hold thousands of chunks - don't block the request)
+        purge_job_id = None
         try:
-            user_docs = rag_system.list_documents(user_id=request.user_id)
-            for doc in user_docs:
-                rag_system.delete_document(doc['name'], user_id=request.user_id)
-            logger.info(f"Deleted {len(user_docs)} documents from vector store")
-        except Exception as e:
-            logger.warning(f"Error deleting documents from vector store: {e}")
-
-        # Clear user cache
-        try:
-            cache_pattern = f"*_{request.user_id}"
-            # Redis cache will auto-expire user's cached queries
-            logger.info("User cache will auto-expire")
+            purge_job_id = user_purger.start(request.user_id)
+            clear_document_cache()
         except Exception as e:
-            logger.warning(f"Error clearing user cache: {e}")
+            logger.warning(f"Error starting user data purge: {e}")
 
         # Delete user from database (cascades to related tables)
         success = db.delete_user(request.user_id)
@@ -858,7 +866,8 @@ def delete_account():
 
             return jsonify({
                 'success': True,
-                'message': 'Account deleted successfully. We\'re sorry to see you go!'
+                'message': 'Account deleted successfully. We\'re sorry to see you go!',
+                'purge_job_id': purge_job_id
             })
         else:
             return jsonify({'success': False, 'message': 'Failed to delete account'}), 500
@@ -1085,10 +1094,11 @@ def upload_pdf():
                 'limits': size_check
             }), 413
 
-        # Save file
+        # Save to a private temp file; the document registry moves it into per-content storage once indexed
         filename = secure_filename(file.filename)
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        incoming_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'incoming')
+        os.makedirs(incoming_dir, exist_ok=True)
+        filepath = os.path.join(incoming_dir, f"{secrets.token_hex(16)}_{filename}")
         file.save(filepath)
 
         # Verify MIME type (prevent fake PDFs - e.g., .txt renamed to .pdf)
@@ -1116,7 +1126,12 @@ def upload_pdf():
             # Don't block upload if magic library fails - log and continue
 
         # Process document with user_id for multi-tenancy
-        result = rag_system.add_document(filepath, user_id=user_id)
+        try:
+            result = rag_system.add_document(filepath, user_id=user_id, document_name=filename.replace('.pdf', ''),
+                                             original_filename=file.filename)
+        finally:
+            if os.path.exists(filepath):
+                os.remove(filepath)  # Not registered (extraction or indexing failed)
 
         # Clear document cache after successful upload
         if result['success']:
@@ -1133,12 +1148,20 @@ def upload_pdf():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+def _wants_timings() -> bool:
+    """Per-stage timings in /ask responses: on request (X-Include-Timings: 1) or for admins"""
+    requested = request.headers.get('X-Include-Timings', '').lower() in ('1', 'true', 'yes')
+    return requested or getattr(request, 'is_admin', False)
+
 @app.route('/ask', methods=['POST'])
 @require_auth
 def ask_question():
     data = request.json
     question = data.get('question', '').strip()
     document_name = data.get('document_name')  # Optional document filter
+    document_names = data.get('document_names')  # Optional document set filter
+    if isinstance(document_names, list) and document_names and not document_name:
+        document_name = sorted(str(name) for name in document_names)
     language = data.get('language', 'auto')  # Optional language for TTS ('auto', 'en', 'hi', 'kn')
 
     if not question:
@@ -1148,8 +1171,14 @@ def ask_question():
         # Get user_id from JWT
         user_id = request.user_id
 
-        # Query limit check (beta: 50 queries/day)
-        query_limit = user_limits.check_query_limit(user_id)
+        # Limit check, document check and history load are independent Redis/store reads
+        timings = StageTimings()
+        prologue = run_parallel({
+            'limit_check': lambda: user_limits.check_query_limit(user_id),  # beta: 50 queries/day
+            'conversation_load': lambda: rag_system.cache.get_user_conversation(user_id),
+            'document_check': lambda: rag_system.list_documents(user_id=user_id)
+        }, timings, group='request_prologue')
+        query_limit = prologue['limit_check']
 
         if not query_limit['allowed']:
             return jsonify({
@@ -1160,7 +1189,7 @@ def ask_question():
             }), 429
 
         # Check if user has uploaded any documents
-        user_documents = rag_system.list_documents(user_id=user_id)
+        user_documents = prologue['document_check']
         if not user_documents or len(user_documents) == 0:
             return jsonify({
                 'success': False,
@@ -1168,22 +1197,19 @@ def ask_question():
                 'no_documents': True
             })
 
-        # Get conversation history from Redis
-        conversation_history = rag_system.cache.get_user_conversation(user_id)
+        # Conversation history from Redis
+        conversation_history = prologue['conversation_load']
 
         # Get response with user_id filtering for multi-tenancy
+        include_timings = _wants_timings()
         response = rag_system.query(
             question,
             conversation_history,
             document_name=document_name,
-            user_id=user_id
+            user_id=user_id,
+            include_timings=include_timings
         )
 
-        # Update conversation history and save to Redis
-        conversation_history.append(question)
-        conversation_history.append(response['answer'])
-        rag_system.cache.save_user_conversation(user_id, conversation_history)
-
         # Generate unique audio ID for this response
         import hashlib
         from concurrent.futures import ThreadPoolExecutor
@@ -1193,6 +1219,15 @@ def ask_question():
         audio_filename = f"auto_{audio_id}.wav"
         audio_url = f"/audio/{audio_filename}"
 
+        # Update conversation history and track audio ownership (so an account purge
+        # can find the file later) - two independent Redis writes
+        conversation_history.append(question)
+        conversation_history.append(response['answer'])
+        run_parallel({
+            'conversation_save': lambda: rag_system.cache.save_user_conversation(user_id, conversation_history),
+            'audio_tracking': lambda: rag_system.cache.track_user_audio(user_id, audio_id)
+        }, timings, group='request_epilogue')
+
         # Use thread pool for better resource management
         if not hasattr(app, 'tts_executor'):
             app.tts_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='tts-worker')
@@ -1221,7 +1256,10 @@ def ask_question():
                 'sources_used': response.get('sources_used', 0),
                 'confidence': response.get('confidence', 0),
                 'query_type': response.get('query_type', 'unknown'),
-                'cached': response.get('cached', False)
+                'cached': response.get('cached', False),
+                'rerank': response.get('rerank'),
+                'context_selection': response.get('context_selection'),
+                'retrieval_cached': response.get('retrieval_cached', False)
             },
             'limits': {
                 'queries_remaining': query_limit['remaining'],
@@ -1233,12 +1271,196 @@ def ask_question():
                 'audio_id': audio_id
             }
         }
+        if include_timings:
+            # RAG stages (cache, condense, embedding, search, rerank, images, prompt, LLM) plus request I/O
+            result_payload['metadata']['timings'] = {**(response.get('timings') or {}), **timings.as_dict()}
 
         return jsonify(result_payload)
 
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+def _sse(event: str, data) -> str:
+    """One Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/ask/stream', methods=['POST'])
+@require_auth
+def ask_question_stream():
+    """
+    Stream an answer as Server-Sent Events
+
+    Events, in order:
+    - metadata: query type, sources and retrieval stats, sent before the first token
+    - token:    {"text": ...} per answer delta
+    - audio:    with "stream_audio": true, one spoken sentence at a time, in order and
+                while tokens are still arriving: {"seq", "text", "mime", "engine", "data" (base64)}
+    - done:     the full answer, metadata, limits and audio; sent after the answer
+                is cached and the conversation saved. With X-Include-Timings: 1 (or
+                for admins) metadata.timings has per-stage milliseconds, including
+                ttft (time to first token) and ttfa (time to first audio)
+    - error:    {"message": ...} if the request fails before the stream starts
+    """
+    data = request.json or {}
+    question = data.get('question', '').strip()
+    document_name = data.get('document_name')  # Optional document filter
+    document_names = data.get('document_names')  # Optional document set filter
+    if isinstance(document_names, list) and document_names and not document_name:
+        document_name = sorted(str(name) for name in document_names)
+    language = data.get('language', 'auto')  # Optional language for TTS ('auto', 'en', 'hi', 'kn')
+    stream_audio = bool(data.get('stream_audio'))  # Speak sentence by sentence during generation
+    include_timings = _wants_timings()
+
+    if not question:
+        return jsonify({'success': False, 'message': 'Please enter a question'})
+
+    try:
+        user_id = request.user_id
+
+        timings = StageTimings()
+        prologue = run_parallel({
+            'limit_check': lambda: user_limits.check_query_limit(user_id),  # beta: 50 queries/day
+            'conversation_load': lambda: rag_system.cache.get_user_conversation(user_id),
+            'document_check': lambda: rag_system.list_documents(user_id=user_id)
+        }, timings, group='request_prologue')
+        query_limit = prologue['limit_check']
+
+        if not query_limit['allowed']:
+            return jsonify({
+                'success': False,
+                'message': query_limit['message'],
+                'limit_reached': True,
+                'limits': query_limit
+            }), 429
+
+        if not prologue['document_check']:
+            return jsonify({
+                'success': False,
+                'message': 'Please upload at least one PDF document before asking questions.',
+                'no_documents': True
+            })
+
+        conversation_history = prologue['conversation_load']
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+    def audio_events(segments):
+        for segment in segments:
+            if 'ttfa' not in timings.stages:
+                timings.mark('ttfa')  # Time to first audio
+            yield _sse('audio', {
+                'seq': segment['seq'],
+                'text': segment['text'],
+                'mime': segment['mime'],
+                'engine': segment['engine'],
+                'data': base64.b64encode(segment['audio']).decode('ascii')
+            })
+
+    def generate():
+        pipeline = None
+        finished = False
+        try:
+            if stream_audio:
+                from src.tts_pipeline import SentenceTTSPipeline
+                pipeline = SentenceTTSPipeline(tts_handler, language=language, config=rag_system.config)
+
+            response = None
+            # Timings always come back for the TTFT log line; the client sees them only on request
+            for event in rag_system.query_stream(question, conversation_history, document_name=document_name,
+                                                 user_id=user_id, include_timings=True):
+                if event['type'] == 'metadata':
+                    yield _sse('metadata', {key: value for key, value in event.items() if key != 'type'})
+                elif event['type'] == 'token':
+                    yield _sse('token', {'text': event['text']})
+                    if pipeline:
+                        pipeline.feed(event['text'])
+                        yield from audio_events(pipeline.ready())
+                else:
+                    response = event['response']
+
+            if pipeline:
+                pipeline.close()
+                yield from audio_events(pipeline.drain())
+
+            import hashlib
+            audio_id = hashlib.md5(response['answer'].encode()).hexdigest()[:12]
+            audio_url = f"/audio/auto_{audio_id}.wav"
+
+            # Conversation write and audio ownership at the end, like /ask
+            conversation_history.append(question)
+            conversation_history.append(response['answer'])
+            epilogue = {
+                'conversation_save': lambda: rag_system.cache.save_user_conversation(user_id, conversation_history)
+            }
+            if not stream_audio:
+                epilogue['audio_tracking'] = lambda: rag_system.cache.track_user_audio(user_id, audio_id)
+            run_parallel(epilogue, timings, group='request_epilogue')
+
+            if not stream_audio:
+                if not hasattr(app, 'tts_executor'):
+                    from concurrent.futures import ThreadPoolExecutor
+                    app.tts_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='tts-worker')
+
+                def generate_audio_background():
+                    try:
+                        tts_handler.synthesize(response['answer'], language=language,
+                                               output_filename=f"auto_{audio_id}")
+                    except Exception as tts_error:
+                        logger.error(f"❌ Background: TTS generation failed: {tts_error}")
+                        capture_exception(tts_error, {'context': 'background_tts', 'audio_id': audio_id})
+
+                app.tts_executor.submit(generate_audio_background)
+
+            request_timings = {**(response.get('timings') or {}), **timings.as_dict()}
+            logger.info(f"⏱️ Streamed answer: TTFT {request_timings.get('ttft')} ms, "
+                        f"TTFA {request_timings.get('ttfa')} ms, total {request_timings.get('total')} ms")
+
+            metadata = {
+                'sources_used': response.get('sources_used', 0),
+                'confidence': response.get('confidence', 0),
+                'query_type': response.get('query_type', 'unknown'),
+                'cached': response.get('cached', False),
+                'provider': response.get('provider'),
+                'rerank': response.get('rerank'),
+                'context_selection': response.get('context_selection'),
+                'retrieval_cached': response.get('retrieval_cached', False)
+            }
+            if include_timings:
+                metadata['timings'] = request_timings
+
+            yield _sse('done', {
+                'success': not response.get('error', False),
+                'answer': response['answer'],
+                'metadata': metadata,
+                'limits': {
+                    'queries_remaining': query_limit['remaining'],
+                    'queries_limit': query_limit['limit']
+                },
+                'audio': {'streamed': True} if stream_audio else {
+                    'url': audio_url,
+                    'generating': True,
+                    'audio_id': audio_id
+                }
+            })
+            finished = True
+        except Exception as e:
+            logger.error(f"Streaming answer failed: {e}")
+            capture_exception(e, {'context': 'ask_stream'})
+            yield _sse('error', {'message': str(e)})
+        finally:
+            if pipeline and not finished:
+                pipeline.cancel()  # Client disconnected or the stream failed
+
+    from flask import Response, stream_with_context
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Keep reverse proxies from buffering tokens
+        }
+    )
+
 @app.route('/clear', methods=['POST'])
 @require_auth
 def clear_conversation():
@@ -1849,6 +2071,7 @@ def get_document_categories():
 def clear_cache():
     """Clear all cache entries"""
     try:
+        rag_system.semantic_cache.clear()
         result = rag_system.cache.clear_all_cache()
         if result:
             return jsonify({
@@ -1871,7 +2094,8 @@ def get_cache_stats():
         stats = rag_system.cache.get_cache_stats()
         return jsonify({
             'success': True,
-            'cache': stats
+            'cache': stats,
+            'semantic_cache': rag_system.semantic_cache.get_stats()
         })
     except Exception as e:
         logger.error(f"Get cache stats error: {str(e)}")
@@ -2036,6 +2260,72 @@ def admin_get_ai_feedback():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/admin/purge-jobs', methods=['GET', 'OPTIONS'])
+@require_admin
+def admin_get_purge_jobs():
+    """Get account purge job progress (admin only)"""
+    try:
+        jobs = user_purger.list_jobs()
+
+        return jsonify({
+            'success': True,
+            'jobs': jobs,
+            'count': len(jobs)
+        })
+    except Exception as e:
+        logger.error(f"Admin get purge jobs error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/admin/purge-jobs/<job_id>', methods=['GET', 'OPTIONS'])
+@require_admin
+def admin_get_purge_job(job_id):
+    """Get progress and throughput for a single purge job (admin only)"""
+    try:
+        job = user_purger.get_status(job_id)
+        if not job:
+            return jsonify({'success': False, 'message': 'Purge job not found'}), 404
+
+        return jsonify({
+            'success': True,
+            'job': job
+        })
+    except Exception as e:
+        logger.error(f"Admin get purge job error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/admin/index-maintenance', methods=['GET', 'OPTIONS'])
+@require_admin
+def admin_get_index_maintenance():
+    """Get vector index size, fragmentation and last compaction (admin only)"""
+    try:
+        return jsonify({
+            'success': True,
+            'maintenance': rag_system.index_maintainer.get_status()
+        })
+    except Exception as e:
+        logger.error(f"Admin get index maintenance error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/admin/index-maintenance/compact', methods=['POST', 'OPTIONS'])
+@require_admin
+def admin_compact_index():
+    """Queue a background compaction regardless of the tombstone ratio (admin only)"""
+    try:
+        if not rag_system.index_maintainer.trigger(force=True):
+            return jsonify({'success': False, 'message': 'Vector store backend does not support compaction'}), 400
+
+        return jsonify({
+            'success': True,
+            'message': 'Compaction queued'
+        }), 202
+    except Exception as e:
+        logger.error(f"Admin compact index error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 # ============= END ADMIN ENDPOINTS =============
 
 # ============= MODEL WARMUP (PRE-LOADING) =============
@@ -2059,6 +2349,11 @@ def warmup_models():
         rag = _components.get('rag_system')
         if rag:
             logger.info("✓ RAG system loaded")
+            if rag.reranker.enabled:
+                rag.reranker.warmup()
+                logger.info("✓ Cross-encoder reranker loaded")
+            rag.llm_handler.context_packer.warmup()
+            logger.info("✓ Context tokenizer loaded")
 
         # Pre-load TTS handler
         tts = _components.get('tts_handler')
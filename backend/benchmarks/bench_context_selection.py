@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Benchmark: prompt-context size with adaptive context selection at equal answer rate
+
+Indexes documents into a scratch vector store and retrieves the same queries
+with context selection off, then on at several similarity floors. For each run
+it reports:
+
+- answer rate:    share of queries whose source passage reaches the LLM context
+- chunks:         average chunks sent to the LLM
+- context tokens: average prompt context (same ~4 chars/token estimate as LLMHandler)
+
+LLM latency scales with prompt tokens, so the drop in context tokens is the
+expected latency saving, provided the answer rate stays level.
+
+Usage:
+    python -m benchmarks.bench_context_selection                  # synthetic pages
+    python -m benchmarks.bench_context_selection --pdf-dir ./data/pdfs
+    python -m benchmarks.bench_context_selection --thresholds 0.2 0.3 0.4 --gap 0.08
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import logging
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+
+def _measure(retriever, queries):
+    answered, chunks, context_tokens = 0, 0, 0
+    for query in queries:
+        results = retriever.retrieve(query, user_id='bench')['results']
+        answered += any(query in r['content'] for r in results)
+        chunks += len(results)
+        context_tokens += sum(len(r['content']) // 4 for r in results)
+
+    n = len(queries)
+    return answered / n, chunks / n, context_tokens / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdf-dir', help='Directory of PDFs to use as the corpus')
+    parser.add_argument('--pages', type=int, default=40, help='Synthetic pages')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.2, 0.3, 0.4])
+    parser.add_argument('--gap', type=float, default=None, help='CONTEXT_ELBOW_MIN_GAP override')
+    args = parser.parse_args()
+
+    from config.config import Config
+    from src.vector_store import create_vector_store
+    from src.lexical_index import LexicalIndex
+    from src.retriever import SmartRetriever
+    from benchmarks.bench_mmr import _pdf_corpus, _synthetic_corpus
+
+    config = Config()
+    if args.gap is not None:
+        config.CONTEXT_ELBOW_MIN_GAP = args.gap
+    corpus, sentences = _pdf_corpus(config, args.pdf_dir) if args.pdf_dir else _synthetic_corpus(config, args.pages)
+    queries = random.Random(7).sample(sentences, min(args.queries, len(sentences)))
+
+    scratch = tempfile.mkdtemp(prefix='context_bench_')
+    try:
+        config.VECTOR_DB_PATH = os.path.join(scratch, 'chroma')
+        config.FAISS_INDEX_PATH = os.path.join(scratch, 'faiss', 'index.faiss')
+        config.LEXICAL_INDEX_PATH = os.path.join(scratch, 'lexical')
+        config.RESTORE_SNAPSHOT_ON_STARTUP = False
+
+        store = create_vector_store(config)
+        lexical = LexicalIndex(config, store)
+        print(f"Indexing {sum(len(c) for c in corpus.values())} chunks...")
+        for name, chunks in corpus.items():
+            store.add_documents(chunks, name, user_id='bench')
+            lexical.add_document('bench', name, chunks)
+
+        runs = [('selection off', False, None)] + [(f"floor {t}", True, t) for t in args.thresholds]
+
+        print("=" * 72)
+        print(f"{len(queries)} queries, top-k {config.TOP_K_RESULTS}, "
+              f"elbow gap {config.CONTEXT_ELBOW_MIN_GAP}, min chunks {config.CONTEXT_MIN_RESULTS}")
+        print(f"{'Run':<14} {'answer rate':>12} {'chunks':>8} {'ctx tokens':>12} {'saved vs off':>14}")
+        print("-" * 72)
+        baseline_tokens = None
+        for label, enabled, threshold in runs:
+            config.CONTEXT_SELECTION_ENABLED = enabled
+            if threshold is not None:
+                config.SIMILARITY_THRESHOLD = threshold
+            retriever = SmartRetriever(store, config, lexical_index=lexical)
+            answer_rate, chunks, tokens = _measure(retriever, queries)
+            if baseline_tokens is None:
+                baseline_tokens = tokens
+            print(f"{label:<14} {answer_rate:>12.3f} {chunks:>8.2f} {tokens:>12.0f} "
+                  f"{baseline_tokens - tokens:>14.0f}")
+        print("=" * 72)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
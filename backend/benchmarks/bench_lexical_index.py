@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark: BM25 lexical search latency for one tenant
+
+Builds a per-user lexical index from PDFs (or a synthetic corpus sized like a
+typical 5-document tenant) and reports ingest time and search latency p50/p95.
+
+Usage:
+    python -m benchmarks.bench_lexical_index                        # synthetic 5 x 200 chunks
+    python -m benchmarks.bench_lexical_index --pdf-dir ./data/pdfs
+    python -m benchmarks.bench_lexical_index --docs 5 --chunks-per-doc 400 --queries 2000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import logging
+from types import SimpleNamespace
+
+import numpy as np
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+
+def _corpus(args):
+    if args.pdf_dir:
+        from config.config import Config
+        from src.pdf_processor import PDFProcessor
+        processor = PDFProcessor(Config())
+        return {
+            filename[:-4]: processor.extract_content(os.path.join(args.pdf_dir, filename))
+            for filename in sorted(os.listdir(args.pdf_dir)) if filename.endswith('.pdf')
+        }
+
+    rng = random.Random(42)
+    vocab = [f"term{i}" for i in range(8000)] + ['h2so4', 'ch3-ch2-oh', '3.2.1', 'benzene', 'न्यूटन',
+                                                  'ಸಂಯುಕ್ತ', 'ಕಾರ್ಬನ್']
+    return {
+        f"doc{d}": [SimpleNamespace(content=' '.join(rng.choices(vocab, k=180)), chunk_type='text', page_number=i // 3 + 1)
+                    for i in range(args.chunks_per_doc)]
+        for d in range(args.docs)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdf-dir', help='Directory of PDFs to use as the corpus')
+    parser.add_argument('--docs', type=int, default=5)
+    parser.add_argument('--chunks-per-doc', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    from src.lexical_index import LexicalIndex
+
+    corpus = _corpus(args)
+    scratch = tempfile.mkdtemp(prefix='lexical_bench_')
+    try:
+        index = LexicalIndex(SimpleNamespace(LEXICAL_INDEX_PATH=scratch))
+
+        started = time.perf_counter()
+        for name, chunks in corpus.items():
+            index.add_document('bench', name, chunks)
+        ingest_s = time.perf_counter() - started
+
+        rng = random.Random(7)
+        all_chunks = [c for chunks in corpus.values() for c in chunks]
+        queries = [' '.join(rng.sample(rng.choice(all_chunks).content.split(), 4)) for _ in range(args.queries)]
+
+        index.search('bench', queries[0])  # warm the tenant into memory
+        latencies = []
+        for query in queries:
+            t0 = time.perf_counter()
+            index.search('bench', query, n_results=10)
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+        print("=" * 60)
+        print(f"{len(corpus)} documents, {len(all_chunks)} chunks, {len(queries)} queries")
+        print(f"Ingest:        {ingest_s * 1000:.1f}ms")
+        print(f"Search p50:    {np.percentile(latencies, 50):.3f}ms")
+        print(f"Search p95:    {np.percentile(latencies, 95):.3f}ms")
+
+        # Kannada: vowel signs and viramas must stay inside the word, or BM25 only sees consonant fragments
+        index.add_document('bench', 'kannada', [SimpleNamespace(
+            content='ಕೀಟೋನ್‌ಗಳು ಕಾರ್ಬೊನಿಲ್ ಗುಂಪನ್ನು ಹೊಂದಿರುವ ಸಾವಯವ ಸಂಯುಕ್ತಗಳು', chunk_type='text', page_number=1)])
+        hits = index.search('bench', 'ಕೀಟೋನ್‌ಗಳು ಎಂದರೇನು', n_results=1)
+        found = bool(hits) and hits[0]['metadata']['document_name'] == 'kannada'
+        print(f"Kannada query: {'top hit' if found else 'MISSED'}")
+        print("=" * 60)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
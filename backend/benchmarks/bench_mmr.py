@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Benchmark: context-token savings from MMR diversification at equal answer quality
+
+Indexes documents into a scratch vector store, then retrieves the same queries
+with MMR off and with MMR at several lambdas. For each run it reports:
+
+- hit@k:            share of queries whose source passage is in the top-k (quality proxy)
+- context tokens:   tokens sent to the LLM (same ~4 chars/token estimate as LLMHandler)
+- redundant tokens: tokens repeating text already in an earlier chunk (overlap copies)
+
+Redundant tokens are context the LLM pays for without new information, so the
+saving is the drop in redundant tokens while hit@k stays level.
+
+Usage:
+    python -m benchmarks.bench_mmr                       # synthetic overlapping pages
+    python -m benchmarks.bench_mmr --pdf-dir ./data/pdfs
+    python -m benchmarks.bench_mmr --lambdas 0.5 0.7 0.9 --queries 200
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import logging
+from types import SimpleNamespace
+
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+SHINGLE = 8  # Words per shingle when detecting repeated text
+
+
+def _synthetic_corpus(config, pages: int):
+    """Pages of distinct 'fact' sentences, chunked with the production size/overlap"""
+    rng = random.Random(42)
+    vocab = [f"w{i}" for i in range(20000)]
+    stride = config.CHUNK_SIZE - config.CHUNK_OVERLAP
+    chunks, sentences = [], []
+    for page in range(1, pages + 1):
+        words = []
+        while len(words) < config.CHUNK_SIZE * 2.5:
+            sentence = rng.choices(vocab, k=15)
+            sentences.append(' '.join(sentence))
+            words.extend(sentence)
+        for i in range(0, len(words), stride):
+            chunks.append(SimpleNamespace(content=' '.join(words[i:i + config.CHUNK_SIZE]),
+                                          chunk_type='text', page_number=page))
+    return {'synthetic': chunks}, sentences
+
+
+def _pdf_corpus(config, pdf_dir: str):
+    from src.pdf_processor import PDFProcessor
+    processor = PDFProcessor(config)
+    corpus = {
+        filename[:-4]: processor.extract_content(os.path.join(pdf_dir, filename))
+        for filename in sorted(os.listdir(pdf_dir)) if filename.endswith('.pdf')
+    }
+    # Query with sentences taken from the documents themselves
+    sentences = []
+    for chunks in corpus.values():
+        for chunk in chunks:
+            words = chunk.content.split()
+            sentences.extend(' '.join(words[i:i + 15]) for i in range(0, max(1, len(words) - 15), 150))
+    return corpus, sentences
+
+
+def _shingles(text: str):
+    words = text.split()
+    return {tuple(words[i:i + SHINGLE]) for i in range(max(1, len(words) - SHINGLE + 1))}
+
+
+def _measure(retriever, queries, k):
+    hits, context_tokens, redundant_tokens = 0, 0, 0
+    for query in queries:
+        results = retriever.retrieve(query, user_id='bench')['results'][:k]
+        hits += any(query in r['content'] for r in results)
+
+        seen = set()
+        for r in results:
+            tokens = len(r['content']) // 4
+            shingles = _shingles(r['content'])
+            repeated = len(shingles & seen) / len(shingles) if shingles else 0.0
+            context_tokens += tokens
+            redundant_tokens += int(tokens * repeated)
+            seen |= shingles
+
+    n = len(queries)
+    return hits / n, context_tokens / n, redundant_tokens / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdf-dir', help='Directory of PDFs to use as the corpus')
+    parser.add_argument('--pages', type=int, default=40, help='Synthetic pages')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--lambdas', type=float, nargs='+', default=[0.5, 0.7, 0.9])
+    args = parser.parse_args()
+
+    from config.config import Config
+    from src.vector_store import create_vector_store
+    from src.lexical_index import LexicalIndex
+    from src.retriever import SmartRetriever
+
+    config = Config()
+    corpus, sentences = _pdf_corpus(config, args.pdf_dir) if args.pdf_dir else _synthetic_corpus(config, args.pages)
+    queries = random.Random(7).sample(sentences, min(args.queries, len(sentences)))
+
+    scratch = tempfile.mkdtemp(prefix='mmr_bench_')
+    try:
+        config.VECTOR_DB_PATH = os.path.join(scratch, 'chroma')
+        config.FAISS_INDEX_PATH = os.path.join(scratch, 'faiss', 'index.faiss')
+        config.LEXICAL_INDEX_PATH = os.path.join(scratch, 'lexical')
+        config.RESTORE_SNAPSHOT_ON_STARTUP = False
+
+        store = create_vector_store(config)
+        lexical = LexicalIndex(config, store)
+        print(f"Indexing {sum(len(c) for c in corpus.values())} chunks...")
+        for name, chunks in corpus.items():
+            store.add_documents(chunks, name, user_id='bench')
+            lexical.add_document('bench', name, chunks)
+
+        k = config.TOP_K_RESULTS
+        runs = [('MMR off', False, None)] + [(f"MMR λ={lam}", True, lam) for lam in args.lambdas]
+
+        print("=" * 72)
+        print(f"{len(queries)} queries, k={k}, chunk size/overlap {config.CHUNK_SIZE}/{config.CHUNK_OVERLAP} words")
+        print(f"{'Run':<14} {'hit@k':>8} {'ctx tokens':>12} {'redundant':>11} {'saved vs off':>14}")
+        print("-" * 72)
+        baseline_redundant = None
+        for label, enabled, lam in runs:
+            config.MMR_ENABLED = enabled
+            if lam is not None:
+                config.MMR_LAMBDA = lam
+            retriever = SmartRetriever(store, config, lexical_index=lexical)
+            hit_rate, ctx, redundant = _measure(retriever, queries, k)
+            if baseline_redundant is None:
+                baseline_redundant = redundant
+            print(f"{label:<14} {hit_rate:>8.3f} {ctx:>12.0f} {redundant:>11.0f} "
+                  f"{baseline_redundant - redundant:>14.0f}")
+        print("=" * 72)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Benchmark: warm-start restore from snapshot vs. re-embedding every chunk
+
+Restores a snapshot into a scratch ChromaDB directory and compares that with
+the cost of regenerating embeddings for the same documents and inserting them.
+
+Usage:
+    python -m benchmarks.bench_snapshot_restore [snapshot_path]
+"""
+import sys
+import time
+import shutil
+import tempfile
+import logging
+
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+
+def main():
+    from config.config import Config
+    from src.chroma_vector_store import ChromaVectorStore
+
+    config = Config()
+    snapshot_path = sys.argv[1] if len(sys.argv) > 1 else config.VECTOR_SNAPSHOT_PATH
+
+    scratch_dir = tempfile.mkdtemp(prefix='chroma_bench_')
+    try:
+        config.VECTOR_DB_PATH = scratch_dir
+        config.RESTORE_SNAPSHOT_ON_STARTUP = False
+        store = ChromaVectorStore(config)
+
+        # 1. Restore from snapshot
+        result = store.restore_snapshot(snapshot_path)
+        if not result['success']:
+            print(f"Restore failed: {result.get('error')}")
+            sys.exit(1)
+        restore_s = result['elapsed_s']
+        count = result['count']
+
+        # 2. Re-embed the same documents and insert them into a fresh collection
+        page = store.collection.get(include=['metadatas', 'documents'])
+        documents, metadatas, ids = page['documents'], page['metadatas'], page['ids']
+        store.clear_all()
+
+        started = time.time()
+        embeddings = store._generate_embeddings(documents, batch_size=64) if documents else []
+        for i in range(0, len(ids), store.SNAPSHOT_PAGE_SIZE):
+            end = i + store.SNAPSHOT_PAGE_SIZE
+            store.collection.add(ids=ids[i:end], embeddings=embeddings[i:end],
+                                 metadatas=metadatas[i:end], documents=documents[i:end])
+        reembed_s = time.time() - started
+
+        print("=" * 60)
+        print(f"Chunks:            {count}")
+        print(f"Snapshot restore:  {restore_s:8.2f}s  ({count / max(restore_s, 1e-9):,.0f} chunks/s)")
+        print(f"Re-embed + insert: {reembed_s:8.2f}s  ({count / max(reembed_s, 1e-9):,.0f} chunks/s)")
+        print(f"Speedup:           {reembed_s / max(restore_s, 1e-9):8.1f}x")
+        print("=" * 60)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Benchmark: compare VectorStore backends (Chroma, FAISS flat/IVF/HNSW, simple)
+
+Reports per backend: build time, query latency p50/p95, recall@k against
+exact cosine search, and resident-memory growth.
+
+Corpus and query embeddings are computed once up front and injected into each
+backend, so build time measures indexing cost rather than the embedding model.
+
+Usage:
+    python -m benchmarks.bench_vector_backends                       # synthetic corpus
+    python -m benchmarks.bench_vector_backends --pdf-dir ./data/pdfs # real uploaded PDFs
+    python -m benchmarks.bench_vector_backends --chunks 20000 --queries 200 --k 5
+"""
+import argparse
+import gc
+import os
+import random
+import shutil
+import tempfile
+import time
+import logging
+
+import numpy as np
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+BACKENDS = [
+    ('chroma', None),
+    ('faiss', 'flat'),
+    ('faiss', 'ivf'),
+    ('faiss', 'hnsw'),
+    ('simple', None),
+]
+
+
+def _rss_mb() -> float:
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
+    except ImportError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _load_corpus(args, config):
+    """Return {document_name: [DocumentChunk]} and a list of query strings"""
+    from src.pdf_processor import PDFProcessor, DocumentChunk
+
+    corpus = {}
+    if args.pdf_dir:
+        processor = PDFProcessor(config)
+        for filename in sorted(os.listdir(args.pdf_dir)):
+            if filename.endswith('.pdf'):
+                corpus[filename[:-4]] = processor.extract_content(os.path.join(args.pdf_dir, filename))
+    else:
+        rng = random.Random(42)
+        vocab = [f"term{i}" for i in range(5000)]
+        per_doc = max(1, args.chunks // 10)
+        for d in range(10):
+            corpus[f"doc{d}"] = [
+                DocumentChunk(content=' '.join(rng.choices(vocab, k=120)), chunk_type='text',
+                              page_number=i // 3 + 1, metadata={'chunk_index': i})
+                for i in range(per_doc)
+            ]
+
+    all_chunks = [c for chunks in corpus.values() for c in chunks]
+    rng = random.Random(7)
+    queries = [' '.join(rng.choice(all_chunks).content.split()[:12]) for _ in range(args.queries)]
+    return corpus, queries
+
+
+def _patch_embeddings(store, lookup):
+    """Serve precomputed embeddings so only indexing/search cost is measured"""
+    def generate(texts, batch_size=32):
+        matrix = np.stack([lookup[t] for t in texts])
+        return matrix.tolist() if store.__class__.__name__ == 'ChromaVectorStore' else matrix
+
+    store._generate_embeddings = generate
+    if hasattr(store, '_generate_embedding'):
+        store._generate_embedding = lambda text: lookup[text].tolist()
+
+
+def _run_backend(backend, index_type, config, corpus, queries, lookup, truth, k):
+    from src.vector_store import create_vector_store
+
+    scratch = tempfile.mkdtemp(prefix='vs_bench_')
+    try:
+        config.VECTOR_STORE_BACKEND = backend
+        config.VECTOR_DB_PATH = os.path.join(scratch, 'chroma')
+        config.FAISS_INDEX_PATH = os.path.join(scratch, 'faiss', 'index.faiss')
+        config.RESTORE_SNAPSHOT_ON_STARTUP = False
+        if index_type:
+            config.FAISS_INDEX_TYPE = index_type
+
+        gc.collect()
+        rss_before = _rss_mb()
+        store = create_vector_store(config)
+        _patch_embeddings(store, lookup)
+
+        started = time.perf_counter()
+        for name, chunks in corpus.items():
+            store.add_documents(chunks, name, user_id='bench')
+        build_s = time.perf_counter() - started
+
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            t0 = time.perf_counter()
+            result = store.search(query, n_results=k, user_id='bench')
+            latencies.append((time.perf_counter() - t0) * 1000)
+            returned = {(m['document_name'], doc) for m, doc in
+                        zip(result['metadatas'][0], result['documents'][0])}
+            hits += len(returned & expected)
+
+        return {
+            'backend': backend if not index_type else f"{backend}-{index_type}",
+            'build_s': build_s,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'recall': hits / (len(queries) * k),
+            'rss_mb': _rss_mb() - rss_before
+        }
+    except ImportError as e:
+        return {'backend': backend if not index_type else f"{backend}-{index_type}", 'error': str(e)}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdf-dir', help='Directory of PDFs to use as the corpus')
+    parser.add_argument('--chunks', type=int, default=5000, help='Synthetic corpus size')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    from config.config import Config
+    from sentence_transformers import SentenceTransformer
+
+    config = Config()
+    corpus, queries = _load_corpus(args, config)
+    texts = list({c.content for chunks in corpus.values() for c in chunks} | set(queries))
+
+    print(f"Embedding {len(texts)} texts with {config.EMBEDDING_MODEL}...")
+    model = SentenceTransformer(config.EMBEDDING_MODEL)
+    vectors = model.encode(texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+    lookup = {t: v.astype(np.float32) for t, v in zip(texts, vectors)}
+
+    # Exact ground truth: brute-force cosine over the whole corpus
+    keys = [(name, c.content) for name, chunks in corpus.items() for c in chunks]
+    corpus_matrix = np.stack([lookup[content] for _, content in keys])
+    query_matrix = np.stack([lookup[q] for q in queries])
+    top = np.argsort(-(query_matrix @ corpus_matrix.T), axis=1)[:, :args.k]
+    truth = [{keys[j] for j in row} for row in top]
+
+    rows = [_run_backend(b, t, config, corpus, queries, lookup, truth, args.k) for b, t in BACKENDS]
+
+    print("=" * 78)
+    print(f"{len(keys)} chunks, {len(queries)} queries, k={args.k}")
+    print(f"{'Backend':<14} {'Build (s)':>10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'Recall@k':>10} {'ΔRSS (MB)':>11}")
+    print("-" * 78)
+    for row in rows:
+        if 'error' in row:
+            print(f"{row['backend']:<14} skipped: {row['error']}")
+            continue
+        print(f"{row['backend']:<14} {row['build_s']:>10.2f} {row['p50_ms']:>10.2f} {row['p95_ms']:>10.2f} "
+              f"{row['recall']:>10.3f} {row['rss_mb']:>11.1f}")
+    print("=" * 78)
+
+
+if __name__ == '__main__':
+    main()
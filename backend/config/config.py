@@ -19,23 +19,135 @@ class Config:
     EMBEDDING_MODEL = "all-MiniLM-L6-v2"
     LLM_MODEL = "llama-3.1-8b-instant"  # Groq model
     GEMINI_VISION_MODEL = "models/gemini-2.0-flash"  # Gemini Vision for image understanding
+    # Image analysis: descriptions cached by image content hash; misses analyzed concurrently
+    IMAGE_ANALYSIS_CONCURRENCY = int(os.getenv("IMAGE_ANALYSIS_CONCURRENCY", 4))
+    IMAGE_DESCRIPTION_CACHE_TTL = int(os.getenv("IMAGE_DESCRIPTION_CACHE_TTL", 2592000))  # 30 days
+    # Ingest-time image manifest (which pages have images) and background figure captioning
+    IMAGE_MANIFEST_PATH = os.getenv("IMAGE_MANIFEST_PATH", "./data/image_manifests")
+    IMAGE_MIN_SIDE = int(os.getenv("IMAGE_MIN_SIDE", 48))  # Smaller images (bullets, icons) aren't listed
+    IMAGE_CAPTION_ENABLED = os.getenv("IMAGE_CAPTION_ENABLED", "true").lower() == "true"
+    IMAGE_CAPTION_INTERVAL = float(os.getenv("IMAGE_CAPTION_INTERVAL", 4.0))  # Seconds between vision calls (all workers, with Redis)
 
     # Vector Database
+    VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")  # chroma | faiss | simple
     VECTOR_DB_PATH = "./data/chroma_db"
     COLLECTION_NAME = "pdf_documents"
 
+    # Vector index snapshots (point at persistent storage - VECTOR_DB_PATH is ephemeral on Render)
+    VECTOR_SNAPSHOT_PATH = os.getenv("VECTOR_SNAPSHOT_PATH", "./data/snapshots/chroma_snapshot.npz")
+    RESTORE_SNAPSHOT_ON_STARTUP = os.getenv("RESTORE_SNAPSHOT_ON_STARTUP", "true").lower() == "true"
+
+    # FAISS backend (VECTOR_STORE_BACKEND=faiss)
+    FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "hnsw")  # flat | ivf | hnsw
+    FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./data/faiss/pdf_documents.faiss")
+    FAISS_MMAP = os.getenv("FAISS_MMAP", "true").lower() == "true"  # Memory-map the index on load
+    FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", 100))
+    FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", 8))
+    FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", 32))
+    FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", 200))
+    FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", 64))
+
+    # Background index maintenance (HNSW tombstone compaction)
+    INDEX_MAINTENANCE_ENABLED = os.getenv("INDEX_MAINTENANCE_ENABLED", "true").lower() == "true"
+    INDEX_MAINTENANCE_INTERVAL = int(os.getenv("INDEX_MAINTENANCE_INTERVAL", 600))  # Seconds between checks
+    INDEX_COMPACTION_RATIO = float(os.getenv("INDEX_COMPACTION_RATIO", 0.2))  # Tombstones / (live + tombstones)
+    INDEX_COMPACTION_MIN_TOMBSTONES = int(os.getenv("INDEX_COMPACTION_MIN_TOMBSTONES", 500))
+    INDEX_COMPACTION_PAGE_DELAY = float(os.getenv("INDEX_COMPACTION_PAGE_DELAY", 0.05))  # Pause between pages
+
+    # Hybrid retrieval (BM25 + vectors, fused with reciprocal-rank fusion)
+    HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+    LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "./data/lexical_index")
+    HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))  # RRF damping constant
+    BM25_K1 = float(os.getenv("BM25_K1", 1.5))
+    BM25_B = float(os.getenv("BM25_B", 0.75))
+
+    # MMR diversification (overlapping chunks otherwise fill the top-k with near-copies)
+    MMR_ENABLED = os.getenv("MMR_ENABLED", "true").lower() == "true"
+    MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))  # 1.0 = relevance only, 0.0 = diversity only
+    MMR_POOL_FACTOR = int(os.getenv("MMR_POOL_FACTOR", 4))  # Candidates considered = TOP_K * factor
+
+    # Optional cross-encoder reranking (CPU) with a hard per-request time budget
+    RERANKER_ENABLED = os.getenv("RERANKER_ENABLED", "false").lower() == "true"
+    RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    RERANKER_MAX_CANDIDATES = int(os.getenv("RERANKER_MAX_CANDIDATES", 20))
+    RERANKER_TIME_BUDGET_MS = int(os.getenv("RERANKER_TIME_BUDGET_MS", 150))  # Fall back to vector order past this
+    RERANKER_CACHE_SIZE = int(os.getenv("RERANKER_CACHE_SIZE", 4096))  # (query hash, chunk ID) scores
+
+    # Query condensation (follow-up question + recent turns -> short standalone search query)
+    QUERY_CONDENSE_TURNS = int(os.getenv("QUERY_CONDENSE_TURNS", 2))  # Question/answer pairs considered
+    QUERY_CONDENSE_MAX_TERMS = int(os.getenv("QUERY_CONDENSE_MAX_TERMS", 6))  # Carried-over terms appended
+    QUERY_CONDENSE_LLM = os.getenv("QUERY_CONDENSE_LLM", "false").lower() == "true"  # LLM rewrite instead of extractive
+    QUERY_CONDENSE_MAX_TOKENS = int(os.getenv("QUERY_CONDENSE_MAX_TOKENS", 64))
+    QUERY_CONDENSE_CACHE_SIZE = int(os.getenv("QUERY_CONDENSE_CACHE_SIZE", 1024))  # (conversation hash, question)
+
+    # Retrieval cache: ranked chunk IDs per (user, documents, corpus version, condensed query)
+    RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+    RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", 86400))  # Safe to keep long: keys are corpus-versioned
+
+    # Semantic answer cache (near-duplicate questions reuse an answer; in-process LRU)
+    SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))  # Cosine similarity
+    SEMANTIC_CACHE_MIN_TERM_OVERLAP = float(os.getenv("SEMANTIC_CACHE_MIN_TERM_OVERLAP", 0.5))  # Content-term Jaccard
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 2048))
+    # Identical concurrent queries: the first computes, the rest wait for its answer (in-process + Redis lock)
+    SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+    SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", 60))  # Max wait; also the Redis lock TTL
+    SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", 0.25))  # Cross-worker lock polling
+    # Per-request stage spans as JSONL for offline latency analysis (one file per worker per day)
+    SPAN_LOG_ENABLED = os.getenv("SPAN_LOG_ENABLED", "true").lower() == "true"
+    SPAN_LOG_PATH = os.getenv("SPAN_LOG_PATH", "./data/spans")
+    SPAN_LOG_SAMPLE_RATE = float(os.getenv("SPAN_LOG_SAMPLE_RATE", 1.0))  # Fraction of requests logged
+
+    # LLM provider routing: fastest healthy provider first, 429 cooldowns and circuit breakers (shared via Redis)
+    PROVIDER_ROUTING_ENABLED = os.getenv("PROVIDER_ROUTING_ENABLED", "true").lower() == "true"  # false = fixed order
+    PROVIDER_EWMA_ALPHA = float(os.getenv("PROVIDER_EWMA_ALPHA", 0.2))  # Weight of the newest latency/error sample
+    PROVIDER_LATENCY_PRIOR_MS = float(os.getenv("PROVIDER_LATENCY_PRIOR_MS", 2000))  # Assumed for unmeasured providers
+    PROVIDER_BREAKER_FAILURES = int(os.getenv("PROVIDER_BREAKER_FAILURES", 3))  # Consecutive failures that trip
+    PROVIDER_BREAKER_ERROR_RATE = float(os.getenv("PROVIDER_BREAKER_ERROR_RATE", 0.5))  # EWMA error rate that trips
+    PROVIDER_BREAKER_OPEN_SECONDS = float(os.getenv("PROVIDER_BREAKER_OPEN_SECONDS", 30))  # Before a probe request
+    PROVIDER_RATE_LIMIT_COOLDOWN = float(os.getenv("PROVIDER_RATE_LIMIT_COOLDOWN", 20))  # 429 without Retry-After
+    PROVIDER_HEALTH_SYNC_SECONDS = float(os.getenv("PROVIDER_HEALTH_SYNC_SECONDS", 2))  # Redis refresh interval
+    # Hedged requests: no first token by the provider's p95 -> also ask the next provider, first token wins
+    LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+    LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", 0.95))  # Of recent time-to-first-token samples
+    LLM_HEDGE_DELAY_FACTOR = float(os.getenv("LLM_HEDGE_DELAY_FACTOR", 1.0))
+    LLM_HEDGE_MIN_DELAY_MS = float(os.getenv("LLM_HEDGE_MIN_DELAY_MS", 300))
+    LLM_HEDGE_MAX_DELAY_MS = float(os.getenv("LLM_HEDGE_MAX_DELAY_MS", 8000))
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))  # Below this, PROVIDER_LATENCY_PRIOR_MS
+    LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", 0.05))  # Max hedges per request (token bucket)
+    LLM_HEDGE_BUDGET_BURST = float(os.getenv("LLM_HEDGE_BUDGET_BURST", 2))
+    # Note: hedged non-streaming answers are streamed internally and report tokens_used=0
+
+    # Prompt context packing (token counts from the answering model's tokenizer; overlapping chunk text removed)
+    CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", 4000))  # Leaves room for system prompt, query and answer
+    CONTEXT_MIN_PARTIAL_TOKENS = int(os.getenv("CONTEXT_MIN_PARTIAL_TOKENS", 100))  # Smallest truncated chunk kept
+    CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "Xenova/Meta-Llama-3.1-Tokenizer")  # Hugging Face tokenizer
+
     # PDF Processing
     CHUNK_SIZE = 1000
     CHUNK_OVERLAP = 200
+
+    # Small-to-big retrieval: embed small chunks, give the LLM each hit's neighbouring window
+    SMALL_TO_BIG_ENABLED = os.getenv("SMALL_TO_BIG_ENABLED", "true").lower() == "true"
+    SMALL_CHUNK_SIZE = int(os.getenv("SMALL_CHUNK_SIZE", 150))  # Words; fits MiniLM's 256-token window
+    SMALL_CHUNK_OVERLAP = int(os.getenv("SMALL_CHUNK_OVERLAP", 0))  # Neighbours supply the context instead
+    CHUNK_WINDOW_RADIUS = int(os.getenv("CHUNK_WINDOW_RADIUS", 1))  # Neighbours added on each side of a hit
+    CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", "./data/chunk_store")
     MAX_IMAGE_SIZE = (800, 600)
 
     # Retrieval
     TOP_K_RESULTS = 5
-    SIMILARITY_THRESHOLD = 0.7
+    # Cosine floor for context chunks; MiniLM question/passage matches mostly score 0.3-0.6
+    SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", 0.3))
+    CONTEXT_SELECTION_ENABLED = os.getenv("CONTEXT_SELECTION_ENABLED", "true").lower() == "true"
+    CONTEXT_MIN_RESULTS = int(os.getenv("CONTEXT_MIN_RESULTS", 2))  # Always sent, even below the floor
+    CONTEXT_ELBOW_MIN_GAP = float(os.getenv("CONTEXT_ELBOW_MIN_GAP", 0.1))  # Score drop that counts as an elbow
 
     # Paths
     PDF_UPLOAD_DIR = "./data/pdfs"
     UPLOAD_FOLDER = "./data/pdfs"  # Alias for PDF_UPLOAD_DIR (used by image extraction)
+    # (user, document) -> content-addressed PDF under UPLOAD_FOLDER/objects
+    DOCUMENT_REGISTRY_PATH = os.getenv("DOCUMENT_REGISTRY_PATH", "./data/document_registry")
     PROCESSED_DATA_DIR = "./data/processed"
 
     # Redis Configuration (Dual Support: Upstash + Local)
@@ -50,10 +162,14 @@ class Config:
     REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", None)
 
     # Cache Settings
-    QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", 3600))  # 1 hour
+    QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", 86400))  # 24 hours; uploads/deletes invalidate via corpus version
     SESSION_TTL = int(os.getenv("SESSION_TTL", 86400))  # 24 hours
     RATE_LIMIT_MAX = int(os.getenv("RATE_LIMIT_MAX", 100))  # requests per window
     RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", 3600))  # 1 hour
 
     # TTS (Text-to-Speech) Settings
     TTS_SPEED_MULTIPLIER = float(os.getenv("TTS_SPEED_MULTIPLIER", 1.25))  # 1.0 = normal, 1.25 = 25% faster, 1.5 = 50% faster
+    # Sentence-pipelined TTS for /ask/stream (stream_audio): speak each sentence as soon as it's generated
+    TTS_PIPELINE_WORKERS = int(os.getenv("TTS_PIPELINE_WORKERS", 2))  # Sentences synthesized concurrently
+    TTS_SENTENCE_MIN_CHARS = int(os.getenv("TTS_SENTENCE_MIN_CHARS", 24))  # Shorter sentences merge with the next
+    TTS_SENTENCE_MAX_CHARS = int(os.getenv("TTS_SENTENCE_MAX_CHARS", 250))  # Cut at a comma/space past this
@@ -6,13 +6,29 @@ Replaces the simple in-memory hash-based store with proper embeddings.
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
+from contextlib import contextmanager
+from .vector_store import empty_results, QueryActivity, QueryEmbeddingCache
+import numpy as np
+import hashlib
+import json
 import logging
 import os
+import threading
+import time
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
 
 
 class ChromaVectorStore:
-    """Persistent vector store using ChromaDB with sentence-transformers"""
+    """Persistent vector store using ChromaDB with sentence-transformers (implements VectorStore)"""
+
+    # Max IDs per delete call (keeps SQLite parameter lists and HNSW updates bounded)
+    DELETE_BATCH_SIZE = 500
 
     def __init__(self, config):
         self.config = config
@@ -22,10 +38,21 @@ class ChromaVectorStore:
         self.logger.info(f"Loading embedding model: {config.EMBEDDING_MODEL}")
         self.embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
 
+        # Writes are serialized (across every worker sharing VECTOR_DB_PATH, via flock)
+        # so a background compaction can swap collections atomically
+        self._write_lock = threading.RLock()
+        self._write_lock_file = None  # Open flock file while this process holds the write lock
+        self.query_activity = QueryActivity()
+        self._query_embeddings = QueryEmbeddingCache()
+
         # Create persistent ChromaDB client
         db_path = config.VECTOR_DB_PATH
         os.makedirs(db_path, exist_ok=True)
-
+        self._write_lock_path = os.path.join(db_path, 'write.lock')
+        self._compaction_lock_path = os.path.join(db_path, 'compaction.lock')
+        # Exists while a compaction copy runs; every worker appends its writes to it
+        self._journal_path = os.path.join(db_path, 'compaction_journal.jsonl')
+        self._maintenance_state_path = os.path.join(db_path, 'index_maintenance.json')
         self.logger.info(f"Initializing ChromaDB at: {db_path}")
         self.client = chromadb.PersistentClient(
             path=db_path,
@@ -35,18 +62,29 @@ class ChromaVectorStore:
             )
         )
 
-        # Get or create collection
+        # Get or create collection (under the write lock, so a swap in another worker is never half seen)
         try:
-            self.collection = self.client.get_or_create_collection(
-                name=config.COLLECTION_NAME,
-                metadata={"hnsw:space": "cosine"}
-            )
+            with self._writing():
+                self._recover_compaction()
+                self.collection = self.client.get_or_create_collection(
+                    name=config.COLLECTION_NAME,
+                    metadata={"hnsw:space": "cosine"}
+                )
             self.logger.info(f"✅ ChromaDB collection '{config.COLLECTION_NAME}' ready")
             self.logger.info(f"📊 Collection has {self.collection.count()} documents")
         except Exception as e:
             self.logger.error(f"Failed to create collection: {e}")
             raise
 
+        # Warm start: an empty collection after a redeploy is refilled from the last snapshot
+        # before this store (and therefore the RAG system) is reported ready
+        snapshot_path = getattr(config, 'VECTOR_SNAPSHOT_PATH', None)
+        if (getattr(config, 'RESTORE_SNAPSHOT_ON_STARTUP', False) and snapshot_path
+                and self.collection.count() == 0 and os.path.exists(snapshot_path)):
+            result = self.restore_snapshot(snapshot_path)
+            if not result['success']:
+                self.logger.warning(f"Snapshot restore skipped: {result.get('error')}")
+
     def _generate_embeddings(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
         """Generate embeddings using sentence-transformers with batching for performance"""
         try:
@@ -85,6 +123,9 @@ class ChromaVectorStore:
                     'chunk_type': getattr(chunk, 'chunk_type', 'text'),
                     'page_number': int(page_num) if page_num else 1
                 }
+                chunk_index = (getattr(chunk, 'metadata', None) or {}).get('chunk_index')
+                if chunk_index is not None:
+                    metadata['chunk_index'] = int(chunk_index)  # Small-to-big window lookups
                 # Add user_id to metadata for filtering
                 if user_id:
                     metadata['user_id'] = user_id
@@ -100,16 +141,19 @@ class ChromaVectorStore:
             CHROMA_BATCH_SIZE = 1000
             total_added = 0
 
-            for i in range(0, len(texts), CHROMA_BATCH_SIZE):
-                batch_end = min(i + CHROMA_BATCH_SIZE, len(texts))
-                self.collection.add(
-                    embeddings=embeddings[i:batch_end],
-                    documents=texts[i:batch_end],
-                    metadatas=metadatas[i:batch_end],
-                    ids=ids[i:batch_end]
-                )
-                total_added += (batch_end - i)
-                self.logger.info(f"  Added batch: {total_added}/{len(texts)} chunks")
+            with self._writing():
+                self._refresh_if_swapped()
+                for i in range(0, len(texts), CHROMA_BATCH_SIZE):
+                    batch_end = min(i + CHROMA_BATCH_SIZE, len(texts))
+                    self.collection.add(
+                        embeddings=embeddings[i:batch_end],
+                        documents=texts[i:batch_end],
+                        metadatas=metadatas[i:batch_end],
+                        ids=ids[i:batch_end]
+                    )
+                    total_added += (batch_end - i)
+                    self.logger.info(f"  Added batch: {total_added}/{len(texts)} chunks")
+                self._journal_write('add', ids)
 
             self.logger.info(f"✅ Added {len(chunks)} chunks from '{document_name}'")
             self.logger.info(f"📊 Collection now has {self.collection.count()} total documents")
@@ -120,42 +164,18 @@ class ChromaVectorStore:
             self.logger.error(f"Failed to add documents: {e}")
             return {'success': False, 'error': str(e)}
 
-    def search(self, query: str, n_results: int = 5, document_filter: str = None, user_id: str = None) -> Dict[str, Any]:
-        """Search for relevant documents using semantic similarity with optional user filtering"""
+    def search(self, query: str, n_results: int = 5, document_filter: str = None, user_id: str = None,
+               filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Search for relevant documents using semantic similarity with optional user/metadata filtering"""
         try:
-            # Check if collection is empty
-            if self.collection.count() == 0:
-                self.logger.warning("Collection is empty, no results to return")
-                return {
-                    'documents': [[]],
-                    'metadatas': [[]],
-                    'distances': [[]]
-                }
-
-            # Generate query embedding
-            query_embedding = self._generate_embeddings([query])[0]
-
-            # Build filter with user_id and optional document name
-            where_filter = None
+            # Generate query embedding (reused across filtered passes over the same query)
+            query_embedding = self._embed_queries([query])[0]
 
-            if user_id and document_filter:
-                # Use $and operator for multiple conditions
-                where_filter = {
-                    "$and": [
-                        {"user_id": user_id},
-                        {"document_name": document_filter}
-                    ]
-                }
-                self.logger.info(f"Filtering search to user: {user_id} AND document: {document_filter}")
-            elif user_id:
-                where_filter = {"user_id": user_id}
-                self.logger.info(f"Filtering search to user: {user_id}")
-            elif document_filter:
-                where_filter = {"document_name": document_filter}
-                self.logger.info(f"Filtering search to document: {document_filter}")
+            # Build filter with user_id, optional document name and structured filters
+            where_filter = self._build_where(user_id, document_filter, filters)
 
             # Search ChromaDB
-            results = self.collection.query(
+            results = self._query(
                 query_embeddings=[query_embedding],
                 n_results=n_results,
                 where=where_filter
@@ -167,11 +187,104 @@ class ChromaVectorStore:
 
         except Exception as e:
             self.logger.error(f"Search failed: {e}")
-            return {
-                'documents': [[]],
-                'metadatas': [[]],
-                'distances': [[]]
-            }
+            return empty_results()
+
+    def search_many(self, queries: List[str], n_results: int = 5, document_filter: str = None,
+                    user_id: str = None, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Search several queries with one batched embedding call and one Chroma query"""
+        if not queries:
+            return []
+
+        try:
+            query_embeddings = self._embed_queries(queries)
+            results = self._query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=self._build_where(user_id, document_filter, filters)
+            )
+
+            # Split Chroma's per-query lists into one nested result per query
+            return [
+                {
+                    'ids': [results['ids'][i]],
+                    'documents': [results['documents'][i]],
+                    'metadatas': [results['metadatas'][i]],
+                    'distances': [results['distances'][i]]
+                }
+                for i in range(len(queries))
+            ]
+
+        except Exception as e:
+            self.logger.error(f"Batched search failed: {e}")
+            return [empty_results() for _ in queries]
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        return self._query_embeddings.embed(queries, self._generate_embeddings)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Normalised query embeddings, cached like the ones search() uses"""
+        return np.asarray(self._embed_queries(queries), dtype=np.float32).reshape(len(queries), -1)
+
+    def _query(self, **kwargs) -> Dict[str, Any]:
+        """
+        Run a collection query, counted as interactive activity for the index maintainer
+
+        An empty collection yields empty result lists, so callers don't count() first
+        (that would be a second round trip outside the swap retry).
+        """
+        with self.query_activity.track():
+            try:
+                return self.collection.query(**kwargs)
+            except Exception:
+                # Another worker may have compacted and swapped in a new collection
+                if not self._refresh_if_swapped():
+                    raise
+                return self.collection.query(**kwargs)
+
+    def _refresh_if_swapped(self) -> bool:
+        """Re-resolve the collection by name if a compaction replaced it; True when refreshed"""
+        try:
+            current = self.client.get_collection(self.config.COLLECTION_NAME)
+        except Exception:
+            return False
+        if current.id == self.collection.id:
+            return False
+        self.collection = current
+        self.logger.info("🔧 Collection was compacted by another worker, switched to the new one")
+        return True
+
+    def _build_where(self, user_id: str = None, document_filter: str = None,
+                     filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Build a Chroma where clause for user/document scoping and structured filters"""
+        conditions = []
+        if user_id:
+            conditions.append({"user_id": user_id})
+        if document_filter:
+            conditions.append({"document_name": document_filter})
+
+        filters = filters or {}
+        documents = filters.get('documents')
+        if documents:
+            conditions.append({"document_name": {"$in": list(documents)}})
+        chunk_types = filters.get('chunk_types')
+        if chunk_types:
+            conditions.append({"chunk_type": {"$in": list(chunk_types)}})
+        page_range = filters.get('page_range')
+        if page_range:
+            low, high = page_range
+            if low is not None:
+                conditions.append({"page_number": {"$gte": int(low)}})
+            if high is not None:
+                conditions.append({"page_number": {"$lte": int(high)}})
+        pages = filters.get('pages')
+        if pages:
+            conditions.append({"page_number": {"$in": [int(page) for page in pages]}})
+
+        if not conditions:
+            return None
+        self.logger.info(f"Filtering search with: {conditions}")
+        # Use $and operator for multiple conditions
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
 
     def delete_document(self, document_name: str, user_id: str = None) -> Dict[str, Any]:
         """Delete all chunks from a specific document, optionally filtered by user"""
@@ -190,23 +303,139 @@ class ChromaVectorStore:
             else:
                 where_filter = {"document_name": document_name}
 
-            # Get all IDs for this document
-            results = self.collection.get(where=where_filter)
+            with self._writing():
+                # Fetch IDs only (include=[]) - no documents, metadata or embeddings are materialized
+                self._refresh_if_swapped()
+                ids = self.collection.get(where=where_filter, include=[])['ids']
 
-            if not results['ids']:
-                self.logger.warning(f"No chunks found for document: {document_name}")
-                return {'success': False, 'message': 'Document not found'}
+                if not ids:
+                    self.logger.warning(f"No chunks found for document: {document_name}")
+                    return {'success': False, 'message': 'Document not found'}
 
-            # Delete the chunks
-            self.collection.delete(ids=results['ids'])
+                # Delete the chunks in bounded batches
+                for i in range(0, len(ids), self.DELETE_BATCH_SIZE):
+                    self.collection.delete(ids=ids[i:i + self.DELETE_BATCH_SIZE])
+                self._record_deletes(ids)
 
-            self.logger.info(f"✅ Deleted {len(results['ids'])} chunks from '{document_name}'")
-            return {'success': True, 'deleted_count': len(results['ids'])}
+            self.logger.info(f"✅ Deleted {len(ids)} chunks from '{document_name}'")
+            return {'success': True, 'deleted_count': len(ids)}
 
         except Exception as e:
             self.logger.error(f"Failed to delete document: {e}")
             return {'success': False, 'error': str(e)}
 
+    def delete_user_vectors(self, user_id: str, batch_size: int = None,
+                            progress_callback: Callable[[int], None] = None) -> Dict[str, Any]:
+        """
+        Delete every chunk owned by a user in batches
+
+        Only IDs are fetched per batch, so memory stays flat regardless of how
+        many documents the user uploaded.
+
+        Args:
+            user_id: Owner of the chunks to delete
+            batch_size: IDs fetched and deleted per round trip
+            progress_callback: Called with the running deleted count after each batch
+
+        Returns:
+            Dict with 'success' and 'deleted_count'
+        """
+        if not user_id:
+            return {'success': False, 'error': 'user_id is required'}
+
+        batch_size = batch_size or self.DELETE_BATCH_SIZE
+        deleted = 0
+
+        try:
+            while True:
+                with self._writing():
+                    self._refresh_if_swapped()
+                    ids = self.collection.get(
+                        where={"user_id": user_id},
+                        include=[],
+                        limit=batch_size
+                    )['ids']
+                    if not ids:
+                        break
+
+                    self.collection.delete(ids=ids)
+                    self._record_deletes(ids)
+                deleted += len(ids)
+                if progress_callback:
+                    progress_callback(deleted)
+
+            self.logger.info(f"✅ Deleted {deleted} chunks for user {user_id}")
+            return {'success': True, 'deleted_count': deleted}
+
+        except Exception as e:
+            self.logger.error(f"Failed to delete vectors for user {user_id}: {e}")
+            return {'success': False, 'error': str(e), 'deleted_count': deleted}
+
+    def document_has_other_owners(self, document_name: str, user_id: str) -> bool:
+        """Check whether any other user still has chunks for a document name"""
+        try:
+            ids = self.collection.get(
+                where={
+                    "$and": [
+                        {"document_name": document_name},
+                        {"user_id": {"$ne": user_id}}
+                    ]
+                },
+                include=[],
+                limit=1
+            )['ids']
+            return bool(ids)
+        except Exception as e:
+            self.logger.error(f"Failed to check document owners: {e}")
+            # Err on the side of keeping shared files
+            return True
+
+    def get_document_owners(self) -> Dict[str, List[Optional[str]]]:
+        """Document name -> user IDs holding chunks for it"""
+        owners: Dict[str, set] = {}
+        for metadata in self.collection.get(include=['metadatas'])['metadatas'] or []:
+            owners.setdefault(metadata.get('document_name', 'unknown'), set()).add(metadata.get('user_id'))
+        return {name: list(users) for name, users in owners.items()}
+
+    def get_embeddings(self, ids: List[str]) -> np.ndarray:
+        """Stored embeddings for chunk IDs, aligned with ids (zero rows for unknown IDs)"""
+        with self.query_activity.track():
+            found = self.collection.get(ids=list(dict.fromkeys(ids)), include=['embeddings'])
+        # Chroma doesn't guarantee result order, so align by ID
+        by_id = dict(zip(found['ids'], found['embeddings']))
+        dim = len(found['embeddings'][0]) if found['ids'] else 0
+        matrix = np.zeros((len(ids), dim), dtype=np.float32)
+        for row, chunk_id in enumerate(ids):
+            if chunk_id in by_id:
+                matrix[row] = by_id[chunk_id]
+        return matrix
+
+    def get_chunks(self, ids: List[str]) -> Dict[str, List]:
+        """Text and metadata for chunk IDs, aligned with ids (None for unknown IDs)"""
+        with self.query_activity.track():
+            found = self.collection.get(ids=list(dict.fromkeys(ids)), include=['documents', 'metadatas'])
+        by_id = {chunk_id: (doc, meta) for chunk_id, doc, meta in
+                 zip(found['ids'], found['documents'], found['metadatas'])}
+        rows = [by_id.get(chunk_id, (None, None)) for chunk_id in ids]
+        return {'documents': [doc for doc, _ in rows], 'metadatas': [meta for _, meta in rows]}
+
+    def get_user_chunks(self, user_id: str) -> Dict[str, List]:
+        """All of a user's chunks (text and metadata only), read in pages"""
+        chunks = {'ids': [], 'documents': [], 'metadatas': []}
+        offset = 0
+        while True:
+            page = self.collection.get(
+                where={"user_id": user_id},
+                include=['documents', 'metadatas'],
+                limit=self.SNAPSHOT_PAGE_SIZE,
+                offset=offset
+            )
+            if not page['ids']:
+                return chunks
+            for key in chunks:
+                chunks[key].extend(page[key])
+            offset += len(page['ids'])
+
     def clear_all(self) -> Dict[str, Any]:
         """Clear all documents from the collection"""
         try:
@@ -214,11 +443,14 @@ class ChromaVectorStore:
             self.logger.info(f"Clearing all {count} documents from collection")
 
             # Delete the collection and recreate it
-            self.client.delete_collection(self.config.COLLECTION_NAME)
-            self.collection = self.client.create_collection(
-                name=self.config.COLLECTION_NAME,
-                metadata={"hnsw:space": "cosine"}
-            )
+            with self._writing():
+                self.client.delete_collection(self.config.COLLECTION_NAME)
+                self.collection = self.client.create_collection(
+                    name=self.config.COLLECTION_NAME,
+                    metadata={"hnsw:space": "cosine"}
+                )
+                self._journal_write('clear')
+                self._save_maintenance_state(deleted_since_compaction=0, baseline_bytes_per_vector=None)
 
             self.logger.info("✅ Collection cleared")
             return {'success': True, 'deleted_count': count}
@@ -227,6 +459,425 @@ class ChromaVectorStore:
             self.logger.error(f"Failed to clear collection: {e}")
             return {'success': False, 'error': str(e)}
 
+    # ========== Snapshot / Restore ==========
+
+    # Rows read from / written to Chroma per call while snapshotting or restoring
+    SNAPSHOT_PAGE_SIZE = 1000
+
+    def snapshot(self, path: str = None) -> Dict[str, Any]:
+        """
+        Write the collection to a compressed, checksummed archive
+
+        The archive (.npz) holds IDs, float32 embeddings, metadata and documents.
+        A JSON manifest next to it records the SHA-256 of the archive, row count,
+        embedding dimension and model so restores can be verified.
+
+        Args:
+            path: Archive path (defaults to config.VECTOR_SNAPSHOT_PATH)
+
+        Returns:
+            Dict with 'success', 'path', 'count', 'bytes', 'elapsed_s'
+        """
+        path = path or self.config.VECTOR_SNAPSHOT_PATH
+        started = time.time()
+
+        try:
+            ids, embeddings, metadatas, documents = [], [], [], []
+            offset = 0
+            while True:
+                page = self.collection.get(
+                    include=['embeddings', 'metadatas', 'documents'],
+                    limit=self.SNAPSHOT_PAGE_SIZE,
+                    offset=offset
+                )
+                if not page['ids']:
+                    break
+                ids.extend(page['ids'])
+                embeddings.extend(page['embeddings'])
+                metadatas.extend(page['metadatas'])
+                documents.extend(page['documents'])
+                offset += len(page['ids'])
+
+            embedding_matrix = np.asarray(embeddings, dtype=np.float32)
+            if embedding_matrix.ndim != 2:
+                embedding_matrix = embedding_matrix.reshape(0, 0)
+
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(
+                    f,
+                    ids=np.asarray(ids, dtype=str),
+                    embeddings=embedding_matrix,
+                    metadatas=np.frombuffer(json.dumps(metadatas).encode('utf-8'), dtype=np.uint8),
+                    documents=np.frombuffer(json.dumps(documents).encode('utf-8'), dtype=np.uint8)
+                )
+
+            manifest = {
+                'sha256': self._file_sha256(tmp_path),
+                'count': len(ids),
+                'dim': int(embedding_matrix.shape[1]) if len(ids) else 0,
+                'embedding_model': self.config.EMBEDDING_MODEL,
+                'collection_name': self.config.COLLECTION_NAME,
+                'created_at': time.time()
+            }
+
+            # Publish atomically: archive first, then the manifest that vouches for it
+            os.replace(tmp_path, path)
+            with open(f"{path}.tmp.json", 'w') as f:
+                json.dump(manifest, f)
+            os.replace(f"{path}.tmp.json", self._manifest_path(path))
+
+            elapsed = time.time() - started
+            size = os.path.getsize(path)
+            self.logger.info(f"✅ Snapshot of {len(ids)} chunks written to {path} "
+                             f"({size / 1024 / 1024:.1f}MB in {elapsed:.2f}s)")
+            return {'success': True, 'path': path, 'count': len(ids), 'bytes': size,
+                    'elapsed_s': round(elapsed, 3)}
+
+        except Exception as e:
+            self.logger.error(f"Failed to write snapshot: {e}")
+            return {'success': False, 'error': str(e)}
+
+    def restore_snapshot(self, path: str = None, replace: bool = False) -> Dict[str, Any]:
+        """
+        Load a snapshot archive into the collection without re-embedding
+
+        Args:
+            path: Archive path (defaults to config.VECTOR_SNAPSHOT_PATH)
+            replace: Clear the collection first; otherwise rows are upserted
+
+        Returns:
+            Dict with 'success', 'count', 'elapsed_s'
+        """
+        path = path or self.config.VECTOR_SNAPSHOT_PATH
+        started = time.time()
+
+        try:
+            manifest_path = self._manifest_path(path)
+            if not os.path.exists(path) or not os.path.exists(manifest_path):
+                return {'success': False, 'error': f'Snapshot not found: {path}'}
+
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+            if self._file_sha256(path) != manifest['sha256']:
+                return {'success': False, 'error': 'Snapshot checksum mismatch'}
+
+            if manifest['embedding_model'] != self.config.EMBEDDING_MODEL:
+                return {'success': False,
+                        'error': f"Snapshot was built with {manifest['embedding_model']}, "
+                                 f"current model is {self.config.EMBEDDING_MODEL}"}
+
+            with np.load(path, allow_pickle=False) as archive:
+                ids = archive['ids'].tolist()
+                embeddings = archive['embeddings']
+                metadatas = json.loads(archive['metadatas'].tobytes().decode('utf-8'))
+                documents = json.loads(archive['documents'].tobytes().decode('utf-8'))
+
+            if replace:
+                self.clear_all()
+
+            with self._writing():
+                self._refresh_if_swapped()
+                for i in range(0, len(ids), self.SNAPSHOT_PAGE_SIZE):
+                    end = i + self.SNAPSHOT_PAGE_SIZE
+                    self.collection.upsert(
+                        ids=ids[i:end],
+                        embeddings=embeddings[i:end].tolist(),
+                        metadatas=metadatas[i:end],
+                        documents=documents[i:end]
+                    )
+                self._journal_write('add', ids)
+
+            elapsed = time.time() - started
+            self.logger.info(f"✅ Restored {len(ids)} chunks from {path} in {elapsed:.2f}s")
+            return {'success': True, 'count': len(ids), 'elapsed_s': round(elapsed, 3)}
+
+        except Exception as e:
+            self.logger.error(f"Failed to restore snapshot: {e}")
+            return {'success': False, 'error': str(e)}
+
+    @staticmethod
+    def _manifest_path(path: str) -> str:
+        return f"{path}.manifest.json"
+
+    @staticmethod
+    def _file_sha256(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # ========== Index Maintenance ==========
+
+    # Rows copied per page while rebuilding the collection
+    COMPACTION_PAGE_SIZE = 500
+
+    @contextmanager
+    def _writing(self):
+        """Write lock shared by every worker on VECTOR_DB_PATH; re-entrant within a thread"""
+        with self._write_lock:
+            if self._write_lock_file is not None:
+                yield
+                return
+            with open(self._write_lock_path, 'a') as f:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                self._write_lock_file = f
+                try:
+                    yield
+                finally:
+                    self._write_lock_file = None
+                    if FCNTL_AVAILABLE:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _try_compaction_lock(self):
+        """Open compaction.lock under a non-blocking flock; None if a compaction in any worker holds it"""
+        f = open(self._compaction_lock_path, 'a')
+        if FCNTL_AVAILABLE:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return None
+        return f
+
+    def _get_collection_or_none(self, name: str):
+        try:
+            return self.client.get_collection(name)
+        except Exception:
+            return None
+
+    def _recover_compaction(self):
+        """
+        Clean up after a compaction that died (caller holds the write lock)
+
+        The live collection is renamed to "__old" before the "__compact" copy
+        takes its name, and "__old" is deleted last, so whichever step was
+        interrupted, one complete collection is left to restore. A leftover
+        journal is dropped too; otherwise every write would be appended to it.
+        """
+        lock_file = self._try_compaction_lock()
+        if lock_file is None:
+            return  # A compaction is running in another worker
+        try:
+            name = self.config.COLLECTION_NAME
+            old = self._get_collection_or_none(f"{name}__old")
+            scratch = self._get_collection_or_none(f"{name}__compact")
+            if self._get_collection_or_none(name) is None:
+                if old is not None:
+                    old.modify(name=name)
+                    old = None
+                    self.logger.warning(f"🔧 Restored collection '{name}' after an interrupted compaction")
+                elif scratch is not None:
+                    scratch.modify(name=name)
+                    scratch = None
+                    self.logger.warning(f"🔧 Recovered collection '{name}' from an interrupted compaction copy")
+            for leftover in (old, scratch):
+                if leftover is not None:
+                    self.client.delete_collection(leftover.name)
+            try:
+                os.remove(self._journal_path)
+            except FileNotFoundError:
+                pass
+        except Exception as e:
+            self.logger.error(f"Compaction recovery failed: {e}")
+        finally:
+            lock_file.close()
+
+    def _journal_write(self, op: str, ids: List[str] = ()):
+        """Append a write to the compaction journal while one is running (caller holds the write lock)"""
+        if not os.path.exists(self._journal_path):
+            return
+        with open(self._journal_path, 'a') as f:
+            f.write(json.dumps({'op': op, 'ids': list(ids)}) + '\n')
+
+    def _read_journal(self) -> Optional[Dict[str, str]]:
+        """Last journaled write ('add'/'delete') per ID, or None if the collection was cleared"""
+        last = {}
+        with open(self._journal_path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['op'] == 'clear':
+                    return None
+                for chunk_id in entry['ids']:
+                    last[chunk_id] = entry['op']
+        return last
+
+    def _load_maintenance_state(self) -> Dict[str, Any]:
+        state = {'deleted_since_compaction': 0, 'last_compacted_at': None, 'baseline_bytes_per_vector': None}
+        try:
+            with open(self._maintenance_state_path) as f:
+                state.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable maintenance state: {e}")
+        return state
+
+    def _save_maintenance_state(self, **fields):
+        """Merge fields into the state file shared by all workers (caller holds the write lock)"""
+        state = self._load_maintenance_state()
+        state.update(fields)
+        tmp_path = f"{self._maintenance_state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._maintenance_state_path)
+
+    def _record_deletes(self, ids: List[str]):
+        """Chroma's HNSW segment only marks deleted labels; count them as tombstones until compaction"""
+        self._journal_write('delete', ids)
+        tombstones = self._load_maintenance_state()['deleted_since_compaction']
+        self._save_maintenance_state(deleted_since_compaction=tombstones + len(ids))
+
+    def _index_bytes(self) -> int:
+        """Bytes used by HNSW segment directories (excludes the SQLite metadata DB)"""
+        total = 0
+        for entry in os.scandir(self.config.VECTOR_DB_PATH):
+            if entry.is_dir():
+                for root, _, files in os.walk(entry.path):
+                    total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return total
+
+    def get_index_metrics(self) -> Dict[str, Any]:
+        """
+        Index size and fragmentation metrics
+
+        Tombstones are deletes since the last compaction; Chroma keeps their
+        graph nodes until the collection is rebuilt.
+
+        Returns:
+            Dict with live/tombstone counts, tombstone_ratio, index bytes and
+            bytes-per-vector growth since the last compaction
+        """
+        self._refresh_if_swapped()
+        live = self.collection.count()
+        state = self._load_maintenance_state()  # Counts deletes from every worker
+        tombstones = state['deleted_since_compaction']
+        index_bytes = self._index_bytes()
+        bytes_per_vector = index_bytes / live if live else 0.0
+        baseline = state.get('baseline_bytes_per_vector')
+
+        return {
+            'backend': 'chroma',
+            'live_vectors': live,
+            'tombstones': tombstones,
+            'tombstone_ratio': round(tombstones / (live + tombstones), 4) if live + tombstones else 0.0,
+            'index_bytes': index_bytes,
+            'bytes_per_vector': round(bytes_per_vector, 1),
+            'bloat_since_compaction': round(bytes_per_vector / baseline, 3) if baseline and live else None,
+            'last_compacted_at': state.get('last_compacted_at'),
+            'compacting': os.path.exists(self._journal_path)
+        }
+
+    def compact(self, throttle: Callable[[], None] = None) -> Dict[str, Any]:
+        """
+        Rebuild the collection from live rows and swap it in
+
+        Rows are copied into a scratch collection page by page while the old
+        collection keeps serving. Writes made during the copy, by any worker,
+        are appended to a journal file and replayed in order under the write
+        lock just before the swap. One compaction runs at a time across workers.
+
+        Args:
+            throttle: Called before each page; blocks to yield to interactive queries
+
+        Returns:
+            Dict with 'success', 'copied', 'replayed', 'elapsed_s'
+        """
+        lock_file = self._try_compaction_lock()
+        if lock_file is None:
+            return {'success': False, 'error': 'Compaction already running'}
+
+        name = self.config.COLLECTION_NAME
+        scratch_name = f"{name}__compact"
+        old_name = f"{name}__old"
+        started = time.time()
+
+        try:
+            try:
+                self.client.delete_collection(scratch_name)
+            except Exception:
+                pass
+            scratch = self.client.create_collection(name=scratch_name, metadata={"hnsw:space": "cosine"})
+
+            with self._writing():
+                self._refresh_if_swapped()
+                source = self.collection
+                open(self._journal_path, 'w').close()  # Every worker's writes are journaled from here on
+                # Copy by ID so concurrent deletes can't shift offsets and skip rows
+                ids = source.get(include=[])['ids']
+
+            copied = 0
+            for i in range(0, len(ids), self.COMPACTION_PAGE_SIZE):
+                if throttle:
+                    throttle()
+                page = source.get(ids=ids[i:i + self.COMPACTION_PAGE_SIZE],
+                                  include=['embeddings', 'metadatas', 'documents'])
+                if page['ids']:
+                    scratch.add(ids=page['ids'], embeddings=page['embeddings'],
+                                metadatas=page['metadatas'], documents=page['documents'])
+                    copied += len(page['ids'])
+
+            with self._writing():
+                journal = self._read_journal()
+                os.remove(self._journal_path)
+                self._refresh_if_swapped()
+                if journal is None or self.collection.id != source.id:
+                    self.client.delete_collection(scratch_name)
+                    return {'success': False, 'error': 'Collection was replaced during compaction'}
+
+                # Replay writes that landed in the old collection during the copy; the last one per ID wins
+                deleted = [chunk_id for chunk_id, op in journal.items() if op == 'delete']
+                for i in range(0, len(deleted), self.DELETE_BATCH_SIZE):
+                    scratch.delete(ids=deleted[i:i + self.DELETE_BATCH_SIZE])
+                added = [chunk_id for chunk_id, op in journal.items() if op == 'add']
+                for i in range(0, len(added), self.COMPACTION_PAGE_SIZE):
+                    page = source.get(ids=added[i:i + self.COMPACTION_PAGE_SIZE],
+                                      include=['embeddings', 'metadatas', 'documents'])
+                    if page['ids']:
+                        scratch.upsert(ids=page['ids'], embeddings=page['embeddings'],
+                                       metadatas=page['metadatas'], documents=page['documents'])
+
+                # Never leave the name empty: the old collection is kept until the copy holds the name
+                source.modify(name=old_name)
+                try:
+                    scratch.modify(name=name)
+                except Exception:
+                    source.modify(name=name)
+                    raise
+                self.collection = scratch
+                try:
+                    self.client.delete_collection(old_name)
+                except Exception as e:
+                    self.logger.warning(f"Old collection left for startup cleanup: {e}")
+
+                live = self.collection.count()
+                self._save_maintenance_state(
+                    deleted_since_compaction=0,
+                    last_compacted_at=time.time(),
+                    baseline_bytes_per_vector=self._index_bytes() / live if live else None
+                )
+
+            elapsed = time.time() - started
+            self.logger.info(f"🔧 Compacted collection '{name}': {copied} rows copied, "
+                             f"{len(added) + len(deleted)} journaled writes replayed in {elapsed:.2f}s")
+            return {'success': True, 'copied': copied, 'replayed': len(added) + len(deleted),
+                    'elapsed_s': round(elapsed, 3)}
+
+        except Exception as e:
+            with self._writing():
+                try:
+                    os.remove(self._journal_path)
+                except FileNotFoundError:
+                    pass
+            self.logger.error(f"Compaction failed: {e}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            lock_file.close()
+
     def get_collection_stats(self) -> Dict[str, Any]:
         """Get collection statistics"""
         try:
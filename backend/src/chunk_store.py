@@ -0,0 +1,187 @@
+"""
+Chunk window store for small-to-big retrieval
+
+Text is embedded as small chunks (SMALL_CHUNK_SIZE words) so each vector
+describes one idea. The LLM still needs the surrounding passage, so this store
+keeps every text chunk keyed by (document, page, chunk_index). The retriever
+can then widen a hit to its neighbours on the same page.
+
+Layout: one JSON file per (user, document) under CHUNK_STORE_PATH:
+    {user hash}/{document hash}.json -> {"overlap": words, "pages": {page: {chunk_index: text}}}
+
+The overlap in words used at ingest is recorded, so windows can be stitched
+back into a passage without repeating text.
+
+Parsed files are kept in an in-process LRU, validated against the file's
+mtime on every access, so uploads and deletes in one gunicorn worker are
+seen by the others.
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]
+
+
+class ChunkWindowStore:
+    """Per-user, per-document text chunks addressable by (page, chunk_index)"""
+
+    MAX_LOADED_DOCUMENTS = 512  # In-memory LRU of parsed document files
+
+    def __init__(self, config):
+        self.store_dir = getattr(config, 'CHUNK_STORE_PATH', './data/chunk_store')
+        if getattr(config, 'SMALL_TO_BIG_ENABLED', True):
+            self.overlap = getattr(config, 'SMALL_CHUNK_OVERLAP', 0)
+        else:
+            self.overlap = getattr(config, 'CHUNK_OVERLAP', 200)
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        # (user, document) -> (file mtime, parsed entry)
+        self._documents: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ========== Updates ==========
+
+    def add_document(self, user_id: Optional[str], document_name: str, chunks: List) -> int:
+        """Store a document's text chunks (replaces an earlier upload with the same name)"""
+        pages: Dict[int, Dict[int, str]] = {}
+        for chunk in chunks:
+            chunk_index = (getattr(chunk, 'metadata', None) or {}).get('chunk_index')
+            if getattr(chunk, 'chunk_type', 'text') != 'text' or chunk_index is None:
+                continue
+            page_num = int(getattr(chunk, 'page_number', 1) or 1)
+            pages.setdefault(page_num, {})[int(chunk_index)] = chunk.content
+
+        if not pages:
+            return 0
+
+        entry = {'overlap': self.overlap, 'pages': pages}
+        path = self._path(user_id, document_name)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'document_name': document_name, **entry}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._remember((user_id or '', document_name), os.stat(path).st_mtime_ns, entry)
+
+        count = sum(len(page) for page in pages.values())
+        logger.info(f"✅ Chunk store: {count} text chunks from '{document_name}' (user: {user_id})")
+        return count
+
+    def delete_document(self, user_id: Optional[str], document_name: str):
+        with self._lock:
+            self._documents.pop((user_id or '', document_name), None)
+            try:
+                os.remove(self._path(user_id, document_name))
+            except FileNotFoundError:
+                pass
+
+    def delete_user(self, user_id: str):
+        """Remove all of a user's chunks from memory and disk"""
+        with self._lock:
+            for key in [key for key in self._documents if key[0] == (user_id or '')]:
+                del self._documents[key]
+            shutil.rmtree(self._user_dir(user_id), ignore_errors=True)
+
+    def clear_all(self):
+        with self._lock:
+            self._documents.clear()
+            shutil.rmtree(self.store_dir, ignore_errors=True)
+            os.makedirs(self.store_dir, exist_ok=True)
+
+    # ========== Lookup ==========
+
+    def get_page_indices(self, user_id: Optional[str], document_name: str, page_number: int) -> List[int]:
+        """Chunk indices stored for a page (empty for documents indexed before small-to-big)"""
+        entry = self._get(user_id, document_name)
+        if entry is None:
+            return []
+        return sorted(entry['pages'].get(int(page_number), {}))
+
+    def get_passage(self, user_id: Optional[str], document_name: str, page_number: int,
+                    start: int, end: int) -> Optional[str]:
+        """
+        Text of chunks start..end (inclusive) on one page, stitched without overlap copies
+
+        Returns:
+            The passage, or None if none of the chunks are stored
+        """
+        entry = self._get(user_id, document_name)
+        if entry is None:
+            return None
+        page = entry['pages'].get(int(page_number), {})
+        parts = [page[i].split() for i in range(start, end + 1) if i in page]
+        if not parts:
+            return None
+
+        words = parts[0]
+        for part in parts[1:]:
+            words = words + part[self._overlap_length(words, part, entry['overlap']):]
+        return ' '.join(words)
+
+    # ========== Internals ==========
+
+    @staticmethod
+    def _overlap_length(previous: List[str], following: List[str], max_overlap: int) -> int:
+        """Words at the start of `following` that repeat the end of `previous`"""
+        for length in range(min(max_overlap, len(previous), len(following)), 0, -1):
+            if previous[-length:] == following[:length]:
+                return length
+        return 0
+
+    def _user_dir(self, user_id: Optional[str]) -> str:
+        return os.path.join(self.store_dir, _hash(user_id or ''))
+
+    def _path(self, user_id: Optional[str], document_name: str) -> str:
+        return os.path.join(self._user_dir(user_id), f"{_hash(document_name)}.json")
+
+    def _get(self, user_id: Optional[str], document_name: str) -> Optional[Dict[str, Any]]:
+        key = (user_id or '', document_name)
+        path = self._path(user_id, document_name)
+        with self._lock:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                # Deleted (possibly by another worker)
+                self._documents.pop(key, None)
+                return None
+
+            cached = self._documents.get(key)
+            if cached is not None and cached[0] == mtime:
+                self._documents.move_to_end(key)
+                return cached[1]
+
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                self._documents.pop(key, None)
+                return None
+            except Exception as e:
+                logger.warning(f"Chunk store file for '{document_name}' unreadable: {e}")
+                return None
+
+            # JSON object keys are strings
+            entry = {
+                'overlap': data.get('overlap', 0),
+                'pages': {int(page): {int(i): text for i, text in chunks.items()}
+                          for page, chunks in data.get('pages', {}).items()}
+            }
+            self._remember(key, mtime, entry)
+            return entry
+
+    def _remember(self, key: tuple, mtime: int, entry: Dict[str, Any]):
+        self._documents[key] = (mtime, entry)
+        self._documents.move_to_end(key)
+        while len(self._documents) > self.MAX_LOADED_DOCUMENTS:
+            self._documents.popitem(last=False)
@@ -0,0 +1,259 @@
+"""
+Token-accurate context packing for the LLM prompt
+
+The prompt context used to be filled against a 4000-token budget estimated as
+len(text) // 4. That holds for English but not for Devanagari or Kannada,
+which run several times more tokens per character, so Indic documents
+overflowed the budget the estimate said they fit. Overlapping chunks were also
+packed as-is: adjacent CHUNK_SIZE chunks share CHUNK_OVERLAP words, so every
+neighbouring pair spent that many tokens twice.
+
+ContextPacker:
+- Counts tokens with the answering model's tokenizer (CONTEXT_TOKENIZER,
+  a Hugging Face tokenizer for the Llama 3.1 text models). If it can't load,
+  it falls back to tiktoken's cl100k_base: Llama 3 extends that vocabulary,
+  so it overcounts rather than overflows. If neither is available, a
+  per-script character estimate is used.
+- Trims overlap between text chunks from the same page: the words a chunk
+  shares with a neighbour already in the context are dropped from it.
+  Chunks wholly contained in one already packed are skipped. A chunk that
+  contains packed ones replaces them, in the place of the best-ranked one.
+- Fills CONTEXT_MAX_TOKENS greedily in retrieval order. That order is the
+  retriever's final ranking (cross-encoder, RRF fusion, MMR), which the raw
+  'score' field doesn't reflect. A chunk that doesn't fit is skipped so
+  smaller, distinct evidence can still go in. Any space left at the end goes
+  to the best skipped chunk, truncated at a word boundary, if it is at least
+  CONTEXT_MIN_PARTIAL_TOKENS.
+"""
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from tokenizers import Tokenizer
+    TOKENIZERS_AVAILABLE = True
+except ImportError:
+    TOKENIZERS_AVAILABLE = False
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Shortest run of shared words treated as chunk overlap rather than coincidence
+MIN_OVERLAP_WORDS = 8
+TRUNCATION_MARKER = "... [truncated]"
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokenizer-free estimate: ~4 ASCII characters per token, ~1 token per non-ASCII character"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii
+
+
+def overlap_words(earlier: List[str], later: List[str]) -> int:
+    """Number of words at the end of `earlier` that repeat at the start of `later`"""
+    if not earlier or not later:
+        return 0
+    first = later[0]
+    for start in range(max(0, len(earlier) - len(later)), len(earlier) - MIN_OVERLAP_WORDS + 1):
+        if earlier[start] == first and earlier[start:] == later[:len(earlier) - start]:
+            return len(earlier) - start  # Longest match: earliest start
+    return 0
+
+
+class ContextPacker:
+    """Packs retrieved chunks into a token budget, without overlapping text"""
+
+    def __init__(self, config):
+        self.max_tokens = getattr(config, 'CONTEXT_MAX_TOKENS', 4000)
+        self.min_partial_tokens = getattr(config, 'CONTEXT_MIN_PARTIAL_TOKENS', 100)
+        self.tokenizer_name = getattr(config, 'CONTEXT_TOKENIZER', 'Xenova/Meta-Llama-3.1-Tokenizer')
+
+        self._count = None
+        self._tokenizer_kind = None
+        self._tokenizer_lock = threading.Lock()
+
+    # ========== Token counting ==========
+
+    def warmup(self):
+        """Load the tokenizer ahead of the first request"""
+        if self._count is None:
+            self._load_tokenizer()
+
+    def count_tokens(self, text: str) -> int:
+        if self._count is None:
+            self._load_tokenizer()
+        return self._count(text)
+
+    def _load_tokenizer(self):
+        with self._tokenizer_lock:
+            if self._count is not None:
+                return
+            if TOKENIZERS_AVAILABLE and self.tokenizer_name:
+                try:
+                    tokenizer = Tokenizer.from_pretrained(self.tokenizer_name)
+                    self._count = lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+                    self._tokenizer_kind = self.tokenizer_name
+                except Exception as e:
+                    logger.warning(f"Could not load tokenizer {self.tokenizer_name}: {e}")
+            if self._count is None and TIKTOKEN_AVAILABLE:
+                try:
+                    encoding = tiktoken.get_encoding('cl100k_base')
+                    self._count = lambda text: len(encoding.encode(text, disallowed_special=()))
+                    self._tokenizer_kind = 'tiktoken:cl100k_base'
+                except Exception as e:
+                    logger.warning(f"Could not load tiktoken encoding: {e}")
+            if self._count is None:
+                self._count = estimate_tokens
+                self._tokenizer_kind = 'estimate'
+            logger.info(f"Context packing counts tokens with {self._tokenizer_kind}")
+
+    # ========== Packing ==========
+
+    def pack(self, context_docs: List[Dict[str, Any]]) -> Tuple[str, Dict[str, Any]]:
+        """
+        Build the prompt context from retrieved chunks
+
+        Args:
+            context_docs: Retrieved chunks (dicts with 'content', 'metadata'), best first
+
+        Returns:
+            (context text, stats) - tokens used, chunks packed/skipped/truncated/duplicate, overlap words removed
+        """
+        stats = {'tokens': 0, 'budget': self.max_tokens, 'packed': 0, 'skipped': 0, 'truncated': 0,
+                 'overlap_words_removed': 0, 'duplicates': 0}
+        packed: List[Dict[str, Any]] = []  # {'doc', 'words', 'part', 'tokens'}
+        skipped: List[Dict[str, Any]] = []
+        for doc in context_docs:
+            text, removed, contained = self._without_overlap(doc, packed)
+            if text is None:
+                stats['duplicates'] += 1
+                continue
+            part = self._format(text, doc)
+            tokens = self.count_tokens(part)
+            freed = sum(entry['tokens'] for entry in contained)
+            if stats['tokens'] - freed + tokens > self.max_tokens:
+                skipped.append(doc)
+                continue
+            entry = {'doc': doc, 'words': text.split(), 'part': part, 'tokens': tokens}
+            if contained:
+                # This chunk holds earlier, better-ranked chunks' text: it takes the first one's place
+                position = packed.index(contained[0])
+                packed[position] = entry
+                packed[:] = [e for e in packed if not any(e is c for c in contained)]
+                stats['duplicates'] += len(contained)
+            else:
+                packed.append(entry)
+            stats['tokens'] += tokens - freed
+            stats['overlap_words_removed'] += removed
+
+        remaining = self.max_tokens - stats['tokens']
+        for doc in skipped:
+            if remaining < self.min_partial_tokens:
+                break
+            text, removed, contained = self._without_overlap(doc, packed)
+            if not text or contained:
+                continue  # A truncated copy of packed text adds nothing
+            part = self._truncate(text, doc, remaining)
+            if part is None:
+                continue
+            tokens = self.count_tokens(part)
+            packed.append({'doc': doc, 'words': text.split(), 'part': part, 'tokens': tokens})
+            stats['tokens'] += tokens
+            stats['truncated'] += 1
+            stats['overlap_words_removed'] += removed
+            remaining -= tokens
+            skipped.remove(doc)
+            break  # One partial chunk at most
+
+        stats['packed'] = len(packed)
+        stats['skipped'] = len(skipped)
+        stats['tokenizer'] = self._tokenizer_kind
+        return "\n".join(entry['part'] for entry in packed), stats
+
+    @staticmethod
+    def _format(content: str, doc: Dict[str, Any]) -> str:
+        # Minimal context formatting - just content and page
+        return f"""{content} [Page {doc['metadata'].get('page_number')}]
+
+"""
+
+    def _truncate(self, text: str, doc: Dict[str, Any], budget: int) -> Optional[str]:
+        """Longest word prefix whose formatted part fits the budget, or None if it can't hold min_partial_tokens"""
+        words = text.split()
+        low, high, best = 1, len(words), None
+        while low <= high:
+            middle = (low + high) // 2
+            part = self._format(' '.join(words[:middle]) + TRUNCATION_MARKER, doc)
+            if self.count_tokens(part) <= budget:
+                best, low = part, middle + 1
+            else:
+                high = middle - 1
+        if best is None or self.count_tokens(best) < self.min_partial_tokens:
+            return None
+        return best
+
+    @staticmethod
+    def _without_overlap(doc: Dict[str, Any],
+                         packed: List[Dict[str, Any]]) -> Tuple[Optional[str], int, List[Dict[str, Any]]]:
+        """
+        The doc's text minus words it shares with packed text chunks from the same page
+
+        Returns:
+            (text or None if nothing new is left, words removed,
+             packed entries whose text this chunk contains and should replace)
+        """
+        meta = doc['metadata']
+        words = doc['content'].split()
+        if meta.get('chunk_type', 'text') != 'text':
+            return doc['content'], 0, []
+
+        page = (meta.get('document_name'), meta.get('page_number'))
+        start, end = 0, len(words)
+        contained = []
+        for entry in packed:
+            other_meta = entry['doc']['metadata']
+            if other_meta.get('chunk_type', 'text') != 'text' or \
+                    (other_meta.get('document_name'), other_meta.get('page_number')) != page:
+                continue
+            other = entry['words']
+            mine = f" {' '.join(words[start:end])} "
+            theirs = f" {' '.join(other)} "
+            if mine in theirs:
+                return None, len(words), []
+            if theirs in mine:
+                contained.append(entry)
+                continue
+            order = _position(meta, other_meta)
+            if order != 'before':  # Packed chunk may precede this one: drop our shared prefix
+                start += overlap_words(other, words[start:end])
+            if order != 'after':  # Packed chunk may follow this one: drop our shared suffix
+                end -= overlap_words(words[start:end], other)
+
+        if start >= end:
+            return None, len(words), []
+        removed = len(words) - (end - start)
+        return (doc['content'] if removed == 0 else ' '.join(words[start:end])), removed, contained
+
+
+def _position(meta: Dict[str, Any], other_meta: Dict[str, Any]) -> Optional[str]:
+    """'before'/'after' if this chunk's place on the page relative to the other's is known, else None"""
+    mine, theirs = _span(meta), _span(other_meta)
+    if mine is None or theirs is None:
+        return None
+    if mine[0] < theirs[0]:
+        return 'before'
+    if mine[0] > theirs[0]:
+        return 'after'
+    return None
+
+
+def _span(meta: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    if meta.get('window'):
+        return tuple(meta['window'])
+    index = meta.get('chunk_index')
+    return (index, index) if index is not None else None
@@ -0,0 +1,325 @@
+"""
+User-scoped registry of uploaded PDFs over content-addressed storage
+
+Uploads used to share one flat directory named after the upload's filename.
+Finding a user's PDF meant guessing "{name}.pdf" and, failing that, listing
+and sorting the whole directory by mtime. That picked up whichever upload
+was newest, even one from another user. Two users uploading "notes.pdf" also
+overwrote each other.
+
+The registry maps (user, document name) to the SHA-256 of the file. The file
+itself is stored once under that hash, so lookups are a dict read and
+identical uploads share one copy on disk:
+
+    DOCUMENT_REGISTRY_PATH/{user hash}.json -> {"user_id", "documents": {name: record}}
+    UPLOAD_FOLDER/objects/{sha[:2]}/{sha}.pdf
+    UPLOAD_FOLDER/objects/{sha[:2]}/{sha}.refs/{user hash}_{document hash}
+
+Each (user, document) that points at a blob leaves an empty marker in the
+blob's .refs directory. The blob is deleted with its last marker, so
+removing one user's copy never breaks another user's document.
+
+Registry files are re-read when their mtime changes, so every gunicorn worker
+sees the others' uploads and deletes. Updates to one user's registry file, and
+adding or releasing references to one blob, hold an flock shared by all
+workers, so concurrent uploads can't lose each other's records and a blob
+can't be deleted while a new reference to it is being added.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, Any, List, Optional
+
+from .file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _hash(value: str) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentRegistry:
+    """(user, document name) -> content-addressed PDF path, with reference-counted blobs"""
+
+    def __init__(self, config):
+        self.registry_dir = getattr(config, 'DOCUMENT_REGISTRY_PATH', './data/document_registry')
+        self.upload_folder = getattr(config, 'UPLOAD_FOLDER', './data/pdfs')
+        self.objects_dir = os.path.join(self.upload_folder, 'objects')
+        self.locks_dir = os.path.join(self.objects_dir, 'locks')
+        os.makedirs(self.registry_dir, exist_ok=True)
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+        # user key -> (registry file mtime, {document name: record})
+        self._users: Dict[str, tuple] = {}
+        self._lock = threading.RLock()
+
+    # ========== Updates ==========
+
+    def register(self, user_id: Optional[str], document_name: str, source_path: str,
+                 original_filename: str = None, keep_source: bool = False) -> Dict[str, Any]:
+        """
+        Store an uploaded file and point (user, document name) at it
+
+        Args:
+            user_id: Owner (None for uploads without auth)
+            document_name: Name the document is indexed under
+            source_path: The uploaded file; moved into storage unless keep_source
+            original_filename: Filename as uploaded, for display
+            keep_source: Copy instead of move (one legacy file registered for several owners)
+
+        Returns:
+            The registry record, including the stored 'path'
+        """
+        sha = file_sha256(source_path)
+        blob_path = self._blob_path(sha)
+        with self._user_lock(user_id):
+            with self._blob_lock(sha):
+                self._add_ref(sha, user_id, document_name)
+                if os.path.exists(blob_path):
+                    if not keep_source:
+                        os.remove(source_path)
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    tmp_path = f"{blob_path}.{os.getpid()}.tmp"
+                    if keep_source:
+                        shutil.copyfile(source_path, tmp_path)
+                    else:
+                        shutil.move(source_path, tmp_path)
+                    os.replace(tmp_path, blob_path)
+
+            record = {
+                'document_name': document_name,
+                'sha256': sha,
+                'size': os.path.getsize(blob_path),
+                'original_filename': original_filename or f"{document_name}.pdf",
+                'uploaded_at': time.time()
+            }
+            documents = dict(self._load(user_id))
+            previous = documents.get(document_name)
+            documents[document_name] = record
+            self._save(user_id, documents)
+
+        # Re-uploading a name with different content drops the old file's reference
+        if previous and previous['sha256'] != sha:
+            self._release(previous['sha256'], user_id, document_name, delete_files=True)
+
+        logger.info(f"📄 Registered '{document_name}' (user: {user_id}) -> {sha[:12]}")
+        return self._with_path(record)
+
+    def remove(self, user_id: Optional[str], document_name: str, delete_files: bool = True) -> List[str]:
+        """
+        Forget a user's document
+
+        Returns:
+            Paths of blobs no longer referenced by anyone (already deleted if delete_files)
+        """
+        with self._user_lock(user_id):
+            documents = dict(self._load(user_id))
+            record = documents.pop(document_name, None)
+            if record is None:
+                return []
+            self._save(user_id, documents)
+        orphan = self._release(record['sha256'], user_id, document_name, delete_files)
+        return [orphan] if orphan else []
+
+    def remove_user(self, user_id: Optional[str], delete_files: bool = True) -> List[str]:
+        """Forget all of a user's documents; returns blobs no other user references"""
+        with self._user_lock(user_id):
+            documents = self._load(user_id)
+            with self._lock:
+                self._users.pop(user_id or '', None)
+            try:
+                os.remove(self._registry_path(user_id))
+            except FileNotFoundError:
+                pass
+
+        orphans = []
+        for name, record in documents.items():
+            orphan = self._release(record['sha256'], user_id, name, delete_files)
+            if orphan:
+                orphans.append(orphan)
+        return orphans
+
+    def clear_all(self):
+        """Drop every record and stored file"""
+        with self._lock:
+            self._users.clear()
+            shutil.rmtree(self.registry_dir, ignore_errors=True)
+            shutil.rmtree(self.objects_dir, ignore_errors=True)
+            os.makedirs(self.registry_dir, exist_ok=True)
+            os.makedirs(self.locks_dir, exist_ok=True)
+
+    # ========== Lookup ==========
+
+    def get(self, user_id: Optional[str], document_name: str) -> Optional[Dict[str, Any]]:
+        record = self._load(user_id).get(document_name)
+        return self._with_path(record) if record else None
+
+    def get_path(self, user_id: Optional[str], document_name: str = None) -> Optional[str]:
+        """
+        Stored PDF for a user's document
+
+        Args:
+            document_name: Document to look up; None means the user's most recent upload
+
+        Returns:
+            Path of an existing file, or None
+        """
+        documents = self._load(user_id)
+        if document_name:
+            record = documents.get(document_name)
+        else:
+            record = max(documents.values(), key=lambda r: r['uploaded_at'], default=None)
+        if not record:
+            return None
+        path = self._blob_path(record['sha256'])
+        return path if os.path.exists(path) else None
+
+    def list_documents(self, user_id: Optional[str]) -> List[Dict[str, Any]]:
+        return [self._with_path(record) for record in self._load(user_id).values()]
+
+    # ========== Migration ==========
+
+    def migrate_flat_uploads(self, get_owners: Callable[[], Dict[str, List[Optional[str]]]]) -> Dict[str, int]:
+        """
+        Move PDFs from the old flat upload directory into the registry
+
+        A flat "{name}.pdf" is registered for every user whose chunks name that
+        document. Files no one owns (never indexed, or already deleted) are set
+        aside in UPLOAD_FOLDER/unreferenced so startup doesn't rescan them.
+
+        Args:
+            get_owners: Returns document name -> owning user IDs; only called if there is something to migrate
+        """
+        try:
+            flat = sorted(f for f in os.listdir(self.upload_folder)
+                          if f.lower().endswith('.pdf') and os.path.isfile(os.path.join(self.upload_folder, f)))
+        except FileNotFoundError:
+            return {'migrated': 0, 'unreferenced': 0}
+        if not flat:
+            return {'migrated': 0, 'unreferenced': 0}
+
+        owners = get_owners()
+        migrated = unreferenced = 0
+        for filename in flat:
+            path = os.path.join(self.upload_folder, filename)
+            name = filename[:-4]
+            users = owners.get(name, [])
+            try:
+                if not users:
+                    os.makedirs(os.path.join(self.upload_folder, 'unreferenced'), exist_ok=True)
+                    os.replace(path, os.path.join(self.upload_folder, 'unreferenced', filename))
+                    unreferenced += 1
+                    continue
+                for user_id in users:
+                    if not self.get(user_id, name):
+                        self.register(user_id, name, path, original_filename=filename, keep_source=True)
+                os.remove(path)
+                migrated += 1
+            except FileNotFoundError:
+                continue  # Another worker migrated it first
+            except Exception as e:
+                logger.warning(f"Could not migrate upload '{filename}': {e}")
+
+        logger.info(f"📄 Document registry migration: {migrated} uploads registered, "
+                    f"{unreferenced} unreferenced set aside")
+        return {'migrated': migrated, 'unreferenced': unreferenced}
+
+    # ========== Internals ==========
+
+    def _registry_path(self, user_id: Optional[str]) -> str:
+        return os.path.join(self.registry_dir, f"{_hash(user_id or '')}.json")
+
+    def _blob_path(self, sha: str) -> str:
+        return os.path.join(self.objects_dir, sha[:2], f"{sha}.pdf")
+
+    def _refs_dir(self, sha: str) -> str:
+        return os.path.join(self.objects_dir, sha[:2], f"{sha}.refs")
+
+    def _ref_path(self, sha: str, user_id: Optional[str], document_name: str) -> str:
+        return os.path.join(self._refs_dir(sha), f"{_hash(user_id or '')}_{_hash(document_name)}")
+
+    def _user_lock(self, user_id: Optional[str]):
+        """Held for a read-modify-write of the user's registry file"""
+        return file_lock(os.path.join(self.registry_dir, f"{_hash(user_id or '')}.lock"))
+
+    def _blob_lock(self, sha: str):
+        """Held while adding or releasing references to a blob (one lock file per sha prefix)"""
+        return file_lock(os.path.join(self.locks_dir, f"{sha[:2]}.lock"))
+
+    def _with_path(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        return {**record, 'path': self._blob_path(record['sha256'])}
+
+    def _add_ref(self, sha: str, user_id: Optional[str], document_name: str):
+        os.makedirs(self._refs_dir(sha), exist_ok=True)
+        open(self._ref_path(sha, user_id, document_name), 'a').close()
+
+    def _release(self, sha: str, user_id: Optional[str], document_name: str, delete_files: bool) -> Optional[str]:
+        """Drop one reference; returns the blob path if that was the last one"""
+        with self._blob_lock(sha):
+            try:
+                os.remove(self._ref_path(sha, user_id, document_name))
+            except FileNotFoundError:
+                pass
+            try:
+                os.rmdir(self._refs_dir(sha))  # Fails while other references remain
+            except FileNotFoundError:
+                pass
+            except OSError:
+                return None
+
+            blob_path = self._blob_path(sha)
+            if delete_files:
+                try:
+                    os.remove(blob_path)
+                except FileNotFoundError:
+                    pass
+            return blob_path
+
+    def _load(self, user_id: Optional[str]) -> Dict[str, Dict[str, Any]]:
+        key = user_id or ''
+        path = self._registry_path(user_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                self._users.pop(key, None)
+            return {}
+
+        with self._lock:
+            cached = self._users.get(key)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    documents = json.load(f).get('documents', {})
+            except Exception as e:
+                logger.warning(f"Document registry for user {user_id} unreadable: {e}")
+                return {}
+            self._users[key] = (mtime, documents)
+            return documents
+
+    def _save(self, user_id: Optional[str], documents: Dict[str, Dict[str, Any]]):
+        """Caller holds the user's lock"""
+        path = self._registry_path(user_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'user_id': user_id, 'documents': documents}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._users[user_id or ''] = (os.stat(path).st_mtime_ns, documents)
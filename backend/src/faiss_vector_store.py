@@ -0,0 +1,707 @@
+"""
+FAISS-based vector store with on-disk index and JSON metadata sidecar.
+
+Index types (Config.FAISS_INDEX_TYPE):
+- flat: exact inner-product search (IndexIDMap2 + IndexFlatIP)
+- ivf:  inverted-file index, trained lazily and retrained as the corpus grows
+- hnsw: graph index; deletes are tombstoned until a background compaction
+        (see index_maintenance.IndexMaintainer) rebuilds the graph
+
+Embeddings are L2-normalised, so inner product == cosine similarity and
+distances are reported as 1 - similarity to match ChromaDB's cosine space.
+
+Each gunicorn worker holds its own copy of the index. Writes hold an flock on
+"{FAISS_INDEX_PATH}.lock" and first reload the files if another worker has
+replaced them (checked by the sidecar's inode and mtime). Reads reload the
+same way, so every worker sees the others' uploads and deletes. A reload reads
+the whole index, so this suits read-mostly corpora; write-heavy deployments
+should use Chroma.
+"""
+import os
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Callable, Optional, Set, Tuple
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from .file_lock import file_lock
+from .vector_store import empty_results, QueryActivity, QueryEmbeddingCache, matches_filters
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+
+class FaissVectorStore:
+    """Persistent vector store using FAISS with sentence-transformers (implements VectorStore)"""
+
+    # Retrain IVF once the corpus is this many times larger than at training time
+    IVF_RETRAIN_GROWTH = 4
+
+    # Minimum training points per IVF list recommended by FAISS
+    IVF_POINTS_PER_LIST = 39
+
+    # Vectors added to the replacement index per page during compaction
+    COMPACTION_PAGE_SIZE = 1000
+
+    def __init__(self, config):
+        if not FAISS_AVAILABLE:
+            raise ImportError("faiss is not installed. Install requirements-faiss.txt to use VECTOR_STORE_BACKEND=faiss")
+
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._journal = None  # IDs added/deleted while a compaction build is running
+        self._last_compacted_at = None
+        self.query_activity = QueryActivity()
+        self._query_embeddings = QueryEmbeddingCache()
+
+        self.index_type = getattr(config, 'FAISS_INDEX_TYPE', 'flat').lower()
+        if self.index_type not in ('flat', 'ivf', 'hnsw'):
+            raise ValueError(f"Unknown FAISS_INDEX_TYPE: {self.index_type} (expected flat, ivf or hnsw)")
+
+        self.index_path = config.FAISS_INDEX_PATH
+        self.sidecar_path = f"{self.index_path}.meta.json"
+        self.lock_path = f"{self.index_path}.lock"
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+
+        self.logger.info(f"Loading embedding model: {config.EMBEDDING_MODEL}")
+        self.embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
+        self.dim = self.embedding_model.get_sentence_embedding_dimension()
+
+        self._loaded_version = None  # Sidecar version of the files this process last loaded or wrote
+        self._generation = 0  # Bumped on every reload, so a compaction can tell its snapshot went stale
+        with self._lock, file_lock(self.lock_path):
+            self._reset()
+            self._load()
+
+        self.logger.info(f"✅ FAISS {self.index_type} index ready at {self.index_path} "
+                         f"({self._live_count()} vectors{', mmap' if self._mmapped else ''})")
+
+    # ========== Persistence ==========
+
+    def _reset(self):
+        # ID -> metadata sidecar and filter indexes
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._tombstones: Set[int] = set()
+        self._next_id = 0
+        self._trained_on = 0
+        self._ids_by_user: Dict[Optional[str], Set[int]] = defaultdict(set)
+        self._ids_by_doc: Dict[Tuple[Optional[str], str], Set[int]] = defaultdict(set)
+        self._int_ids: Dict[str, int] = {}  # chunk ID -> FAISS int ID
+
+        self.index = None
+        self._mmapped = False
+
+    def _sidecar_version(self) -> Optional[tuple]:
+        """Identity of the sidecar file: every write replaces it, so inode, mtime and size change"""
+        try:
+            stat = os.stat(self.sidecar_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """Read index and sidecar (caller holds the file lock)"""
+        self._loaded_version = self._sidecar_version()
+        if not (os.path.exists(self.index_path) and self._loaded_version is not None):
+            self.index = self._new_index()
+            return
+
+        with open(self.sidecar_path) as f:
+            sidecar = json.load(f)
+
+        if sidecar.get('index_type') != self.index_type or sidecar.get('dim') != self.dim:
+            raise ValueError(f"FAISS index at {self.index_path} was built as "
+                             f"{sidecar.get('index_type')}/{sidecar.get('dim')}d, "
+                             f"config expects {self.index_type}/{self.dim}d")
+
+        if getattr(self.config, 'FAISS_MMAP', True):
+            try:
+                # Read-only memory map: pages are shared across workers and loaded on demand
+                self.index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP)
+                self._mmapped = True
+            except RuntimeError as e:
+                self.logger.warning(f"mmap load not supported for this index ({e}), reading into memory")
+        if self.index is None:
+            self.index = faiss.read_index(self.index_path)
+
+        self._next_id = sidecar['next_id']
+        self._trained_on = sidecar.get('trained_on', 0)
+        self._last_compacted_at = sidecar.get('last_compacted_at')
+        self._tombstones = set(sidecar.get('tombstones', []))
+        for key, entry in sidecar['entries'].items():
+            self._index_entry(int(key), entry)
+
+    def _persist(self):
+        """Write index and sidecar atomically (index first, sidecar vouches for it)"""
+        tmp_index = f"{self.index_path}.tmp"
+        faiss.write_index(self.index, tmp_index)
+        os.replace(tmp_index, self.index_path)
+
+        sidecar = {
+            'index_type': self.index_type,
+            'dim': self.dim,
+            'next_id': self._next_id,
+            'trained_on': self._trained_on,
+            'last_compacted_at': self._last_compacted_at,
+            'tombstones': sorted(self._tombstones),
+            'entries': {str(k): v for k, v in self._entries.items()}
+        }
+        tmp_sidecar = f"{self.sidecar_path}.tmp"
+        with open(tmp_sidecar, 'w') as f:
+            json.dump(sidecar, f)
+        os.replace(tmp_sidecar, self.sidecar_path)
+        self._loaded_version = self._sidecar_version()
+
+    def _reload_if_changed(self) -> bool:
+        """Reload if another worker wrote the files since (caller holds the lock and the file lock)"""
+        if self._sidecar_version() == self._loaded_version:
+            return False
+        self._reset()
+        self._load()
+        self._generation += 1
+        self.logger.info(f"🔄 FAISS index changed in another worker, reloaded ({self._live_count()} vectors)")
+        return True
+
+    def _refresh(self):
+        """Pick up other workers' writes before reading (caller holds the lock)"""
+        if self._sidecar_version() != self._loaded_version:
+            with file_lock(self.lock_path):
+                self._reload_if_changed()
+
+    @contextmanager
+    def _writing(self):
+        """Write lock across threads and workers, over the latest files (not re-entrant)"""
+        with self._lock, file_lock(self.lock_path):
+            self._reload_if_changed()
+            yield
+
+    def _ensure_writable(self):
+        """A memory-mapped index is read-only; promote it to an in-memory copy before mutating"""
+        if self._mmapped:
+            self.index = faiss.read_index(self.index_path)
+            self._mmapped = False
+
+    # ========== Index Construction ==========
+
+    def _new_index(self, n_train: int = 0):
+        if self.index_type == 'flat':
+            return faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+
+        if self.index_type == 'hnsw':
+            hnsw = faiss.IndexHNSWFlat(self.dim, getattr(self.config, 'FAISS_HNSW_M', 32),
+                                       faiss.METRIC_INNER_PRODUCT)
+            hnsw.hnsw.efConstruction = getattr(self.config, 'FAISS_HNSW_EF_CONSTRUCTION', 200)
+            return faiss.IndexIDMap2(hnsw)
+
+        # IVF: cap nlist so every list gets enough training points
+        nlist = getattr(self.config, 'FAISS_IVF_NLIST', 100)
+        if n_train:
+            nlist = max(1, min(nlist, n_train // self.IVF_POINTS_PER_LIST))
+        quantizer = faiss.IndexFlatIP(self.dim)
+        index = faiss.IndexIVFFlat(quantizer, self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        # Hashtable direct map supports reconstruct() and remove_ids() with arbitrary IDs
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+
+    def _rebuild(self, extra_ids: np.ndarray = None, extra_vectors: np.ndarray = None):
+        """Rebuild the index from live vectors (compacts tombstones, retrains IVF)"""
+        live_ids = np.array(sorted(self._entries), dtype=np.int64)
+        vectors = self._reconstruct(live_ids)
+
+        if extra_ids is not None:
+            live_ids = np.concatenate([live_ids, extra_ids])
+            vectors = np.vstack([vectors, extra_vectors])
+
+        index = self._new_index(n_train=len(live_ids))
+        if self.index_type == 'ivf' and len(live_ids):
+            index.train(vectors)
+            self._trained_on = len(live_ids)
+        if len(live_ids):
+            index.add_with_ids(vectors, live_ids)
+
+        self.index = index
+        self._tombstones.clear()
+        self.logger.info(f"🔧 Rebuilt FAISS {self.index_type} index with {len(live_ids)} vectors")
+
+    def _reconstruct(self, int_ids: np.ndarray) -> np.ndarray:
+        vectors = [self.index.reconstruct(int(i)) for i in int_ids] if self.index.ntotal else []
+        return np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+
+    def _add_vectors(self, ids: np.ndarray, vectors: np.ndarray):
+        needs_training = self.index_type == 'ivf' and (
+            not self.index.is_trained
+            or self._live_count() + len(ids) >= self._trained_on * self.IVF_RETRAIN_GROWTH
+        )
+        if needs_training:
+            self._rebuild(ids, vectors)
+        else:
+            self.index.add_with_ids(vectors, ids)
+
+    # ========== Sidecar Bookkeeping ==========
+
+    def _index_entry(self, int_id: int, entry: Dict[str, Any]):
+        self._entries[int_id] = entry
+        self._int_ids[entry['id']] = int_id
+        if int_id in self._tombstones:
+            return
+        meta = entry['metadata']
+        self._ids_by_user[meta.get('user_id')].add(int_id)
+        self._ids_by_doc[(meta.get('user_id'), meta.get('document_name'))].add(int_id)
+
+    def _remove_entries(self, int_ids: List[int]):
+        for int_id in int_ids:
+            entry = self._entries.pop(int_id, None)
+            if not entry:
+                continue
+            if self._int_ids.get(entry['id']) == int_id:
+                del self._int_ids[entry['id']]
+            meta = entry['metadata']
+            user_key = meta.get('user_id')
+            doc_key = (user_key, meta.get('document_name'))
+            self._ids_by_user[user_key].discard(int_id)
+            self._ids_by_doc[doc_key].discard(int_id)
+            if not self._ids_by_user[user_key]:
+                del self._ids_by_user[user_key]
+            if not self._ids_by_doc[doc_key]:
+                del self._ids_by_doc[doc_key]
+
+        if self._journal is not None:
+            self._journal['deleted'].update(int_ids)
+
+        if self.index_type == 'hnsw':
+            # HNSW can't remove nodes - searches exclude tombstones via the ID selector
+            self._tombstones.update(int_ids)
+        elif int_ids:
+            self.index.remove_ids(np.asarray(int_ids, dtype=np.int64))
+
+    def _live_count(self) -> int:
+        return len(self._entries)
+
+    def _allowed_ids(self, user_id: str = None, document_filter: str = None,
+                     filters: Dict[str, Any] = None) -> Optional[np.ndarray]:
+        """IDs a search may return, or None when every live vector qualifies"""
+        if user_id and document_filter:
+            allowed = self._ids_by_doc.get((user_id, document_filter), set())
+        elif user_id:
+            allowed = self._ids_by_user.get(user_id, set())
+        elif document_filter:
+            allowed = set()
+            for (_, doc_name), ids in self._ids_by_doc.items():
+                if doc_name == document_filter:
+                    allowed |= ids
+        elif self._tombstones or filters:
+            allowed = set(self._entries)
+        else:
+            return None
+
+        if filters:
+            # Structured filters narrow the candidate set before FAISS sees it
+            allowed = {i for i in allowed if matches_filters(self._entries[i]['metadata'], filters)}
+        return np.fromiter(allowed, dtype=np.int64, count=len(allowed))
+
+    # ========== Embeddings ==========
+
+    def _generate_embeddings(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Generate normalised float32 embeddings with batching"""
+        try:
+            embeddings = self.embedding_model.encode(
+                texts,
+                batch_size=batch_size,
+                show_progress_bar=len(texts) > 10,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            return np.ascontiguousarray(embeddings, dtype=np.float32)
+        except Exception as e:
+            self.logger.error(f"Embedding generation failed: {e}")
+            raise
+
+    # ========== VectorStore API ==========
+
+    def add_documents(self, chunks: List, document_name: str, user_id: str = None) -> Dict[str, Any]:
+        """Add document chunks with optional user_id for multi-tenancy"""
+        try:
+            self.logger.info(f"Processing {len(chunks)} chunks for '{document_name}' (user: {user_id})")
+            if not chunks:
+                return {'success': True, 'count': 0}
+
+            texts = [chunk.content for chunk in chunks]
+            embeddings = self._generate_embeddings(texts, batch_size=min(64, len(texts)))
+
+            with self._writing():
+                self._ensure_writable()
+                # A re-upload reuses the chunk IDs: drop the previous upload's vectors first
+                previous = list(self._ids_by_doc.get((user_id, document_name), ()))
+                if previous:
+                    self._remove_entries(previous)
+                int_ids = np.arange(self._next_id, self._next_id + len(chunks), dtype=np.int64)
+                self._next_id += len(chunks)
+                if self._journal is not None:
+                    self._journal['added'].update(int(i) for i in int_ids)
+
+                # Vectors go in before their sidecar entries - an IVF retrain rebuilds from _entries
+                self._add_vectors(int_ids, embeddings)
+
+                for int_id, (i, chunk) in zip(int_ids, enumerate(chunks)):
+                    page_num = getattr(chunk, 'page_number', 1)
+                    metadata = {
+                        'document_name': document_name,
+                        'chunk_type': getattr(chunk, 'chunk_type', 'text'),
+                        'page_number': int(page_num) if page_num else 1
+                    }
+                    chunk_index = (getattr(chunk, 'metadata', None) or {}).get('chunk_index')
+                    if chunk_index is not None:
+                        metadata['chunk_index'] = int(chunk_index)  # Small-to-big window lookups
+                    if user_id:
+                        metadata['user_id'] = user_id
+                    self._index_entry(int(int_id), {
+                        'id': f"{user_id}_{document_name}_{i}" if user_id else f"{document_name}_{i}",
+                        'document': chunk.content,
+                        'metadata': metadata
+                    })
+
+                self._persist()
+
+            self.logger.info(f"✅ Added {len(chunks)} chunks from '{document_name}' "
+                             f"({self._live_count()} total vectors)")
+            return {'success': True, 'count': len(chunks)}
+
+        except Exception as e:
+            self.logger.error(f"Failed to add documents: {e}")
+            return {'success': False, 'error': str(e)}
+
+    def search(self, query: str, n_results: int = 5, document_filter: str = None,
+               user_id: str = None, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Search for relevant chunks with optional user/document/metadata filtering"""
+        return self.search_many([query], n_results, document_filter, user_id, filters)[0]
+
+    def search_many(self, queries: List[str], n_results: int = 5, document_filter: str = None,
+                    user_id: str = None, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Search several queries with one embedding batch and one FAISS call"""
+        if not queries:
+            return []
+
+        try:
+            with self._lock:
+                self._refresh()
+                if self._live_count() == 0:
+                    return [empty_results() for _ in queries]
+
+            query_vectors = self.embed_queries(queries)
+
+            with self.query_activity.track(), self._lock:
+                self._refresh()
+                if self._live_count() == 0:
+                    return [empty_results() for _ in queries]
+                allowed = self._allowed_ids(user_id, document_filter, filters)
+                if allowed is not None and len(allowed) == 0:
+                    return [empty_results() for _ in queries]
+
+                k = min(n_results, self._live_count() if allowed is None else len(allowed))
+                # The selector must outlive the search call, so keep a reference here
+                params, selector = self._search_params(allowed)
+                similarities, labels = self.index.search(query_vectors, k, params=params)
+                del selector
+
+                results = []
+                for sims, ids in zip(similarities, labels):
+                    hits = [(int(i), float(s)) for i, s in zip(ids, sims) if i >= 0 and int(i) in self._entries]
+                    results.append({
+                        'ids': [[self._entries[i]['id'] for i, _ in hits]],
+                        'documents': [[self._entries[i]['document'] for i, _ in hits]],
+                        'metadatas': [[dict(self._entries[i]['metadata']) for i, _ in hits]],
+                        'distances': [[1.0 - s for _, s in hits]]
+                    })
+                return results
+
+        except Exception as e:
+            self.logger.error(f"Search failed: {e}")
+            return [empty_results() for _ in queries]
+
+    def _search_params(self, allowed: Optional[np.ndarray]):
+        """Build index-specific search parameters restricted to the allowed IDs"""
+        selector = faiss.IDSelectorBatch(len(allowed), faiss.swig_ptr(allowed)) if allowed is not None else None
+
+        if self.index_type == 'hnsw':
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = getattr(self.config, 'FAISS_HNSW_EF_SEARCH', 64)
+        elif self.index_type == 'ivf':
+            params = faiss.SearchParametersIVF()
+            params.nprobe = getattr(self.config, 'FAISS_IVF_NPROBE', 8)
+        elif selector is None:
+            return None, None
+        else:
+            params = faiss.SearchParameters()
+
+        if selector is not None:
+            params.sel = selector
+        return params, selector
+
+    def delete_document(self, document_name: str, user_id: str = None) -> Dict[str, Any]:
+        """Delete all chunks from a specific document, optionally filtered by user"""
+        try:
+            with self._writing():
+                if user_id:
+                    int_ids = list(self._ids_by_doc.get((user_id, document_name), ()))
+                else:
+                    int_ids = [i for (_, doc), ids in self._ids_by_doc.items() if doc == document_name for i in ids]
+
+                if not int_ids:
+                    self.logger.warning(f"No chunks found for document: {document_name}")
+                    return {'success': False, 'message': 'Document not found'}
+
+                self._ensure_writable()
+                self._remove_entries(int_ids)
+                self._persist()
+
+            self.logger.info(f"✅ Deleted {len(int_ids)} chunks from '{document_name}'")
+            return {'success': True, 'deleted_count': len(int_ids)}
+
+        except Exception as e:
+            self.logger.error(f"Failed to delete document: {e}")
+            return {'success': False, 'error': str(e)}
+
+    def delete_user_vectors(self, user_id: str, batch_size: int = None,
+                            progress_callback: Callable[[int], None] = None) -> Dict[str, Any]:
+        """Delete every chunk owned by a user"""
+        if not user_id:
+            return {'success': False, 'error': 'user_id is required'}
+
+        try:
+            with self._writing():
+                int_ids = list(self._ids_by_user.get(user_id, ()))
+                if int_ids:
+                    self._ensure_writable()
+                    self._remove_entries(int_ids)
+                    self._persist()
+            if progress_callback:
+                progress_callback(len(int_ids))
+
+            self.logger.info(f"✅ Deleted {len(int_ids)} chunks for user {user_id}")
+            return {'success': True, 'deleted_count': len(int_ids)}
+
+        except Exception as e:
+            self.logger.error(f"Failed to delete vectors for user {user_id}: {e}")
+            return {'success': False, 'error': str(e), 'deleted_count': 0}
+
+    def document_has_other_owners(self, document_name: str, user_id: str) -> bool:
+        """Check whether any other user still has chunks for a document name"""
+        with self._lock:
+            self._refresh()
+            return any(doc == document_name and owner != user_id for owner, doc in self._ids_by_doc)
+
+    def get_document_owners(self) -> Dict[str, List[Optional[str]]]:
+        """Document name -> user IDs holding chunks for it"""
+        owners: Dict[str, List[Optional[str]]] = {}
+        with self._lock:
+            self._refresh()
+            for owner, doc in self._ids_by_doc:
+                owners.setdefault(doc, []).append(owner)
+        return owners
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Normalised query embeddings, cached like the ones search() uses"""
+        return np.asarray(self._query_embeddings.embed(queries, self._generate_embeddings),
+                          dtype=np.float32).reshape(-1, self.dim)
+
+    def get_embeddings(self, ids: List[str]) -> np.ndarray:
+        """Stored embeddings for chunk IDs, aligned with ids (zero rows for unknown IDs)"""
+        matrix = np.zeros((len(ids), self.dim), dtype=np.float32)
+        with self._lock:
+            self._refresh()
+            for row, chunk_id in enumerate(ids):
+                int_id = self._int_ids.get(chunk_id)
+                if int_id is not None:
+                    matrix[row] = self.index.reconstruct(int_id)
+        return matrix
+
+    def get_chunks(self, ids: List[str]) -> Dict[str, List]:
+        """Text and metadata for chunk IDs, aligned with ids (None for unknown IDs)"""
+        with self._lock:
+            self._refresh()
+            entries = [self._entries.get(self._int_ids.get(chunk_id)) for chunk_id in ids]
+        return {
+            'documents': [entry['document'] if entry else None for entry in entries],
+            'metadatas': [dict(entry['metadata']) if entry else None for entry in entries]
+        }
+
+    def get_user_chunks(self, user_id: str) -> Dict[str, List]:
+        """All of a user's chunks (text and metadata only)"""
+        with self._lock:
+            self._refresh()
+            entries = [self._entries[i] for i in sorted(self._ids_by_user.get(user_id, ()))]
+        return {
+            'ids': [entry['id'] for entry in entries],
+            'documents': [entry['document'] for entry in entries],
+            'metadatas': [dict(entry['metadata']) for entry in entries]
+        }
+
+    def clear_all(self) -> Dict[str, Any]:
+        """Clear all vectors and metadata"""
+        try:
+            with self._writing():
+                count = self._live_count()
+                self._entries.clear()
+                self._int_ids.clear()
+                self._tombstones.clear()
+                self._ids_by_user.clear()
+                self._ids_by_doc.clear()
+                self._trained_on = 0
+                if self._journal is not None:
+                    self._journal['cleared'] = True
+                self.index = self._new_index()
+                self._mmapped = False
+                self._persist()
+
+            self.logger.info("✅ FAISS index cleared")
+            return {'success': True, 'deleted_count': count}
+
+        except Exception as e:
+            self.logger.error(f"Failed to clear index: {e}")
+            return {'success': False, 'error': str(e)}
+
+    # ========== Index Maintenance ==========
+
+    def get_index_metrics(self) -> Dict[str, Any]:
+        """Index size and fragmentation metrics (tombstones are HNSW nodes awaiting compaction)"""
+        with self._lock:
+            self._refresh()
+            live = self._live_count()
+            tombstones = len(self._tombstones)
+        index_bytes = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        sidecar_bytes = os.path.getsize(self.sidecar_path) if os.path.exists(self.sidecar_path) else 0
+
+        return {
+            'backend': 'faiss',
+            'index_type': self.index_type,
+            'live_vectors': live,
+            'tombstones': tombstones,
+            'tombstone_ratio': round(tombstones / (live + tombstones), 4) if live + tombstones else 0.0,
+            'index_bytes': index_bytes,
+            'sidecar_bytes': sidecar_bytes,
+            'bytes_per_vector': round(index_bytes / live, 1) if live else 0.0,
+            'last_compacted_at': self._last_compacted_at,
+            'compacting': self._compaction_lock.locked()
+        }
+
+    def compact(self, throttle: Callable[[], None] = None) -> Dict[str, Any]:
+        """
+        Rebuild the index from live vectors off the lock and swap it in
+
+        Searches keep using the current index while the replacement is built
+        page by page; writes made meanwhile are journaled and replayed under
+        the lock just before the swap.
+
+        Args:
+            throttle: Called before each page; blocks to yield to interactive queries
+
+        Returns:
+            Dict with 'success', 'copied', 'replayed', 'elapsed_s'
+        """
+        if not self._compaction_lock.acquire(blocking=False):
+            return {'success': False, 'error': 'Compaction already running'}
+
+        started = time.time()
+        try:
+            with self._lock:
+                self._refresh()
+                generation = self._generation
+                live_ids = np.array(sorted(self._entries), dtype=np.int64)
+                vectors = self._reconstruct(live_ids)
+                self._journal = {'added': set(), 'deleted': set(), 'cleared': False}
+
+            index = self._new_index(n_train=len(live_ids))
+            if self.index_type == 'ivf' and len(live_ids):
+                index.train(vectors)
+            for i in range(0, len(live_ids), self.COMPACTION_PAGE_SIZE):
+                if throttle:
+                    throttle()
+                end = i + self.COMPACTION_PAGE_SIZE
+                index.add_with_ids(vectors[i:end], live_ids[i:end])
+
+            with self._writing():
+                journal, self._journal = self._journal, None
+                if journal['cleared']:
+                    return {'success': False, 'error': 'Index was cleared during compaction'}
+                if self._generation != generation:
+                    # The journal only covers this worker's writes
+                    return {'success': False, 'error': 'Index was changed by another worker during compaction'}
+
+                # Replay writes that landed in the old index during the build
+                added = np.array(sorted(journal['added'] - journal['deleted']), dtype=np.int64)
+                if len(added):
+                    index.add_with_ids(self._reconstruct(added), added)
+                snapshot_ids = set(live_ids.tolist())
+                deleted = [i for i in journal['deleted'] if i in snapshot_ids]
+                if self.index_type == 'hnsw':
+                    self._tombstones = set(deleted)
+                elif deleted:
+                    index.remove_ids(np.asarray(deleted, dtype=np.int64))
+
+                self.index = index
+                self._mmapped = False
+                if self.index_type == 'ivf' and len(live_ids):
+                    self._trained_on = len(live_ids)
+                self._last_compacted_at = time.time()
+                self._persist()
+
+            elapsed = time.time() - started
+            self.logger.info(f"🔧 Compacted FAISS {self.index_type} index: {len(live_ids)} vectors copied, "
+                             f"{len(added) + len(deleted)} journaled writes replayed in {elapsed:.2f}s")
+            return {'success': True, 'copied': len(live_ids), 'replayed': len(added) + len(deleted),
+                    'elapsed_s': round(elapsed, 3)}
+
+        except Exception as e:
+            self._journal = None
+            self.logger.error(f"Compaction failed: {e}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            self._compaction_lock.release()
+
+    def get_collection_stats(self) -> Dict[str, Any]:
+        """Get index statistics"""
+        with self._lock:
+            self._refresh()
+            document_names = {doc for _, doc in self._ids_by_doc}
+            return {
+                'total_chunks': self._live_count(),
+                'total_documents': len(document_names),
+                'document_names': list(document_names),
+                'embedding_model': self.config.EMBEDDING_MODEL,
+                'backend': 'faiss',
+                'index_type': self.index_type,
+                'tombstones': len(self._tombstones),
+                'index_bytes': os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0,
+                'mmapped': self._mmapped
+            }
+
+    def list_documents(self, user_id: str = None) -> List[Dict[str, Any]]:
+        """List all documents with their statistics, optionally filtered by user"""
+        with self._lock:
+            self._refresh()
+            doc_stats = {}
+            for (owner, doc_name), ids in self._ids_by_doc.items():
+                if user_id and owner != user_id:
+                    continue
+                stats = doc_stats.setdefault(doc_name, {
+                    'name': doc_name,
+                    'total_chunks': 0,
+                    'text_chunks': 0,
+                    'table_chunks': 0,
+                    'image_chunks': 0
+                })
+                for int_id in ids:
+                    chunk_type = self._entries[int_id]['metadata'].get('chunk_type', 'text')
+                    stats['total_chunks'] += 1
+                    stats[f'{chunk_type}_chunks'] = stats.get(f'{chunk_type}_chunks', 0) + 1
+            return list(doc_stats.values())
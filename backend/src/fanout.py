@@ -0,0 +1,191 @@
+"""
+Concurrent fan-out of independent I/O with per-stage timings
+
+Request handlers make several independent round trips: Redis lookups,
+vector-store metadata reads and the query embedding. run_parallel() starts
+them together, so the request pays the slowest one instead of their sum.
+
+Under gunicorn's gevent worker each call gets its own greenlet, and socket
+waits yield to the others. Elsewhere (the dev server, scripts) the calls run
+on a small shared thread pool. The last call always runs inline on the
+caller, so a fan-out of two needs only one extra worker. Put CPU-bound work
+(the query embedding) last: under gevent the spawned calls first run until they
+wait on their sockets, then the CPU work runs while those round trips are in flight.
+
+A StageTimings can be activated for the current request. Code further down
+the call stack (retriever, reranker, LLM handler) then records into it with
+span(name), without a timings argument threaded through every call. The active
+recorder follows the calls that run_parallel starts.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional
+
+MAX_WORKERS = 16
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _gevent_patched() -> bool:
+    try:
+        from gevent import monkey
+        return monkey.is_module_patched('socket')
+    except ImportError:
+        return False
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='fanout')
+    return _thread_pool
+
+
+class StageTimings:
+    """Wall-clock milliseconds per named stage of one request"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        # Every recorded span in order: {'name', 'start_ms' (from request start), 'duration_ms'}
+        self.spans: List[Dict[str, Any]] = []
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def activate(self):
+        """Make this the recorder span() writes to, for the current request"""
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            try:
+                _active.reset(token)
+            except ValueError:
+                _active.set(None)  # A streaming generator closed from another context
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def record(self, name: str, started: float):
+        """Record a stage that began at time.perf_counter() value `started`; repeated stages add up"""
+        duration = round((time.perf_counter() - started) * 1000, 2)
+        self.stages[name] = round(self.stages.get(name, 0.0) + duration, 2)
+        self.spans.append({'name': name, 'start_ms': round((started - self._started) * 1000, 2),
+                           'duration_ms': duration})
+
+    def set(self, name: str, milliseconds: float):
+        """Record a duration measured elsewhere (e.g. the provider's time to first token)"""
+        self.stages[name] = round(milliseconds, 2)
+
+    def mark(self, name: str):
+        """Record the time from request start to now (e.g. time to first token)"""
+        self.stages[name] = round((time.perf_counter() - self._started) * 1000, 2)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {**self.stages, 'total': round((time.perf_counter() - self._started) * 1000, 2)}
+
+
+_active: contextvars.ContextVar = contextvars.ContextVar('stage_timings', default=None)
+
+
+def current_timings() -> Optional[StageTimings]:
+    """The recorder activated for the current request, if any"""
+    return _active.get()
+
+
+@contextmanager
+def span(name: str):
+    """Time a block into the active request's StageTimings (no-op outside a request)"""
+    timings = _active.get()
+    if timings is None:
+        yield
+        return
+    with timings.stage(name):
+        yield
+
+
+def run_parallel(calls: Dict[str, Callable[[], Any]], timings: Optional[StageTimings] = None,
+                 group: Optional[str] = None, max_concurrency: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run independent zero-argument calls concurrently
+
+    Args:
+        calls: Stage name -> callable
+        timings: Receives each call's duration under its name, and the wall time under `group`
+        group: Name for the whole fan-out (its wall time is the critical path)
+        max_concurrency: At most this many calls in flight at once (e.g. a provider's rate limit)
+
+    Returns:
+        Stage name -> return value
+
+    Raises:
+        The first exception raised by any call, after all calls have finished
+    """
+    if not calls:
+        return {}
+    group_started = time.perf_counter()
+    # gevent patches threading, so this also bounds greenlets
+    slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+
+    def timed(name: str, call: Callable[[], Any]) -> Callable[[], Any]:
+        def run():
+            if slots:
+                slots.acquire()
+            started = time.perf_counter()
+            try:
+                return call()
+            finally:
+                if timings is not None:
+                    timings.record(name, started)
+                if slots:
+                    slots.release()
+        return run
+
+    def in_context(run: Callable[[], Any]) -> Callable[[], Any]:
+        # Pool threads and new greenlets don't inherit the caller's active recorder
+        context = contextvars.copy_context()
+        return lambda: context.run(run)
+
+    names = list(calls)
+    wrapped = [in_context(timed(name, calls[name])) for name in names]
+    results: Dict[str, Any] = {}
+    errors = []
+
+    if _gevent_patched():
+        import gevent
+        greenlets = [gevent.spawn(fn) for fn in wrapped[:-1]]
+        gevent.sleep(0)  # Let the spawned calls send their requests before the inline call runs
+        try:
+            results[names[-1]] = wrapped[-1]()
+        except Exception as e:
+            errors.append(e)
+        gevent.joinall(greenlets)
+        for name, greenlet in zip(names, greenlets):
+            if greenlet.successful():
+                results[name] = greenlet.value
+            else:
+                errors.append(greenlet.exception)
+    else:
+        futures = [_pool().submit(fn) for fn in wrapped[:-1]]
+        try:
+            results[names[-1]] = wrapped[-1]()
+        except Exception as e:
+            errors.append(e)
+        for name, future in zip(names, futures):
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors.append(e)
+
+    if timings is not None and group:
+        timings.record(group, group_started)
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,29 @@
+"""
+Exclusive file locks shared by every gunicorn worker
+
+Per-user indexes and registries on local disk are updated read-modify-write.
+An in-process lock only serializes one worker's threads, so two workers
+updating the same file would lose each other's changes. flock() on a lock
+file next to the data serializes them across processes (and across threads,
+since each holder opens its own file description).
+"""
+from contextlib import contextmanager
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive lock on path across threads and processes (a no-op without fcntl); not re-entrant"""
+    with open(path, 'a') as f:
+        if FCNTL_AVAILABLE:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -11,7 +11,7 @@ from src.llm_fallback_handler import LLMFallbackHandler
 class GeminiVisionHandler:
     """Handler for Google Gemini Vision API with fallback to other vision models"""
 
-    def __init__(self, config):
+    def __init__(self, config, cache=None):
         self.config = config
         self.logger = logging.getLogger(__name__)
         self.model = None
@@ -31,7 +31,7 @@ class GeminiVisionHandler:
 
         # Initialize fallback vision models
         try:
-            self.fallback_handler = LLMFallbackHandler(config)
+            self.fallback_handler = LLMFallbackHandler(config, cache=cache)
             # Check if any fallback has vision models
             vision_providers = [p for p in self.fallback_handler.providers if p.get('vision_model')]
             if vision_providers:
@@ -0,0 +1,228 @@
+"""
+Hedged LLM requests
+
+Provider latency has a long tail: most answers start streaming within a
+second, but now and then one provider takes many times longer, and that one
+request sets the p99. With hedging on, a request that has not produced its
+first token by the hedge delay is also sent to the next provider in routing
+order. Whichever streams a token first answers; the other stream is closed.
+
+- Delay: the primary's p95 time to first token (recent samples in this
+  process, from ProviderHealth) times LLM_HEDGE_DELAY_FACTOR, clamped to
+  LLM_HEDGE_MIN_DELAY_MS..LLM_HEDGE_MAX_DELAY_MS. Until there are
+  LLM_HEDGE_MIN_SAMPLES, PROVIDER_LATENCY_PRIOR_MS is used.
+- Budget: a token bucket lets at most LLM_HEDGE_BUDGET hedges per request
+  (plus a small burst), so extra provider calls stay a few percent of
+  traffic even while a provider is slow for everyone.
+- Cancellation: the losing attempt is flagged and its stream is closed when
+  its next chunk arrives. A blocking HTTP read can't be interrupted from
+  another thread, so the loser is billed for its prompt and at most one
+  chunk of output. Its elapsed time is recorded as a censored time to first
+  token, so a provider that keeps losing still looks slow to routing and to
+  its own hedge delay.
+
+A failure before the first token falls through to the remaining providers,
+as in the unhedged path. A failure after it ends the answer, since its
+tokens have already been sent.
+"""
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class HedgePolicy:
+    """Hedge delay per provider and the per-process hedge budget"""
+
+    def __init__(self, config, health):
+        """
+        Args:
+            config: Config with LLM_HEDGE_* settings
+            health: ProviderHealth supplying time-to-first-token quantiles
+        """
+        self.enabled = getattr(config, 'LLM_HEDGING_ENABLED', False)
+        self.quantile = getattr(config, 'LLM_HEDGE_QUANTILE', 0.95)
+        self.delay_factor = getattr(config, 'LLM_HEDGE_DELAY_FACTOR', 1.0)
+        self.min_delay_ms = getattr(config, 'LLM_HEDGE_MIN_DELAY_MS', 300.0)
+        self.max_delay_ms = getattr(config, 'LLM_HEDGE_MAX_DELAY_MS', 8000.0)
+        self.min_samples = getattr(config, 'LLM_HEDGE_MIN_SAMPLES', 20)
+        self.prior_ms = getattr(config, 'PROVIDER_LATENCY_PRIOR_MS', 2000.0)
+        self.budget_ratio = getattr(config, 'LLM_HEDGE_BUDGET', 0.05)
+        self.budget_burst = getattr(config, 'LLM_HEDGE_BUDGET_BURST', 2.0)
+        self.health = health
+
+        self._tokens = self.budget_burst
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'hedged': 0, 'hedge_won': 0, 'over_budget': 0}
+
+    def delay_seconds(self, name: str) -> float:
+        p = self.health.ttft_quantile(name, self.quantile, self.min_samples)
+        delay_ms = self.prior_ms if p is None else p * self.delay_factor
+        return min(self.max_delay_ms, max(self.min_delay_ms, delay_ms)) / 1000
+
+    def note_request(self):
+        """Each hedgeable request earns budget_ratio of a hedge"""
+        with self._lock:
+            self.stats['requests'] += 1
+            self._tokens = min(self.budget_burst, self._tokens + self.budget_ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                self.stats['over_budget'] += 1
+                return False
+            self._tokens -= 1
+            self.stats['hedged'] += 1
+            return True
+
+    def note_hedge_won(self):
+        with self._lock:
+            self.stats['hedge_won'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, 'enabled': self.enabled, 'budget_tokens': round(self._tokens, 3),
+                    'budget_ratio': self.budget_ratio}
+
+
+class _Attempt:
+    """One provider call streaming into the race's queue from a worker thread"""
+
+    def __init__(self, provider: Dict[str, Any], model: str, hedge: bool):
+        self.provider = provider
+        self.model = model
+        self.hedge = hedge
+        self.cancelled = threading.Event()
+        self.started = time.perf_counter()
+        self.ttft_ms: Optional[float] = None
+        self.parts: List[str] = []
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    @property
+    def name(self) -> str:
+        return self.provider['name']
+
+    def run(self, chunks: Iterator[str], events: 'queue.Queue'):
+        try:
+            for text in chunks:
+                if self.cancelled.is_set():
+                    break
+                events.put((self, 'token', text))
+            events.put((self, 'done', None))
+        except Exception as e:
+            events.put((self, 'error', e))
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+
+
+def race(candidates: List[Tuple[Dict[str, Any], str]], open_chunks: Callable[[Dict[str, Any], str], Iterator[str]],
+         policy: HedgePolicy) -> Iterator[Dict[str, Any]]:
+    """
+    Stream an answer from the first of the candidates to produce a token
+
+    Args:
+        candidates: (provider, model) in routing order
+        open_chunks: Starts a provider stream; returns an iterator of text deltas (closed to cancel)
+        policy: Hedge delay, budget and ProviderHealth for recording outcomes
+
+    Yields:
+        The same events as LLMFallbackHandler.stream_text, with 'hedged' on the end event
+    """
+    health = policy.health
+    events: 'queue.Queue' = queue.Queue()
+    pending = list(candidates)
+    live: List[_Attempt] = []
+    winner: Optional[_Attempt] = None
+    hedge_decided = hedged = False
+    error_msg = None
+    policy.note_request()
+
+    def launch(hedge: bool = False):
+        provider, model = pending.pop(0)
+        attempt = _Attempt(provider, model, hedge)
+        logger.info(f"{'Hedging with' if hedge else 'Streaming from'} {provider['name']}...")
+        threading.Thread(target=attempt.run, args=(open_chunks(provider, model), events),
+                         name='llm-attempt', daemon=True).start()
+        live.append(attempt)
+
+    def end(attempt: _Attempt, success: bool, **fields) -> Dict[str, Any]:
+        return {'type': 'end', 'success': success, 'answer': ''.join(attempt.parts), 'provider': attempt.name,
+                'model': attempt.model, 'ttft_ms': attempt.ttft_ms, 'hedged': hedged, **fields}
+
+    launch()
+    try:
+        while True:
+            timeout = None
+            if winner is None and not hedge_decided and pending and len(live) == 1:
+                delay = policy.delay_seconds(live[0].name)
+                timeout = max(0.0, delay - (time.perf_counter() - live[0].started))
+            try:
+                attempt, kind, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                # One hedge decision per request: the primary is past its p95
+                hedge_decided = True
+                if policy.try_spend():
+                    hedged = True
+                    logger.info(f"[HEDGE] {live[0].name} has no first token after "
+                                f"{(time.perf_counter() - live[0].started) * 1000:.0f} ms")
+                    launch(hedge=True)
+                continue
+
+            if attempt.cancelled.is_set():
+                continue  # The loser's leftovers
+
+            if kind == 'token':
+                if winner is None:
+                    winner = attempt
+                    attempt.ttft_ms = attempt.elapsed_ms()
+                    health.record_success(attempt.name, attempt.ttft_ms, first_token=True)
+                    logger.info(f"[STREAM] {attempt.name} first token after {attempt.ttft_ms} ms")
+                    for other in live:
+                        if other is not attempt:
+                            other.cancelled.set()
+                            health.record_cancelled(other.name, other.elapsed_ms())
+                    live = [attempt]
+                    if attempt.hedge:
+                        policy.note_hedge_won()
+                attempt.parts.append(payload)
+                yield {'type': 'token', 'text': payload}
+                continue
+
+            if kind == 'done' and attempt is winner:
+                logger.info(f"[SUCCESS] {attempt.name} streamed ({sum(len(p) for p in attempt.parts)} chars)")
+                yield end(attempt, True)
+                return
+
+            error = payload if kind == 'error' else RuntimeError("empty response")
+            error_msg = str(error)
+            health.record_failure(attempt.name, error)
+            if attempt is winner:
+                # Tokens already reached the client; switching provider would splice two answers
+                logger.error(f"{attempt.name} stream broke after first token: {error_msg}")
+                yield end(attempt, False, error=error_msg)
+                return
+
+            logger.warning(f"{attempt.name} failed before first token: {error_msg}")
+            live.remove(attempt)
+            if not live:
+                if not pending:
+                    break
+                launch()
+
+        logger.error("All providers failed!")
+        yield {'type': 'end', 'success': False,
+               'answer': "I apologize, but I'm experiencing technical difficulties. Please try again in a moment.",
+               'provider': 'None', 'model': 'None', 'ttft_ms': None, 'hedged': hedged, 'error': error_msg}
+    finally:
+        # Also reached when the client disconnects mid-answer
+        for attempt in live:
+            attempt.cancelled.set()
+            if attempt.ttft_ms is None:
+                health.record_cancelled(attempt.name, attempt.elapsed_ms())
@@ -0,0 +1,457 @@
+"""
+Ingest-time image manifest and background figure captioning
+
+At upload, build_image_manifest() lists the images on every page (xref, size,
+content hash) with PyMuPDF. Listing only reads the image streams, so it is
+cheap. It never calls the vision model.
+
+- ImageManifestStore keeps the manifest per (user, document) on disk. It also
+  keeps captions, content-addressed and shared across documents and users.
+- FigureCaptioner works through new manifests in a background thread. It
+  makes at most one vision call every IMAGE_CAPTION_INTERVAL seconds, so it
+  stays inside the provider's rate limit and leaves quota for queries. Every
+  gunicorn worker runs one; with Redis, the interval is a single global slot
+  and each image is claimed by one worker, so N workers don't make N times
+  the calls. Without Redis the interval is per process.
+
+Cached manifests are checked against the file's mtime on every read, so a
+re-upload or delete in one worker is seen by the others.
+
+At query time, figure enrichment is a manifest and caption lookup. Pages the
+manifest shows have no images are skipped without opening the PDF.
+
+Layout under IMAGE_MANIFEST_PATH:
+    manifests/{user hash}/{document hash}.json -> {"user_id", "document_name", "pdf_path",
+                                                   "pages": {page index: [{"xref", "width", "height",
+                                                                           "bytes", "hash"}]}}
+    captions/{key[:2]}/{key}.txt
+"""
+import os
+import json
+import math
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from collections import deque, OrderedDict
+from typing import Callable, List, Dict, Any, Optional
+
+try:
+    import fitz  # PyMuPDF
+    FITZ_AVAILABLE = True
+except ImportError:
+    FITZ_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Page-independent, so one caption serves the image wherever it appears
+IMAGE_ANALYSIS_PROMPT = (
+    "Analyze this image from an educational document. Describe all visible content including diagrams, "
+    "chemical structures, equations, charts, graphs, or text."
+)
+IMAGES_PER_PAGE = 2  # First images on a page; the rest are rarely the figure being asked about
+# Shared caption rate slot, and how long one worker's claim on an image lasts if it never finishes
+CAPTION_RATE_LOCK = 'image_caption_rate'
+CAPTION_CLAIM_TTL = 300
+
+
+def _hash(value: str) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]
+
+
+def caption_key(image_hash: str) -> str:
+    """Cache identity of a caption: the image content and the prompt used"""
+    return hashlib.sha256(f"{IMAGE_ANALYSIS_PROMPT}\x00{image_hash}".encode('utf-8')).hexdigest()[:32]
+
+
+def build_image_manifest(pdf_path: str, min_side: int = 48) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    List the captionable images on each page
+
+    Args:
+        pdf_path: PDF to scan
+        min_side: Images narrower or shorter than this (bullets, rules, logos) are left out
+
+    Returns:
+        0-indexed page -> up to IMAGES_PER_PAGE image entries; image-free pages are absent
+    """
+    if not FITZ_AVAILABLE:
+        return {}
+
+    pages: Dict[int, List[Dict[str, Any]]] = {}
+    doc = fitz.open(pdf_path)
+    try:
+        for page_num in range(len(doc)):
+            entries = []
+            for img in doc[page_num].get_images(full=True):
+                xref, width, height = img[0], img[2], img[3]
+                if width < min_side or height < min_side:
+                    continue
+                try:
+                    data = doc.extract_image(xref)["image"]
+                except Exception as e:
+                    logger.debug(f"Skipping unreadable image xref {xref} on page {page_num + 1}: {e}")
+                    continue
+                entries.append({
+                    'xref': xref,
+                    'width': width,
+                    'height': height,
+                    'bytes': len(data),
+                    'hash': hashlib.sha256(data).hexdigest()[:32]
+                })
+                if len(entries) >= IMAGES_PER_PAGE:
+                    break
+            if entries:
+                pages[page_num] = entries
+    finally:
+        doc.close()
+    return pages
+
+
+def extract_images(pdf_path: str, xrefs: List[int]) -> Dict[int, bytes]:
+    """Image bytes by xref (unreadable xrefs are left out)"""
+    images = {}
+    doc = fitz.open(pdf_path)
+    try:
+        for xref in xrefs:
+            try:
+                images[xref] = doc.extract_image(xref)["image"]
+            except Exception as e:
+                logger.warning(f"Could not extract image xref {xref}: {e}")
+    finally:
+        doc.close()
+    return images
+
+
+class ImageManifestStore:
+    """Per-document image manifests and content-addressed captions on disk"""
+
+    MAX_LOADED_MANIFESTS = 256
+
+    def __init__(self, config):
+        base = getattr(config, 'IMAGE_MANIFEST_PATH', './data/image_manifests')
+        self.manifest_dir = os.path.join(base, 'manifests')
+        self.caption_dir = os.path.join(base, 'captions')
+        self.min_side = getattr(config, 'IMAGE_MIN_SIDE', 48)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        os.makedirs(self.caption_dir, exist_ok=True)
+
+        # (user, document) -> (manifest file mtime, manifest)
+        self._manifests: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ========== Manifests ==========
+
+    def index_document(self, user_id: Optional[str], document_name: str, pdf_path: str) -> int:
+        """Build and store a document's manifest; returns the number of images listed"""
+        pages = build_image_manifest(pdf_path, self.min_side)
+        entry = {'user_id': user_id, 'document_name': document_name, 'pdf_path': pdf_path, 'pages': pages}
+        path = self._manifest_path(user_id, document_name)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            self._remember((user_id or '', document_name), os.stat(path).st_mtime_ns, entry)
+
+        count = sum(len(images) for images in pages.values())
+        logger.info(f"🖼️ Image manifest: {count} images on {len(pages)} pages of '{document_name}'")
+        return count
+
+    def get_manifest(self, user_id: Optional[str], document_name: str) -> Optional[Dict[str, Any]]:
+        """Stored manifest, or None for documents indexed before manifests existed"""
+        key = (user_id or '', document_name)
+        path = self._manifest_path(user_id, document_name)
+        with self._lock:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                # Deleted (possibly by another worker)
+                self._manifests.pop(key, None)
+                return None
+
+            cached = self._manifests.get(key)
+            if cached is not None and cached[0] == mtime:
+                self._manifests.move_to_end(key)
+                return cached[1]
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except FileNotFoundError:
+                self._manifests.pop(key, None)
+                return None
+            except Exception as e:
+                logger.warning(f"Image manifest for '{document_name}' unreadable: {e}")
+                return None
+            # JSON object keys are strings
+            entry['pages'] = {int(page): images for page, images in entry.get('pages', {}).items()}
+            self._remember(key, mtime, entry)
+            return entry
+
+    def list_manifests(self) -> List[Dict[str, Any]]:
+        """Every stored manifest (used to resume captioning after a restart)"""
+        manifests = []
+        for user_dir in os.listdir(self.manifest_dir):
+            user_path = os.path.join(self.manifest_dir, user_dir)
+            if not os.path.isdir(user_path):
+                continue
+            for name in os.listdir(user_path):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(user_path, name), 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    manifests.append(self.get_manifest(data.get('user_id'), data['document_name']))
+                except Exception as e:
+                    logger.warning(f"Skipping unreadable image manifest {name}: {e}")
+        return [m for m in manifests if m]
+
+    def delete_document(self, user_id: Optional[str], document_name: str):
+        with self._lock:
+            self._manifests.pop((user_id or '', document_name), None)
+            try:
+                os.remove(self._manifest_path(user_id, document_name))
+            except FileNotFoundError:
+                pass
+
+    def delete_user(self, user_id: str):
+        with self._lock:
+            for key in [key for key in self._manifests if key[0] == (user_id or '')]:
+                del self._manifests[key]
+            shutil.rmtree(os.path.join(self.manifest_dir, _hash(user_id or '')), ignore_errors=True)
+
+    def clear_all(self):
+        """Drop manifests (captions are content-addressed and stay valid)"""
+        with self._lock:
+            self._manifests.clear()
+            shutil.rmtree(self.manifest_dir, ignore_errors=True)
+            os.makedirs(self.manifest_dir, exist_ok=True)
+
+    # ========== Captions ==========
+
+    def get_captions(self, image_hashes: List[str]) -> Dict[str, str]:
+        """Image hash -> stored caption"""
+        captions = {}
+        for image_hash in image_hashes:
+            try:
+                with open(self._caption_path(image_hash), 'r', encoding='utf-8') as f:
+                    captions[image_hash] = f.read()
+            except FileNotFoundError:
+                continue
+        return captions
+
+    def has_caption(self, image_hash: str) -> bool:
+        return os.path.exists(self._caption_path(image_hash))
+
+    def save_captions(self, captions: Dict[str, str]):
+        for image_hash, caption in captions.items():
+            path = self._caption_path(image_hash)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(caption)
+            os.replace(tmp_path, path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        captions = sum(len(files) for _, _, files in os.walk(self.caption_dir))
+        return {'loaded_manifests': len(self._manifests), 'captions': captions}
+
+    # ========== Internals ==========
+
+    def _manifest_path(self, user_id: Optional[str], document_name: str) -> str:
+        return os.path.join(self.manifest_dir, _hash(user_id or ''), f"{_hash(document_name)}.json")
+
+    def _caption_path(self, image_hash: str) -> str:
+        key = caption_key(image_hash)
+        return os.path.join(self.caption_dir, key[:2], f"{key}.txt")
+
+    def _remember(self, key: tuple, mtime: int, entry: Dict[str, Any]):
+        self._manifests[key] = (mtime, entry)
+        self._manifests.move_to_end(key)
+        while len(self._manifests) > self.MAX_LOADED_MANIFESTS:
+            self._manifests.popitem(last=False)
+
+
+class FigureCaptioner:
+    """Throttled background captioning of manifest images"""
+
+    def __init__(self, manifest_store: ImageManifestStore, gemini_vision, config, cache=None,
+                 resolve_pdf: Callable[[Optional[str], str], Optional[str]] = None):
+        """
+        Args:
+            manifest_store: Where manifests are read and captions written
+            gemini_vision: GeminiVisionHandler used for captions
+            config: Config with IMAGE_CAPTION_* settings
+            cache: Optional RedisCacheManager; captions are shared with it so other instances reuse them
+            resolve_pdf: (user_id, document_name) -> current PDF path, for manifests whose file has moved
+        """
+        self.store = manifest_store
+        self.gemini_vision = gemini_vision
+        self.cache = cache
+        self.resolve_pdf = resolve_pdf
+        self.enabled = getattr(config, 'IMAGE_CAPTION_ENABLED', True)
+        self.interval = getattr(config, 'IMAGE_CAPTION_INTERVAL', 4.0)
+        self.cache_ttl = getattr(config, 'IMAGE_DESCRIPTION_CACHE_TTL', 2592000)
+
+        self._queue: 'deque[tuple]' = deque()
+        self._queued = set()
+        self._failed = set()  # Image hashes the vision model couldn't caption (not retried this process)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_call = 0.0
+        self.stats = {'captioned': 0, 'reused': 0, 'failed': 0, 'documents_done': 0}
+
+    def start(self, resume: bool = True):
+        """Start the captioning thread (idempotent); resume queues manifests left uncaptioned"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(resume,), name='figure-captioner', daemon=True)
+        self._thread.start()
+        logger.info(f"🖼️ Figure captioning started (one vision call per {self.interval}s)")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def enqueue(self, user_id: Optional[str], document_name: str):
+        if not self.enabled:
+            return
+        key = (user_id, document_name)
+        with self._lock:
+            if key in self._queued:
+                return
+            self._queued.add(key)
+            self._queue.append(key)
+        self.start(resume=False)
+        self._wake.set()
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            queued = len(self._queue)
+        return {
+            'enabled': self.enabled,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'interval_s': self.interval,
+            'queued_documents': queued,
+            **self.stats,
+            **self.store.get_stats()
+        }
+
+    def _loop(self, resume: bool):
+        if resume:
+            try:
+                for manifest in self.store.list_manifests():
+                    if self._pending_images(manifest):
+                        self.enqueue(manifest['user_id'], manifest['document_name'])
+            except Exception as e:
+                logger.error(f"Could not resume figure captioning: {e}")
+
+        while not self._stop.is_set():
+            with self._lock:
+                key = self._queue.popleft() if self._queue else None
+            if key is None:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            try:
+                self._caption_document(*key)
+            except Exception as e:
+                logger.error(f"Figure captioning failed for '{key[1]}': {e}")
+            finally:
+                with self._lock:
+                    self._queued.discard(key)
+
+    def _pending_images(self, manifest: Dict[str, Any]) -> List[Dict[str, Any]]:
+        seen, pending = set(), []
+        for page in sorted(manifest['pages']):
+            for image in manifest['pages'][page]:
+                image_hash = image['hash']
+                if image_hash in seen or image_hash in self._failed or self.store.has_caption(image_hash):
+                    continue
+                seen.add(image_hash)
+                pending.append(image)
+        return pending
+
+    def _caption_document(self, user_id: Optional[str], document_name: str):
+        manifest = self.store.get_manifest(user_id, document_name)
+        if not manifest or not self.gemini_vision.is_available():
+            return
+        pending = self._pending_images(manifest)
+        if not pending:
+            return
+
+        # Another instance (or an earlier query) may already have described some of them
+        if self.cache:
+            shared = self.cache.get_cached_image_descriptions([caption_key(i['hash']) for i in pending])
+            reused = {i['hash']: shared[caption_key(i['hash'])] for i in pending if caption_key(i['hash']) in shared}
+            self.store.save_captions(reused)
+            self.stats['reused'] += len(reused)
+            pending = [i for i in pending if i['hash'] not in reused]
+
+        pdf_path = manifest['pdf_path']
+        if not os.path.exists(pdf_path) and self.resolve_pdf:
+            pdf_path = self.resolve_pdf(user_id, document_name)
+        if not pdf_path or not os.path.exists(pdf_path):
+            logger.warning(f"Figure captioning: PDF for '{document_name}' is gone")
+            return
+
+        images = extract_images(pdf_path, [i['xref'] for i in pending])
+        for image in pending:
+            if self._stop.is_set():
+                return
+            data = images.get(image['xref'])
+            if data is None:
+                continue
+
+            claim = self._claim(image['hash'])
+            if claim is None:
+                continue  # Another worker is captioning it
+            try:
+                if self.store.has_caption(image['hash']):
+                    continue  # Finished by another worker meanwhile
+                self._wait_for_slot()
+                if self._stop.is_set():
+                    return
+
+                caption = self.gemini_vision.describe_image(data, prompt=IMAGE_ANALYSIS_PROMPT)
+                if not caption:
+                    self._failed.add(image['hash'])
+                    self.stats['failed'] += 1
+                    continue
+                self.store.save_captions({image['hash']: caption})
+                if self.cache:
+                    self.cache.cache_image_descriptions({caption_key(image['hash']): caption}, ttl=self.cache_ttl)
+                self.stats['captioned'] += 1
+            finally:
+                if self.cache:
+                    self.cache.release_lock(f"image_caption:{caption_key(image['hash'])}", claim)
+
+        self.stats['documents_done'] += 1
+        logger.info(f"🖼️ Captioned figures of '{document_name}' ({self.stats['captioned']} total)")
+
+    def _claim(self, image_hash: str) -> Optional[str]:
+        """Claim an image for this worker; None if another worker holds it"""
+        if not self.cache:
+            return 'local'
+        return self.cache.acquire_lock(f"image_caption:{caption_key(image_hash)}", CAPTION_CLAIM_TTL)
+
+    def _wait_for_slot(self):
+        """
+        Block until the next vision call may be made
+
+        With Redis, a lock left to expire after IMAGE_CAPTION_INTERVAL (rounded up
+        to whole seconds) is the one slot every worker takes turns on.
+        """
+        wait = self._last_call + self.interval - time.monotonic()
+        if wait > 0:
+            self._stop.wait(wait)
+        if self.cache:
+            ttl = max(1, math.ceil(self.interval))
+            while not self._stop.is_set() and not self.cache.acquire_lock(CAPTION_RATE_LOCK, ttl):
+                self._stop.wait(min(ttl, 1.0))
+        self._last_call = time.monotonic()
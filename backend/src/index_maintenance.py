@@ -0,0 +1,161 @@
+"""
+Background vector index maintenance
+
+Deleted chunks leave tombstoned nodes in HNSW graphs (Chroma's segment index
+and the FAISS hnsw backend). They still cost memory, disk and traversal time
+until the index is rebuilt. IndexMaintainer watches the tombstone ratio and,
+once it crosses Config.INDEX_COMPACTION_RATIO, rebuilds the index from live
+vectors and swaps the result in.
+
+The rebuild is throttled: before every page it sleeps briefly and then waits
+until no search has run for a short quiet period. Every gunicorn worker runs a
+maintainer; a Redis lock lets only one of them compact at a time.
+
+The quiet period only counts searches in the compacting worker's own process.
+With several workers, searches served by the others don't pause the rebuild,
+and under gevent each page copy also holds up the compacting worker's other
+requests while it runs. To limit the impact, keep compactions rare
+(INDEX_COMPACTION_RATIO) or force them off-peak from the admin endpoint.
+"""
+import time
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+from .vector_store import CompactableVectorStore
+
+logger = logging.getLogger(__name__)
+
+
+class IndexMaintainer:
+    """Monitors index fragmentation and runs throttled background compactions"""
+
+    # Seconds without searches before a compaction page may run
+    QUIET_PERIOD_S = 0.5
+
+    # Poll interval while waiting for searches to finish
+    IDLE_POLL_S = 0.1
+
+    # Shared compaction lock; expires on its own if the holding worker dies mid-rebuild
+    LOCK_NAME = 'index_compaction'
+    LOCK_TTL_S = 3600
+
+    def __init__(self, vector_store, config, cache=None):
+        """
+        Initialize the maintainer
+
+        Args:
+            vector_store: Active VectorStore (maintenance is a no-op unless it supports compaction)
+            config: Config with INDEX_* maintenance settings
+            cache: Optional RedisCacheManager for the cross-worker compaction lock
+        """
+        self.vector_store = vector_store
+        self.cache = cache
+        self.enabled = isinstance(vector_store, CompactableVectorStore)
+        self.interval = getattr(config, 'INDEX_MAINTENANCE_INTERVAL', 600)
+        self.ratio_threshold = getattr(config, 'INDEX_COMPACTION_RATIO', 0.2)
+        self.min_tombstones = getattr(config, 'INDEX_COMPACTION_MIN_TOMBSTONES', 500)
+        self.page_delay = getattr(config, 'INDEX_COMPACTION_PAGE_DELAY', 0.05)
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._force = False
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def start(self):
+        """Start the periodic maintenance thread (idempotent)"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='index-maintenance', daemon=True)
+        self._thread.start()
+        logger.info(f"🔧 Index maintenance started (every {self.interval}s, "
+                    f"compact at {self.ratio_threshold:.0%} tombstones)")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def trigger(self, force: bool = False) -> bool:
+        """
+        Ask the maintenance thread to check now
+
+        Args:
+            force: Compact even if the tombstone ratio is below the threshold
+
+        Returns:
+            False if this backend doesn't support compaction
+        """
+        if not self.enabled:
+            return False
+        self.start()
+        self._force = self._force or force
+        self._wake.set()
+        return True
+
+    def get_status(self) -> Dict[str, Any]:
+        """Current index metrics plus the outcome of the last maintenance run"""
+        if not self.enabled:
+            return {'enabled': False, 'reason': 'vector store backend does not support compaction'}
+        return {
+            'enabled': True,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'interval_s': self.interval,
+            'ratio_threshold': self.ratio_threshold,
+            'min_tombstones': self.min_tombstones,
+            'metrics': self.vector_store.get_index_metrics(),
+            'last_run': self.last_run
+        }
+
+    def needs_compaction(self, metrics: Dict[str, Any]) -> bool:
+        return (metrics['tombstones'] >= self.min_tombstones
+                and metrics['tombstone_ratio'] >= self.ratio_threshold)
+
+    def run_once(self, force: bool = False) -> Optional[Dict[str, Any]]:
+        """Check metrics and compact if needed; returns the compaction result or None"""
+        metrics = self.vector_store.get_index_metrics()
+        if not force and not self.needs_compaction(metrics):
+            return None
+
+        logger.info(f"🔧 Compacting vector index: {metrics['tombstones']} tombstones "
+                    f"({metrics['tombstone_ratio']:.1%}), {metrics['index_bytes'] / 1024 / 1024:.1f}MB")
+        token = self.cache.acquire_lock(self.LOCK_NAME, self.LOCK_TTL_S) if self.cache else None
+        if self.cache and not token:
+            logger.info("🔧 Another worker is compacting the vector index, skipping")
+            return None
+        try:
+            result = self.vector_store.compact(throttle=self._throttle)
+        finally:
+            if token:
+                self.cache.release_lock(self.LOCK_NAME, token)
+        after = self.vector_store.get_index_metrics()
+
+        self.last_run = {
+            'finished_at': time.time(),
+            'forced': force,
+            'result': result,
+            'before': {k: metrics[k] for k in ('live_vectors', 'tombstones', 'tombstone_ratio', 'index_bytes')},
+            'after': {k: after[k] for k in ('live_vectors', 'tombstones', 'tombstone_ratio', 'index_bytes')}
+        }
+        return result
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+
+            force, self._force = self._force, False
+            try:
+                self.run_once(force=force)
+            except Exception as e:
+                logger.error(f"Index maintenance failed: {e}")
+
+    def _throttle(self):
+        """Pace compaction pages and wait out search traffic in this process (other workers aren't seen)"""
+        time.sleep(self.page_delay)
+        activity = self.vector_store.query_activity
+        while activity.idle_for() < self.QUIET_PERIOD_S and not self._stop.is_set():
+            time.sleep(self.IDLE_POLL_S)
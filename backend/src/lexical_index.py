@@ -0,0 +1,409 @@
+"""
+Per-user BM25 inverted index for hybrid (lexical + vector) retrieval
+
+MiniLM embeddings blur exact terms such as formulas (H2SO4), chemical names
+and section numbers (3.2.1). This index scores those terms with BM25 so
+SmartRetriever can fuse lexical and vector rankings.
+
+Layout per user (CSR, all NumPy):
+- forward rows:  doc_indptr / doc_terms / doc_tfs  (chunk -> term ids, term counts)
+- postings:      post_indptr / post_docs / post_tfs (term id -> chunk rows, term counts)
+
+The forward rows are persisted (.npz) and are the source of truth; postings are
+derived with one argsort. Ingest appends rows and delete drops them, so updates
+are incremental per document, and the query path is a handful of array slices.
+Loaded indexes are checked against the .npz mtime on every access, so writes
+from other gunicorn workers are picked up.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from .file_lock import file_lock
+from .vector_store import matches_filters
+
+logger = logging.getLogger(__name__)
+
+# Words plus the Indic blocks Devanagari..Sinhala (vowel signs and viramas aren't \w), combining
+# marks and ZWNJ/ZWJ, so "ಕೀಟೋನ್‌ಗಳು" stays one word; keeps "3.2.1", "h2so4", "ch3-ch2-oh" intact
+WORD_CHARS = r"\w\u0300-\u036F\u0900-\u0DFF\u200C\u200D"
+TOKEN_PATTERN = re.compile(rf"[{WORD_CHARS}]+(?:[.\-/][{WORD_CHARS}]+)*")
+# Zero-width joiners are optional in typed Indic text; dropped so both spellings match
+ZERO_WIDTH = re.compile(r"[\u200C\u200D]")
+TOKEN_SEPARATORS = re.compile(r"[.\-/]")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were
+what which who whom how why when where with does do did can could should would will about
+explain describe tell me give show list please
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms; compound terms are indexed whole and by their parts"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        token = ZERO_WIDTH.sub('', token)
+        if not token or token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if TOKEN_SEPARATORS.search(token):
+            tokens.extend(part for part in TOKEN_SEPARATORS.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+
+class _UserIndex:
+    """Immutable BM25 index for one user; updates build a new instance so searches never see a partial update"""
+
+    def __init__(self, terms: List[str], chunk_ids: List[str], contents: List[str],
+                 metadatas: List[Dict[str, Any]], doc_indptr: np.ndarray, doc_terms: np.ndarray,
+                 doc_tfs: np.ndarray):
+        self.terms = terms
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.chunk_ids = chunk_ids
+        self.contents = contents
+        self.metadatas = metadatas
+        self.doc_indptr = doc_indptr.astype(np.int64)
+        self.doc_terms = doc_terms.astype(np.int32)
+        self.doc_tfs = doc_tfs.astype(np.float32)
+
+        n = len(chunk_ids)
+        rows = np.repeat(np.arange(n, dtype=np.int32), np.diff(self.doc_indptr))
+        self.doc_lens = np.bincount(rows, weights=self.doc_tfs, minlength=n).astype(np.float32)
+        self.avg_len = float(self.doc_lens.mean()) if n else 0.0
+
+        order = np.argsort(self.doc_terms, kind='stable')
+        self.post_docs = rows[order]
+        self.post_tfs = self.doc_tfs[order]
+        self.df = np.bincount(self.doc_terms, minlength=len(terms))
+        self.post_indptr = np.concatenate([[0], np.cumsum(self.df)]).astype(np.int64)
+
+        self.document_names = np.array([m.get('document_name', '') for m in metadatas], dtype=str)
+
+    @classmethod
+    def empty(cls) -> '_UserIndex':
+        return cls([], [], [], [], np.zeros(1, np.int64), np.zeros(0, np.int32), np.zeros(0, np.float32))
+
+    @property
+    def size(self) -> int:
+        return len(self.chunk_ids)
+
+    def with_document(self, chunk_ids: List[str], contents: List[str],
+                      metadatas: List[Dict[str, Any]]) -> '_UserIndex':
+        """New index with the given chunks appended"""
+        terms = list(self.terms)
+        vocab = dict(self.vocab)
+        new_terms, new_tfs, new_lengths = [], [], []
+        for content in contents:
+            counts = Counter(tokenize(content))
+            for term, count in counts.items():
+                term_id = vocab.get(term)
+                if term_id is None:
+                    term_id = vocab[term] = len(terms)
+                    terms.append(term)
+                new_terms.append(term_id)
+                new_tfs.append(count)
+            new_lengths.append(len(counts))
+
+        indptr = np.concatenate([self.doc_indptr, self.doc_indptr[-1] + np.cumsum(new_lengths, dtype=np.int64)])
+        return _UserIndex(
+            terms,
+            self.chunk_ids + chunk_ids,
+            self.contents + contents,
+            self.metadatas + metadatas,
+            indptr,
+            np.concatenate([self.doc_terms, np.asarray(new_terms, dtype=np.int32)]),
+            np.concatenate([self.doc_tfs, np.asarray(new_tfs, dtype=np.float32)])
+        )
+
+    def without_rows(self, drop: np.ndarray) -> '_UserIndex':
+        """New index without the masked rows; unused terms are dropped from the vocabulary"""
+        keep = ~drop
+        entry_keep = np.repeat(keep, np.diff(self.doc_indptr))
+        doc_terms = self.doc_terms[entry_keep]
+        doc_tfs = self.doc_tfs[entry_keep]
+        lengths = np.diff(self.doc_indptr)[keep]
+
+        used, remapped = np.unique(doc_terms, return_inverse=True)
+        kept_rows = np.flatnonzero(keep)
+        return _UserIndex(
+            [self.terms[i] for i in used],
+            [self.chunk_ids[i] for i in kept_rows],
+            [self.contents[i] for i in kept_rows],
+            [self.metadatas[i] for i in kept_rows],
+            np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]),
+            remapped.astype(np.int32),
+            doc_tfs
+        )
+
+    def filter_mask(self, document_filter: str = None, filters: Dict[str, Any] = None) -> Optional[np.ndarray]:
+        if not document_filter and not filters:
+            return None
+        mask = np.ones(self.size, dtype=bool)
+        if document_filter:
+            mask &= self.document_names == document_filter
+        if filters:
+            if filters.get('documents'):
+                mask &= np.isin(self.document_names, list(filters['documents']))
+            if filters.get('chunk_types') or filters.get('page_range') or filters.get('pages'):
+                mask &= np.fromiter((matches_filters(m, filters) for m in self.metadatas), dtype=bool, count=self.size)
+        return mask
+
+    def scores(self, query: str, k1: float, b: float) -> np.ndarray:
+        """BM25 score of every chunk for the query"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        n = self.size
+        for term_id in term_ids:
+            start, end = self.post_indptr[term_id], self.post_indptr[term_id + 1]
+            if start == end:
+                continue
+            docs = self.post_docs[start:end]
+            tfs = self.post_tfs[start:end]
+            df = end - start
+            idf = np.log1p((n - df + 0.5) / (df + 0.5))
+            norm = k1 * (1 - b + b * self.doc_lens[docs] / self.avg_len)
+            # Each chunk appears once per term's postings, so fancy-index += is safe
+            scores[docs] += idf * tfs * (k1 + 1) / (tfs + norm)
+        return scores
+
+
+class LexicalIndex:
+    """Per-user BM25 indexes, persisted to disk and kept warm in a bounded LRU"""
+
+    # Tenants kept in memory
+    MAX_LOADED_USERS = 256
+
+    def __init__(self, config, vector_store=None):
+        """
+        Initialize the index manager
+
+        Args:
+            config: Config with LEXICAL_INDEX_PATH and BM25 parameters
+            vector_store: Used to backfill users whose chunks predate the lexical index
+        """
+        self.index_dir = getattr(config, 'LEXICAL_INDEX_PATH', './data/lexical_index')
+        self.k1 = getattr(config, 'BM25_K1', 1.5)
+        self.b = getattr(config, 'BM25_B', 0.75)
+        self.vector_store = vector_store
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        # user -> (.npz mtime, index)
+        self._users: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.RLock()
+
+    # ========== Updates ==========
+
+    def add_document(self, user_id: str, document_name: str, chunks: List) -> int:
+        """Index a document's chunks for a user (replaces an earlier upload with the same name)"""
+        if not user_id or not chunks:
+            return 0
+
+        contents, metadatas, chunk_ids = [], [], []
+        for i, chunk in enumerate(chunks):
+            page_num = getattr(chunk, 'page_number', 1)
+            contents.append(chunk.content)
+            metadata = {
+                'document_name': document_name,
+                'chunk_type': getattr(chunk, 'chunk_type', 'text'),
+                'page_number': int(page_num) if page_num else 1,
+                'user_id': user_id
+            }
+            chunk_index = (getattr(chunk, 'metadata', None) or {}).get('chunk_index')
+            if chunk_index is not None:
+                metadata['chunk_index'] = int(chunk_index)
+            metadatas.append(metadata)
+            chunk_ids.append(f"{user_id}_{document_name}_{i}")
+
+        with self._lock, self._user_lock(user_id):
+            index = self._get(user_id)
+            if index.size:
+                index = index.without_rows(index.document_names == document_name)
+            self._set(user_id, index.with_document(chunk_ids, contents, metadatas))
+
+        logger.info(f"✅ Lexical index: {len(chunks)} chunks from '{document_name}' (user: {user_id})")
+        return len(chunks)
+
+    def delete_document(self, user_id: str, document_name: str) -> int:
+        """Drop a document's chunks from a user's index"""
+        if not user_id:
+            return 0
+        with self._lock, self._user_lock(user_id):
+            index = self._get(user_id)
+            drop = index.document_names == document_name
+            deleted = int(drop.sum())
+            if deleted:
+                self._set(user_id, index.without_rows(drop))
+        return deleted
+
+    def delete_user(self, user_id: str):
+        """Remove a user's index from memory and disk"""
+        with self._lock, self._user_lock(user_id):
+            self._users.pop(user_id, None)
+            try:
+                os.remove(self._path(user_id))
+            except FileNotFoundError:
+                pass
+
+    def clear_all(self):
+        with self._lock:
+            self._users.clear()
+            for filename in os.listdir(self.index_dir):
+                if filename.endswith('.npz'):
+                    os.remove(os.path.join(self.index_dir, filename))
+
+    # ========== Search ==========
+
+    def search(self, user_id: str, query: str, n_results: int = 10, document_filter: str = None,
+               filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        BM25 search over one user's chunks
+
+        Returns:
+            Results (content, metadata, score, id) best first; only chunks sharing a term with the query
+        """
+        if not user_id:
+            return []
+
+        try:
+            index = self._get(user_id)
+            if not index.size:
+                return []
+
+            scores = index.scores(query, self.k1, self.b)
+            mask = index.filter_mask(document_filter, filters)
+            if mask is not None:
+                scores[~mask] = 0.0
+
+            hits = np.flatnonzero(scores > 0)
+            if len(hits) > n_results:
+                hits = hits[np.argpartition(-scores[hits], n_results - 1)[:n_results]]
+            hits = hits[np.argsort(-scores[hits], kind='stable')]
+
+            return [
+                {
+                    'id': index.chunk_ids[i],
+                    'content': index.contents[i],
+                    'metadata': dict(index.metadatas[i]),
+                    'score': float(scores[i])
+                }
+                for i in hits
+            ]
+        except Exception as e:
+            logger.error(f"Lexical search failed: {e}")
+            return []
+
+    # ========== Storage ==========
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.index_dir, f"{hashlib.sha256(user_id.encode()).hexdigest()[:16]}.npz")
+
+    def _user_lock(self, user_id: str):
+        """Held across load-modify-save of the user's .npz, so other workers' updates aren't lost"""
+        return file_lock(f"{self._path(user_id)[:-len('.npz')]}.lock")
+
+    def _get(self, user_id: str) -> _UserIndex:
+        with self._lock:
+            try:
+                mtime = os.stat(self._path(user_id)).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+
+            cached = self._users.get(user_id)
+            if cached is not None and mtime is not None and cached[0] == mtime:
+                self._users.move_to_end(user_id)
+                return cached[1]
+
+            # Not loaded, or rewritten/deleted by another worker
+            index = self._load(user_id) if mtime is not None else None
+            if index is None:
+                index = self._backfill(user_id)
+                try:
+                    mtime = os.stat(self._path(user_id)).st_mtime_ns
+                except FileNotFoundError:
+                    mtime = None  # Backfill failed and wasn't saved: retried on next access
+            self._remember(user_id, mtime, index)
+            return index
+
+    def _set(self, user_id: str, index: _UserIndex):
+        self._remember(user_id, self._save(user_id, index), index)
+
+    def _remember(self, user_id: str, mtime: int, index: _UserIndex):
+        self._users[user_id] = (mtime, index)
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.MAX_LOADED_USERS:
+            self._users.popitem(last=False)
+
+    def _save(self, user_id: str, index: _UserIndex, overwrite: bool = True) -> int:
+        """
+        Write the index atomically; returns the file's new mtime
+
+        Args:
+            overwrite: False to write only if no index file exists (raises FileExistsError)
+        """
+        path = self._path(user_id)
+        payload = json.dumps({
+            'terms': index.terms,
+            'chunk_ids': index.chunk_ids,
+            'contents': index.contents,
+            'metadatas': index.metadatas
+        }).encode('utf-8')
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            # Uncompressed: zlib dominated ingest time and indexes are small per tenant
+            np.savez(
+                f,
+                doc_indptr=index.doc_indptr,
+                doc_terms=index.doc_terms,
+                doc_tfs=index.doc_tfs,
+                payload=np.frombuffer(payload, dtype=np.uint8)
+            )
+        if overwrite:
+            os.replace(tmp_path, path)
+        else:
+            try:
+                os.link(tmp_path, path)  # Fails instead of replacing an index another worker just wrote
+            finally:
+                os.remove(tmp_path)
+        return os.stat(path).st_mtime_ns
+
+    def _load(self, user_id: str) -> Optional[_UserIndex]:
+        path = self._path(user_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as archive:
+                payload = json.loads(archive['payload'].tobytes().decode('utf-8'))
+                return _UserIndex(payload['terms'], payload['chunk_ids'], payload['contents'],
+                                  payload['metadatas'], archive['doc_indptr'], archive['doc_terms'],
+                                  archive['doc_tfs'])
+        except Exception as e:
+            logger.warning(f"Rebuilding unreadable lexical index for user {user_id}: {e}")
+            return None
+
+    def _backfill(self, user_id: str) -> _UserIndex:
+        """Build a user's index from the vector store (chunks ingested before hybrid search)"""
+        index = _UserIndex.empty()
+        if self.vector_store is not None:
+            try:
+                chunks = self.vector_store.get_user_chunks(user_id)
+                if chunks['ids']:
+                    index = index.with_document(chunks['ids'], chunks['documents'], chunks['metadatas'])
+                    logger.info(f"🔧 Backfilled lexical index for user {user_id} ({index.size} chunks)")
+            except Exception as e:
+                logger.warning(f"Lexical backfill failed for user {user_id}: {e}")
+                return index
+        try:
+            # Runs outside the user lock on the search path: never clobber a concurrent update
+            self._save(user_id, index, overwrite=False)
+        except FileExistsError:
+            return self._load(user_id) or index
+        return index
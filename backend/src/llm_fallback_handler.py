@@ -4,25 +4,39 @@ Supports: Groq, SambaNova, OpenRouter, Together AI
 Includes: Text and Vision models
 """
 import os
+import time
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterator
 import openai
 from openai import OpenAI
 
+from src.provider_health import ProviderHealth
+from src.hedging import HedgePolicy, race
+
 logger = logging.getLogger(__name__)
 
 
 class LLMFallbackHandler:
     """
     Handles LLM requests with automatic fallback across multiple providers
-    Cascade: Groq → SambaNova → OpenRouter → Together AI
+    Preference: Groq → SambaNova → OpenRouter → Hugging Face, reordered per
+    request by ProviderHealth (fastest healthy first, rate-limited and tripped
+    providers skipped)
     """
 
-    def __init__(self, config):
-        """Initialize all LLM providers"""
+    def __init__(self, config, cache=None):
+        """
+        Initialize all LLM providers
+
+        Args:
+            config: Config object with provider keys and PROVIDER_* routing settings
+            cache: Optional RedisCacheManager so provider health is shared across workers
+        """
         self.config = config
         self.providers = []
-        self.current_provider_index = 0
+        self.health = ProviderHealth(config, cache)
+        # Optional: re-send a request whose first token is later than the provider's p95
+        self.hedging = HedgePolicy(config, self.health)
 
         # Initialize providers in order of preference
         self._init_groq()
@@ -123,6 +137,42 @@ class LLMFallbackHandler:
         except Exception as e:
             logger.warning(f"Hugging Face initialization failed: {e}")
 
+    @staticmethod
+    def _vision_key(name: str) -> str:
+        """Health key for a provider's vision model (its failures mustn't open the text route)"""
+        return f"{name}:vision"
+
+    def _route(self, providers: List[Dict[str, Any]], vision: bool = False) -> List[Dict[str, Any]]:
+        """Providers in the order ProviderHealth recommends for this request"""
+        by_key = {(self._vision_key(p['name']) if vision else p['name']): p for p in providers}
+        return [by_key[key] for key in self.health.order(list(by_key))]
+
+    def _text_chunks(self, provider: Dict[str, Any], model: str, messages: List[Dict[str, str]],
+                     max_tokens: int) -> Iterator[str]:
+        """Content deltas of one streamed completion; closing the generator closes the HTTP stream"""
+        stream = provider['client'].chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=provider['temperature'],
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+
+    def _race(self, providers: List[Dict[str, Any]], question: str, messages: List[Dict[str, str]],
+              max_tokens: int) -> Iterator[Dict[str, Any]]:
+        """stream_text events from a hedged race over the routed providers"""
+        candidates = [(provider, self._text_model(provider, question)) for provider in providers]
+        return race(candidates, lambda provider, model: self._text_chunks(provider, model, messages, max_tokens),
+                    self.hedging)
+
     def _is_complex_query(self, question: str) -> bool:
         """Determine if query is complex (needs reasoning model)"""
         complex_keywords = [
@@ -132,6 +182,12 @@ class LLMFallbackHandler:
         question_lower = question.lower()
         return any(keyword in question_lower for keyword in complex_keywords)
 
+    def _text_model(self, provider: Dict[str, Any], question: str) -> str:
+        """Choose model based on query complexity (for OpenRouter)"""
+        if provider['name'] == 'OpenRouter' and 'text_model_simple' in provider:
+            return provider['text_model_simple'] if not self._is_complex_query(question) else provider['text_model']
+        return provider['text_model']
+
     def _build_messages(self, question: str, conversation_history: List[str],
                        system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
         """Build message array for OpenAI-compatible API"""
@@ -175,19 +231,28 @@ class LLMFallbackHandler:
         if conversation_history is None:
             conversation_history = []
 
-        # Try each provider in order
-        for i, provider in enumerate(self.providers):
+        providers = self._route(self.providers)
+        if self.hedging.enabled and len(providers) > 1:
+            # Streamed internally so the slower attempt can be cut off; token usage isn't reported
+            messages = self._build_messages(question, conversation_history, system_prompt)
+            events = self._race(providers, question, messages, max_tokens)
+            result = next(event for event in events if event['type'] == 'end')
+            result.pop('type')
+            result['tokens_used'] = 0
+            return result
+
+        error_msg = None
+
+        # Try each provider, best first
+        for provider in providers:
+            started = time.perf_counter()
             try:
                 logger.info(f"Trying {provider['name']}...")
 
                 # Build messages
                 messages = self._build_messages(question, conversation_history, system_prompt)
 
-                # Choose model based on query complexity (for OpenRouter)
-                if provider['name'] == 'OpenRouter' and 'text_model_simple' in provider:
-                    model = provider['text_model_simple'] if not self._is_complex_query(question) else provider['text_model']
-                else:
-                    model = provider['text_model']
+                model = self._text_model(provider, question)
 
                 # Make API call
                 response = provider['client'].chat.completions.create(
@@ -198,6 +263,7 @@ class LLMFallbackHandler:
                 )
 
                 answer = response.choices[0].message.content
+                self.health.record_success(provider['name'], (time.perf_counter() - started) * 1000)
 
                 logger.info(f"[SUCCESS] {provider['name']} responded ({len(answer)} chars)")
 
@@ -211,34 +277,88 @@ class LLMFallbackHandler:
 
             except Exception as e:
                 error_msg = str(e)
-                logger.warning(f"{provider['name']} failed: {error_msg}")
+                self.health.record_failure(provider['name'], e)
+                logger.warning(f"{provider['name']} failed: {error_msg}, trying next provider...")
 
-                # Check if it's a quota error
-                if 'rate' in error_msg.lower() or 'quota' in error_msg.lower() or '429' in error_msg:
-                    logger.warning(f"{provider['name']} quota exceeded, trying next provider...")
-                    continue
-                elif i == len(self.providers) - 1:
-                    # Last provider also failed
-                    logger.error("All providers failed!")
-                    return {
-                        'success': False,
-                        'answer': "I apologize, but I'm experiencing technical difficulties. Please try again in a moment.",
-                        'provider': 'None',
-                        'model': 'None',
-                        'error': error_msg
-                    }
-                else:
-                    # Try next provider
-                    continue
-
-        # Should not reach here, but just in case
+        logger.error("All providers failed!")
         return {
             'success': False,
-            'answer': "Service temporarily unavailable. Please try again later.",
+            'answer': "I apologize, but I'm experiencing technical difficulties. Please try again in a moment.",
             'provider': 'None',
-            'model': 'None'
+            'model': 'None',
+            'error': error_msg
         }
 
+    def stream_text(self, question: str, conversation_history: List[str] = None,
+                    system_prompt: Optional[str] = None,
+                    max_tokens: int = 2000) -> Iterator[Dict[str, Any]]:
+        """
+        Stream a text answer token by token, with fallback until the first token
+
+        A provider that fails before producing any text (connection error, 429,
+        empty stream) is skipped like in query_text(). Once text has been sent
+        the answer is committed to that provider: a mid-stream failure ends the
+        stream with success=False and the partial answer.
+
+        With LLM_HEDGING_ENABLED, a provider that is slower than its p95 to the
+        first token is raced against the next one (see src/hedging.py).
+
+        Yields:
+            {'type': 'token', 'text': str} for each content delta, then one
+            {'type': 'end', 'success', 'answer', 'provider', 'model', 'ttft_ms', ['hedged'], ['error']}
+        """
+        if conversation_history is None:
+            conversation_history = []
+
+        messages = self._build_messages(question, conversation_history, system_prompt)
+        providers = self._route(self.providers)
+        if self.hedging.enabled and len(providers) > 1:
+            yield from self._race(providers, question, messages, max_tokens)
+            return
+
+        error_msg = None
+
+        for provider in providers:
+            model = self._text_model(provider, question)
+            started = time.perf_counter()
+            parts: List[str] = []
+            ttft_ms = None
+            try:
+                logger.info(f"Streaming from {provider['name']}...")
+                for text in self._text_chunks(provider, model, messages, max_tokens):
+                    if ttft_ms is None:
+                        ttft_ms = round((time.perf_counter() - started) * 1000, 2)
+                        # Time to first token is what the user waits on, so that's what routing compares
+                        self.health.record_success(provider['name'], ttft_ms, first_token=True)
+                        logger.info(f"[STREAM] {provider['name']} first token after {ttft_ms} ms")
+                    parts.append(text)
+                    yield {'type': 'token', 'text': text}
+
+                if not parts:
+                    raise RuntimeError("empty response")
+
+                logger.info(f"[SUCCESS] {provider['name']} streamed ({sum(len(p) for p in parts)} chars)")
+                yield {'type': 'end', 'success': True, 'answer': ''.join(parts),
+                       'provider': provider['name'], 'model': model, 'ttft_ms': ttft_ms}
+                return
+
+            except Exception as e:
+                error_msg = str(e)
+                self.health.record_failure(provider['name'], e)
+                if parts:
+                    # Tokens already reached the client; switching provider would splice two answers
+                    logger.error(f"{provider['name']} stream broke after first token: {error_msg}")
+                    yield {'type': 'end', 'success': False, 'answer': ''.join(parts),
+                           'provider': provider['name'], 'model': model, 'ttft_ms': ttft_ms,
+                           'error': error_msg}
+                    return
+                logger.warning(f"{provider['name']} failed before first token: {error_msg}, trying next provider...")
+
+        logger.error("All providers failed!")
+        yield {'type': 'end', 'success': False,
+               'answer': "I apologize, but I'm experiencing technical difficulties. Please try again in a moment.",
+               'provider': 'None', 'model': 'None', 'ttft_ms': None, 'error': error_msg}
+
     def query_vision(self, question: str, image_data: Any,
                     conversation_history: List[str] = None,
                     system_prompt: Optional[str] = None) -> Dict[str, Any]:
@@ -269,8 +389,11 @@ class LLMFallbackHandler:
                 'model': 'None'
             }
 
-        # Try each vision provider
+        # Try each vision provider in routing order. Vision models are tracked under their own
+        # health keys and don't update latency: image analysis times aren't comparable with text answers
+        vision_providers = self._route(vision_providers, vision=True)
         for i, provider in enumerate(vision_providers):
+            health_key = self._vision_key(provider['name'])
             try:
                 logger.info(f"Trying {provider['name']} vision...")
 
@@ -306,6 +429,7 @@ class LLMFallbackHandler:
                 )
 
                 answer = response.choices[0].message.content
+                self.health.record_success(health_key)
 
                 logger.info(f"[SUCCESS] {provider['name']} vision responded")
 
@@ -319,6 +443,7 @@ class LLMFallbackHandler:
 
             except Exception as e:
                 error_msg = str(e)
+                self.health.record_failure(health_key, e)
                 logger.warning(f"{provider['name']} vision failed: {error_msg}")
 
                 if i == len(vision_providers) - 1:
@@ -342,8 +467,15 @@ class LLMFallbackHandler:
 
     def get_provider_status(self) -> Dict[str, Any]:
         """Get status of all providers"""
+        health = self.health.get_status(
+            [p['name'] for p in self.providers]
+            + [self._vision_key(p['name']) for p in self.providers if p.get('vision_model')]
+        )
         status = {
             'total_providers': len(self.providers),
+            'routing_enabled': health['enabled'],
+            'health_shared': health['shared'],
+            'hedging': self.hedging.get_stats(),
             'providers': []
         }
 
@@ -352,7 +484,9 @@ class LLMFallbackHandler:
                 'name': provider['name'],
                 'text_model': provider['text_model'],
                 'vision_model': provider.get('vision_model', 'None'),
-                'quota_per_day': provider.get('quota_per_day', 'Unknown')
+                'quota_per_day': provider.get('quota_per_day', 'Unknown'),
+                'health': health['providers'].get(provider['name']),
+                'vision_health': health['providers'].get(self._vision_key(provider['name']))
             })
 
         return status
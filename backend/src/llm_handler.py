@@ -1,18 +1,23 @@
 # src/llm_handler.py
 from groq import Groq
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
+import time
 import logging
 from src.llm_fallback_handler import LLMFallbackHandler
+from src.context_packer import ContextPacker
+from src.fanout import span
 
 class LLMHandler:
-    def __init__(self, config):
+    def __init__(self, config, cache=None):
         self.config = config
         self.logger = logging.getLogger(__name__)
         self.conversation_history = []
+        # Retrieved chunks -> prompt context, counted with the model's tokenizer
+        self.context_packer = ContextPacker(config)
 
-        # Initialize fallback handler (supports Groq + 3 fallbacks)
+        # Initialize fallback handler (supports Groq + 3 fallbacks; cache shares provider health across workers)
         try:
-            self.fallback_handler = LLMFallbackHandler(config)
+            self.fallback_handler = LLMFallbackHandler(config, cache=cache)
             self.client = None  # Will use fallback_handler instead
             self.logger.info("LLM Handler initialized with fallback support")
         except Exception as e:
@@ -30,32 +35,10 @@ class LLMHandler:
                          conversation_history: List[str] = None) -> Dict[str, Any]:
         """Generate response using retrieved context"""
 
-        # DEBUG: Log context docs received
-        self.logger.info(f"🔍 LLM received {len(context_docs)} context docs")
-        for i, doc in enumerate(context_docs[:3]):  # Log first 3
-            self.logger.info(f"   Doc {i+1}: type={doc['metadata'].get('chunk_type')}, page={doc['metadata'].get('page_number')}")
-            content_preview = doc['content'][:200].replace('\n', ' ')
-            self.logger.info(f"   Content preview: {content_preview}...")
-
-        # Prepare context from retrieved documents
-        context_text = self._prepare_context(context_docs)
-
-        # DEBUG: Log if image analysis is present in context
-        if "📷" in context_text or "Visual Content" in context_text:
-            self.logger.info("✅ IMAGE ANALYSIS DETECTED IN CONTEXT - LLM should see this!")
-            # Log a snippet of the image analysis
-            for line in context_text.split('\n'):
-                if "📷" in line or "Visual Content" in line:
-                    self.logger.info(f"   Image line: {line[:150]}")
-        else:
-            self.logger.warning("⚠️ NO IMAGE ANALYSIS IN CONTEXT - Images not reaching LLM!")
+        with span('prompt_build'):
+            prompt = self._build_prompt(query, context_docs, conversation_history)
+        provider, model = None, None
 
-        # Build conversation context
-        conversation_context = self._build_conversation_context(conversation_history)
-
-        # Create prompt
-        prompt = self._create_prompt(query, context_text, conversation_context)
-        
         try:
             # Check if fallback handler is available
             if self.fallback_handler is None and self.client is None:
@@ -76,19 +59,17 @@ class LLMHandler:
                 if conversation_history:
                     conv_history = conversation_history
 
-                # Determine max_tokens based on query type
-                if any(keyword in query.lower() for keyword in ['summarize', 'summary', 'explain', 'describe', 'long']):
-                    max_tokens = 2000  # Long responses for summaries/explanations
-                else:
-                    max_tokens = 500  # Shorter for direct questions
+                max_tokens = self._max_tokens(query)
 
                 # Use fallback handler with automatic provider cascade
-                result = self.fallback_handler.query_text(
-                    question=prompt,
-                    conversation_history=conv_history,
-                    system_prompt=self._get_system_prompt(),
-                    max_tokens=max_tokens
-                )
+                with span('llm'):
+                    result = self.fallback_handler.query_text(
+                        question=prompt,
+                        conversation_history=conv_history,
+                        system_prompt=self._get_system_prompt(),
+                        max_tokens=max_tokens
+                    )
+                provider, model = result.get('provider'), result.get('model')
 
                 if result['success']:
                     answer = result['answer']
@@ -105,20 +86,24 @@ class LLMHandler:
                 else:
                     max_tokens = 500  # Shorter for direct questions
 
-                response = self.client.chat.completions.create(
-                    model=self.config.LLM_MODEL,
-                    messages=[
-                        {"role": "system", "content": self._get_system_prompt()},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.4,  # Lower for more direct, factual responses
-                    max_tokens=max_tokens,
-                    top_p=1,
-                    stream=False
-                )
+                with span('llm'):
+                    response = self.client.chat.completions.create(
+                        model=self.config.LLM_MODEL,
+                        messages=[
+                            {"role": "system", "content": self._get_system_prompt()},
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=0.4,  # Lower for more direct, factual responses
+                        max_tokens=max_tokens,
+                        top_p=1,
+                        stream=False
+                    )
                 answer = response.choices[0].message.content
+                provider, model = 'groq', self.config.LLM_MODEL
                 self.logger.info("✅ Response generated by Groq (direct mode)")
             
+            failed = self.fallback_handler is not None and not result['success']
+
             # Update conversation history
             self.conversation_history.append(f"User: {query}")
             self.conversation_history.append(f"Assistant: {answer}")
@@ -127,8 +112,11 @@ class LLMHandler:
                 'answer': answer,
                 'sources_used': len(context_docs),
                 'context_types': list(set([doc['metadata']['chunk_type'] for doc in context_docs])),
-                'confidence': self._calculate_confidence(context_docs),
-                'error': False
+                # An apology from a failed provider cascade must not be cached or shared
+                'confidence': 0.0 if failed else self._calculate_confidence(context_docs),
+                'error': failed,
+                'provider': provider,
+                'model': model
             }
             
         except Exception as e:
@@ -137,44 +125,144 @@ class LLMHandler:
                 'answer': "I apologize, but I encountered an error while generating a response. Please try again.",
                 'sources_used': 0,
                 'context_types': [],
-                'confidence': 0.0
+                'confidence': 0.0,
+                'error': True
             }
     
-    def _prepare_context(self, context_docs: List[Dict[str, Any]]) -> str:
-        """Prepare context from retrieved documents with smart truncation"""
-        context_parts = []
-        max_context_tokens = 4000  # Leave room for system prompt, query, and response
-        estimated_tokens = 0
-
-        for i, doc in enumerate(context_docs, 1):
-            content = doc['content']
-            metadata = doc['metadata']
-
-            # Estimate tokens (rough: 1 token ≈ 4 characters)
-            content_tokens = len(content) // 4
-
-            # If this chunk would exceed limit, truncate it
-            if estimated_tokens + content_tokens > max_context_tokens:
-                remaining_tokens = max_context_tokens - estimated_tokens
-                if remaining_tokens > 100:  # Only include if we can fit meaningful content
-                    content = content[:remaining_tokens * 4] + "... [truncated]"
-                    content_tokens = remaining_tokens
-                else:
-                    break  # Stop adding more chunks
+    def _build_prompt(self, query: str, context_docs: List[Dict[str, Any]],
+                      conversation_history: List[str] = None) -> str:
+        """Context, conversation and question as one user prompt"""
+        # DEBUG: Log context docs received
+        self.logger.info(f"🔍 LLM received {len(context_docs)} context docs")
+        for i, doc in enumerate(context_docs[:3]):  # Log first 3
+            self.logger.info(f"   Doc {i+1}: type={doc['metadata'].get('chunk_type')}, page={doc['metadata'].get('page_number')}")
+            content_preview = doc['content'][:200].replace('\n', ' ')
+            self.logger.info(f"   Content preview: {content_preview}...")
 
-            # Minimal context formatting - just content and page
-            context_part = f"""{content} [Page {metadata['page_number']}]
+        # Prepare context from retrieved documents
+        context_text = self._prepare_context(context_docs)
 
-"""
-            context_parts.append(context_part)
-            estimated_tokens += content_tokens
+        # DEBUG: Log if image analysis is present in context
+        if "📷" in context_text or "Visual Content" in context_text:
+            self.logger.info("✅ IMAGE ANALYSIS DETECTED IN CONTEXT - LLM should see this!")
+            # Log a snippet of the image analysis
+            for line in context_text.split('\n'):
+                if "📷" in line or "Visual Content" in line:
+                    self.logger.info(f"   Image line: {line[:150]}")
+        else:
+            self.logger.warning("⚠️ NO IMAGE ANALYSIS IN CONTEXT - Images not reaching LLM!")
 
-            # Stop if we're approaching the limit
-            if estimated_tokens >= max_context_tokens:
-                break
+        # Build conversation context
+        conversation_context = self._build_conversation_context(conversation_history)
+
+        # Create prompt
+        return self._create_prompt(query, context_text, conversation_context)
+
+    def _max_tokens(self, query: str) -> int:
+        """Determine max_tokens based on query type"""
+        if any(keyword in query.lower() for keyword in ['summarize', 'summary', 'explain', 'describe', 'long']):
+            return 2000  # Long responses for summaries/explanations
+        return 500  # Shorter for direct questions
+
+    def stream_response(self, query: str, context_docs: List[Dict[str, Any]],
+                        conversation_history: List[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Stream a response using retrieved context
+
+        Yields:
+            {'type': 'token', 'text': str} per content delta, then one
+            {'type': 'end', ...} carrying the same fields as generate_response()
+            plus 'ttft_ms'
+        """
+        with span('prompt_build'):
+            prompt = self._build_prompt(query, context_docs, conversation_history)
+        context_types = list(set([doc['metadata']['chunk_type'] for doc in context_docs]))
+
+        if self.fallback_handler is None and self.client is None:
+            error_message = "ERROR: No LLM provider is available. Please check your API keys in the .env file."
+            self.logger.error(error_message)
+            yield {'type': 'end', 'answer': error_message, 'sources_used': len(context_docs),
+                   'context_types': context_types, 'confidence': 0.0, 'error': True, 'ttft_ms': None}
+            return
+
+        try:
+            if self.fallback_handler:
+                events = self.fallback_handler.stream_text(
+                    question=prompt,
+                    conversation_history=conversation_history or [],
+                    system_prompt=self._get_system_prompt(),
+                    max_tokens=self._max_tokens(query)
+                )
+            else:
+                events = self._stream_direct(prompt, self._max_tokens(query))
+
+            for event in events:
+                if event['type'] == 'token':
+                    yield event
+                    continue
+
+                if event['success']:
+                    self.logger.info(f"✅ Response streamed by {event['provider']} ({event['model']})")
+                else:
+                    self.logger.error(f"❌ Streaming failed: {event.get('error', 'Unknown error')}")
+                answer = event['answer']
+                self.conversation_history.append(f"User: {query}")
+                self.conversation_history.append(f"Assistant: {answer}")
+                yield {
+                    'type': 'end',
+                    'answer': answer,
+                    'sources_used': len(context_docs),
+                    'context_types': context_types,
+                    # A failed or cut-off answer must not be cached
+                    'confidence': self._calculate_confidence(context_docs) if event['success'] else 0.0,
+                    'error': not event['success'],
+                    'provider': event['provider'],
+                    'model': event['model'],
+                    'ttft_ms': event['ttft_ms']
+                }
+
+        except Exception as e:
+            self.logger.error(f"Error streaming response: {e}")
+            yield {'type': 'end',
+                   'answer': "I apologize, but I encountered an error while generating a response. Please try again.",
+                   'sources_used': 0, 'context_types': [], 'confidence': 0.0, 'error': True, 'ttft_ms': None}
+
+    def _stream_direct(self, prompt: str, max_tokens: int) -> Iterator[Dict[str, Any]]:
+        """Direct Groq streaming (legacy mode, no fallback)"""
+        started = time.perf_counter()
+        ttft_ms = None
+        parts = []
+        stream = self.client.chat.completions.create(
+            model=self.config.LLM_MODEL,
+            messages=[
+                {"role": "system", "content": self._get_system_prompt()},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.4,
+            max_tokens=max_tokens,
+            top_p=1,
+            stream=True
+        )
+        for chunk in stream:
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if not text:
+                continue
+            if ttft_ms is None:
+                ttft_ms = round((time.perf_counter() - started) * 1000, 2)
+            parts.append(text)
+            yield {'type': 'token', 'text': text}
+        yield {'type': 'end', 'success': bool(parts), 'answer': ''.join(parts), 'provider': 'Groq',
+               'model': self.config.LLM_MODEL, 'ttft_ms': ttft_ms, 'error': None if parts else 'empty response'}
+
+    def _prepare_context(self, context_docs: List[Dict[str, Any]]) -> str:
+        """Prepare context from retrieved documents: overlap removed, packed in retrieval order into the token budget"""
+        context_text, stats = self.context_packer.pack(context_docs)
+        self.logger.info(f"📦 Context: {stats['packed']}/{len(context_docs)} chunks, "
+                         f"{stats['tokens']}/{stats['budget']} tokens ({stats['tokenizer']}), "
+                         f"{stats['overlap_words_removed']} overlapping words removed, "
+                         f"{stats['skipped']} skipped, {stats['truncated']} truncated")
+        return context_text
 
-        return "\n".join(context_parts)
-    
     def _build_conversation_context(self, conversation_history: List[str]) -> str:
         """Build conversation context"""
         if not conversation_history:
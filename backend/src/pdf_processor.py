@@ -107,12 +107,19 @@ class PDFProcessor:
         # Clean and normalize text
         text = self._clean_text(text)
         
-        # Create chunks with overlap
+        # Create chunks with overlap (small-to-big: small chunks, neighbours are added at query time)
+        if getattr(self.config, 'SMALL_TO_BIG_ENABLED', False):
+            chunk_size = self.config.SMALL_CHUNK_SIZE
+            chunk_overlap = self.config.SMALL_CHUNK_OVERLAP
+        else:
+            chunk_size = self.config.CHUNK_SIZE
+            chunk_overlap = self.config.CHUNK_OVERLAP
+
         chunks = []
         words = text.split()
         
-        for i in range(0, len(words), self.config.CHUNK_SIZE - self.config.CHUNK_OVERLAP):
-            chunk_words = words[i:i + self.config.CHUNK_SIZE]
+        for i in range(0, len(words), chunk_size - chunk_overlap):
+            chunk_words = words[i:i + chunk_size]
             chunk_text = ' '.join(chunk_words)
             
             if len(chunk_text.strip()) > 50:  # Only meaningful chunks
@@ -0,0 +1,324 @@
+"""
+LLM provider health tracking and latency-aware routing
+
+LLMFallbackHandler used to try providers in a fixed order. While the first
+one was rate-limiting, every request paid for a failed round trip before
+falling through. ProviderHealth keeps per-provider state and orders
+providers for each request:
+
+- Latency: EWMA of successful calls (time to first token when streaming,
+  full response otherwise). Providers never measured count as
+  PROVIDER_LATENCY_PRIOR_MS, so a slow primary lets the next provider be
+  measured.
+- Error rate: EWMA of failures (0..1). It multiplies the latency score, so a
+  flaky fast provider ranks below a reliable slower one.
+- 429 cooldown: a rate-limited provider is skipped until its Retry-After
+  (seconds or HTTP date), or PROVIDER_RATE_LIMIT_COOLDOWN without one.
+- Circuit breaker: PROVIDER_BREAKER_FAILURES consecutive failures, or an
+  error rate above PROVIDER_BREAKER_ERROR_RATE, open the circuit for
+  PROVIDER_BREAKER_OPEN_SECONDS. Then a single probe request is allowed
+  (half-open). It closes the circuit on success and re-opens it on failure.
+
+Routing reads an in-process copy of the state, refreshed from Redis every
+PROVIDER_HEALTH_SYNC_SECONDS. Updates are written back on a background thread,
+so one worker's 429 or tripped breaker steers the others without adding a
+round trip to any request. If every provider is unavailable, they are all
+still tried, soonest-available first, rather than failing the request outright.
+"""
+import time
+import logging
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Error rate weight in the routing score: latency * (1 + ERROR_PENALTY * error_rate)
+ERROR_PENALTY = 3.0
+# Error-rate breaker needs this many observations before it can trip
+MIN_SAMPLES_FOR_ERROR_RATE = 5
+# Longest Retry-After honoured (the shared state expires from Redis after an hour anyway)
+MAX_COOLDOWN_SECONDS = 3600
+# Recent time-to-first-token samples kept per provider for quantiles (hedging delay)
+TTFT_SAMPLES = 200
+
+_sync_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _sync_executor
+    if _sync_executor is None:
+        _sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='provider-health')
+    return _sync_executor
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    message = str(error).lower()
+    return '429' in message or 'rate' in message or 'quota' in message
+
+
+def is_client_error(error: Exception) -> bool:
+    """Request problems (bad input, oversized prompt) that say nothing about the provider's health"""
+    status = getattr(error, 'status_code', None)
+    return status in (400, 404, 413, 422)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Retry-After from the provider's HTTP response (delta seconds or HTTP date), if any"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderHealth:
+    """Per-provider latency, error rate, cooldown and circuit state; shared through Redis"""
+
+    def __init__(self, config, cache=None):
+        """
+        Args:
+            config: Config with PROVIDER_* settings
+            cache: Optional RedisCacheManager; without it the state is per process
+        """
+        self.enabled = getattr(config, 'PROVIDER_ROUTING_ENABLED', True)
+        self.alpha = getattr(config, 'PROVIDER_EWMA_ALPHA', 0.2)
+        self.latency_prior_ms = getattr(config, 'PROVIDER_LATENCY_PRIOR_MS', 2000.0)
+        self.breaker_failures = getattr(config, 'PROVIDER_BREAKER_FAILURES', 3)
+        self.breaker_error_rate = getattr(config, 'PROVIDER_BREAKER_ERROR_RATE', 0.5)
+        self.open_seconds = getattr(config, 'PROVIDER_BREAKER_OPEN_SECONDS', 30.0)
+        self.rate_limit_cooldown = getattr(config, 'PROVIDER_RATE_LIMIT_COOLDOWN', 20.0)
+        self.sync_seconds = getattr(config, 'PROVIDER_HEALTH_SYNC_SECONDS', 2.0)
+        self.cache = cache
+
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._probing: Dict[str, tuple] = {}  # name -> (probe lock token, claimed at) held by this process
+        self._ttfts: Dict[str, deque] = {}  # name -> recent first-token latencies (ms), this process only
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+
+    # ========== Routing ==========
+
+    def order(self, names: List[str]) -> List[str]:
+        """
+        Providers to try for one request, best first
+
+        Cooling-down and open providers are left out. An open one whose wait
+        is over is let through as a single probe, placed first. If that
+        leaves nothing, every provider is returned, soonest available first.
+        """
+        if not self.enabled or len(names) < 2:
+            return list(names)
+
+        self._refresh(names)
+        now = time.time()
+        ranked, unavailable = [], []
+        with self._lock:
+            for index, name in enumerate(names):
+                state = self._state(name)
+                available_at = max(state['cooldown_until'], state['open_until'] if state['circuit'] == 'open' else 0)
+                if available_at > now:
+                    unavailable.append((available_at, index, name))
+                    continue
+                if state['circuit'] == 'open':
+                    if not self._claim_probe(name):
+                        unavailable.append((now + self.open_seconds, index, name))
+                        continue
+                    # A claimed probe goes first so it is actually sent (and the claim released)
+                    ranked.append((-1.0, index, name))
+                    continue
+                ranked.append((self._score(state), index, name))
+
+        if not ranked:
+            logger.warning("All LLM providers cooling down or tripped; trying them anyway")
+            return [name for _, _, name in sorted(unavailable)]
+        return [name for _, _, name in sorted(ranked)]
+
+    def _score(self, state: Dict[str, Any]) -> float:
+        latency = state['latency_ms'] if state['latency_ms'] is not None else self.latency_prior_ms
+        return latency * (1 + ERROR_PENALTY * state['error_rate'])
+
+    def _claim_probe(self, name: str) -> bool:
+        """One half-open probe at a time across workers (caller holds the lock)"""
+        claimed = self._probing.get(name)
+        if claimed and time.time() - claimed[1] < self.open_seconds:
+            return False  # Our own probe is still out (an abandoned one expires like the Redis lock)
+        token = self.cache.acquire_lock(f"llm_probe:{name}", max(1, int(self.open_seconds))) if self.cache \
+            else 'local'
+        if not token:
+            return False
+        self._probing[name] = (token, time.time())
+        logger.info(f"🔌 {name}: circuit half-open, sending a probe request")
+        return True
+
+    # ========== Observations ==========
+
+    def record_success(self, name: str, latency_ms: Optional[float] = None, first_token: bool = False):
+        """
+        Args:
+            latency_ms: Call latency; None for calls not comparable with text answers (vision)
+            first_token: latency_ms is a time to first token (kept for ttft_quantile)
+        """
+        if first_token and latency_ms is not None:
+            with self._lock:
+                self._ttfts.setdefault(name, deque(maxlen=TTFT_SAMPLES)).append(latency_ms)
+
+        def apply(state):
+            if latency_ms is not None:
+                previous = state['latency_ms']
+                state['latency_ms'] = latency_ms if previous is None else \
+                    round(self.alpha * latency_ms + (1 - self.alpha) * previous, 2)
+            state['error_rate'] = round((1 - self.alpha) * state['error_rate'], 4)
+            state['consecutive_failures'] = 0
+            state['samples'] += 1
+            state['circuit'] = 'closed'
+            state['open_until'] = 0.0
+
+        self._update(name, apply)
+
+    def record_cancelled(self, name: str, elapsed_ms: float):
+        """
+        A hedged attempt cut off before its first token, after elapsed_ms
+
+        Its time to first token is at least elapsed_ms (a censored sample). It
+        is kept for ttft_quantile and can only raise the latency EWMA; error
+        rate and circuit are left alone, since the provider didn't fail.
+        """
+        with self._lock:
+            self._ttfts.setdefault(name, deque(maxlen=TTFT_SAMPLES)).append(elapsed_ms)
+            if self._state(name)['circuit'] == 'open':
+                return  # A cut-off probe proves nothing; its claim expires like the Redis lock
+
+        def apply(state):
+            previous = state['latency_ms']
+            if previous is None or elapsed_ms > previous:
+                state['latency_ms'] = elapsed_ms if previous is None else \
+                    round(self.alpha * elapsed_ms + (1 - self.alpha) * previous, 2)
+
+        self._update(name, apply)
+
+    def record_failure(self, name: str, error: Exception):
+        if is_client_error(error):
+            return  # The request was bad, not the provider
+        if is_rate_limit_error(error):
+            wait = retry_after_seconds(error)
+            wait = self.rate_limit_cooldown if wait is None else min(wait, MAX_COOLDOWN_SECONDS)
+            logger.warning(f"⏳ {name}: rate limited, skipping it for {wait:.0f}s")
+
+            def apply(state):
+                state['cooldown_until'] = max(state['cooldown_until'], time.time() + wait)
+                state['rate_limited'] += 1
+                if state['circuit'] == 'open':
+                    state['open_until'] = max(state['open_until'], state['cooldown_until'])
+
+            self._update(name, apply)
+            return
+
+        def apply(state):
+            state['error_rate'] = round(self.alpha + (1 - self.alpha) * state['error_rate'], 4)
+            state['consecutive_failures'] += 1
+            state['samples'] += 1
+            state['failures'] += 1
+            trip = (state['circuit'] == 'open'  # Failed probe
+                    or state['consecutive_failures'] >= self.breaker_failures
+                    or (state['samples'] >= MIN_SAMPLES_FOR_ERROR_RATE
+                        and state['error_rate'] > self.breaker_error_rate))
+            if trip:
+                state['circuit'] = 'open'
+                state['open_until'] = time.time() + self.open_seconds
+                state['trips'] += 1
+
+        self._update(name, apply)
+
+    def ttft_quantile(self, name: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """Quantile of the provider's recent time to first token in ms, or None with fewer than min_samples"""
+        with self._lock:
+            samples = sorted(self._ttfts.get(name, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def get_status(self, names: Optional[List[str]] = None) -> Dict[str, Any]:
+        with self._lock:
+            names = list(names or self._states)
+            for name in names:
+                self._state(name)
+        self._refresh(names)
+        now = time.time()
+        with self._lock:
+            providers = {}
+            for name in names:
+                state = self._states[name]
+                providers[name] = {
+                    **{key: value for key, value in state.items() if key not in ('cooldown_until', 'open_until')},
+                    'cooldown_s': round(max(0.0, state['cooldown_until'] - now), 1),
+                    'open_s': round(max(0.0, state['open_until'] - now), 1) if state['circuit'] == 'open' else 0.0,
+                    'score': round(self._score(state), 2)
+                }
+        return {'enabled': self.enabled, 'shared': bool(self.cache and self.cache.enabled), 'providers': providers}
+
+    # ========== State ==========
+
+    @staticmethod
+    def _new_state() -> Dict[str, Any]:
+        return {'latency_ms': None, 'error_rate': 0.0, 'consecutive_failures': 0, 'samples': 0,
+                'failures': 0, 'rate_limited': 0, 'trips': 0,
+                'circuit': 'closed', 'open_until': 0.0, 'cooldown_until': 0.0}
+
+    def _state(self, name: str) -> Dict[str, Any]:
+        """Caller holds the lock"""
+        if name not in self._states:
+            self._states[name] = self._new_state()
+        return self._states[name]
+
+    def _update(self, name: str, apply):
+        with self._lock:
+            state = self._state(name)
+            was_open = state['circuit'] == 'open'
+            apply(state)
+            probe = self._probing.pop(name, None)
+        if state['circuit'] == 'open' and (not was_open or probe):
+            logger.warning(f"🔌 {name}: circuit {'re-' if was_open else ''}opened for {self.open_seconds:.0f}s "
+                           f"({state['consecutive_failures']} consecutive failures, "
+                           f"error rate {state['error_rate']:.2f})")
+        elif was_open and state['circuit'] == 'closed':
+            logger.info(f"🔌 {name}: probe succeeded, circuit closed")
+        probe_token = probe[0] if probe else None
+        if self.cache and self.cache.enabled:
+            _executor().submit(self._write_back, name, apply, probe_token)
+
+    def _write_back(self, name: str, apply, probe_token: Optional[str]):
+        """Apply the same observation to the shared state (other workers' updates included)"""
+        try:
+            shared = self.cache.get_provider_health([name]).get(name) or self._new_state()
+            apply(shared)
+            self.cache.save_provider_health(name, shared, ttl=MAX_COOLDOWN_SECONDS)
+            with self._lock:
+                self._states[name] = shared
+            if probe_token and probe_token != 'local':
+                self.cache.release_lock(f"llm_probe:{name}", probe_token)
+        except Exception as e:
+            logger.warning(f"Provider health sync failed for {name}: {e}")
+
+    def _refresh(self, names: List[str]):
+        if not (self.cache and self.cache.enabled) or time.time() - self._synced_at < self.sync_seconds:
+            return
+        self._synced_at = time.time()
+        shared = self.cache.get_provider_health(names) if names else {}
+        with self._lock:
+            for name, state in shared.items():
+                self._states[name] = {**self._new_state(), **state}
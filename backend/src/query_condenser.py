@@ -0,0 +1,187 @@
+"""
+Condense a follow-up question and recent turns into a short standalone search query
+
+The old approach embedded "<previous question> <previous answer> <question>".
+A full LLM answer runs to hundreds of words, so that query was mostly old answer
+text, and MiniLM truncated it at 256 tokens. This stage keeps the question and
+adds only the few terms it refers back to.
+
+- Extractive (default): scores the content terms of recent turns. Terms the
+  user asked about earlier, and that the answer then talked about (entity
+  overlap), are carried forward. Formulas, numbers and capitalised names get a
+  boost. Standalone questions pass through unchanged.
+- LLM rewrite (QUERY_CONDENSE_LLM=true): asks the fallback LLM chain for a
+  standalone query. If it fails, the extractive result is used.
+
+Results are cached per (conversation hash, normalised question).
+"""
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+from .lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Words that point back at earlier turns ("what about its uses?", "इसका सूत्र क्या है?")
+REFERRING_WORDS = frozenset("""
+it its this that these those they them their he she his her him same above previous
+earlier former latter also more else again another other one ones
+यह वह ये वे इस उस इन उन इसका उसका इसके उसके इसकी उसकी इसे उसे इनका उनका
+""".split())
+
+WORD_PATTERN = re.compile(r"[\w\u0900-\u097F]+")
+# Capitalised mid-sentence (names); sentence-initial capitals say nothing
+CAPITALISED_PATTERN = re.compile(r"(?<=[^.!?\s] )[A-Z][\w\-]*")
+DEVANAGARI_PATTERN = re.compile(r"[\u0900-\u097F]")
+
+# A question with this many content terms and no referring word is treated as standalone
+STANDALONE_MIN_TERMS = 3
+
+REWRITE_SYSTEM_PROMPT = (
+    "You rewrite a follow-up question into a standalone search query using the conversation. "
+    "Reply with the query only, in the language of the question, in at most 25 words."
+)
+ANSWER_PREVIEW_CHARS = 400  # Per answer in the rewrite prompt
+MAX_REWRITE_CHARS = 300
+
+
+class QueryCondenser:
+    """Extractive (or optional LLM) condensation of follow-up questions, with an LRU cache"""
+
+    def __init__(self, config, llm_fallback_handler=None):
+        self.turns = getattr(config, 'QUERY_CONDENSE_TURNS', 2)
+        self.max_terms = getattr(config, 'QUERY_CONDENSE_MAX_TERMS', 6)
+        self.cache_size = getattr(config, 'QUERY_CONDENSE_CACHE_SIZE', 1024)
+        self.llm_max_tokens = getattr(config, 'QUERY_CONDENSE_MAX_TOKENS', 64)
+        self.llm_handler = llm_fallback_handler if getattr(config, 'QUERY_CONDENSE_LLM', False) else None
+
+        self._cache: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def condense(self, question: str, conversation_history: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Build the search query for a question
+
+        Args:
+            question: Current user question
+            conversation_history: Alternating [question, answer, ...] entries, oldest first
+
+        Returns:
+            Dict with 'query' (search query), 'method' ('none', 'standalone',
+            'extractive' or 'llm'), 'cached' and 'latency_ms'
+        """
+        started = time.perf_counter()
+        recent = list(conversation_history or [])[-2 * self.turns:]
+        if not recent:
+            return {'query': question, 'method': 'none', 'cached': False, 'latency_ms': 0.0}
+
+        # History alternates question/answer; align so pairs start with a question
+        if len(recent) % 2:
+            recent = recent[1:]
+
+        question_terms = tokenize(question)
+        if not self._is_follow_up(question, question_terms):
+            return {'query': question, 'method': 'standalone', 'cached': False, 'latency_ms': 0.0}
+
+        key = (self._conversation_hash(recent), ' '.join(question.lower().split()))
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is not None:
+            query, method = cached
+            return {'query': query, 'method': method, 'cached': True,
+                    'latency_ms': round((time.perf_counter() - started) * 1000, 2)}
+
+        query, method = None, 'extractive'
+        if self.llm_handler:
+            query = self._rewrite_with_llm(question, recent)
+            method = 'llm' if query else 'extractive'
+        if not query:
+            query = self._extract(question, set(question_terms), recent)
+
+        with self._cache_lock:
+            self._cache[key] = (query, method)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return {'query': query, 'method': method, 'cached': False,
+                'latency_ms': round((time.perf_counter() - started) * 1000, 2)}
+
+    def _is_follow_up(self, question: str, question_terms: List[str]) -> bool:
+        words = WORD_PATTERN.findall(question.lower())
+        if any(word in REFERRING_WORDS for word in words):
+            return True
+        return len(set(question_terms)) < STANDALONE_MIN_TERMS
+
+    def _extract(self, question: str, question_terms: set, recent: List[str]) -> str:
+        """Append the highest-scoring carried-over terms to the question"""
+        scores: Dict[str, float] = {}
+        order: Dict[str, int] = {}  # Most recent turn first, then text order
+        pairs = [(recent[i], recent[i + 1] if i + 1 < len(recent) else '') for i in range(0, len(recent), 2)]
+
+        for age, (asked, answered) in enumerate(reversed(pairs)):
+            weight = 1.0 / (age + 1)  # The last turn counts most
+            asked_tokens, answered_tokens = tokenize(asked), tokenize(answered)
+            asked_terms, answered_terms = set(asked_tokens), set(answered_tokens)
+            emphasised = {word.lower() for word in CAPITALISED_PATTERN.findall(f"{asked} {answered}")}
+
+            for term in dict.fromkeys(asked_tokens + answered_tokens):
+                if term in question_terms or len(term) < 3:
+                    continue
+                score = 0.0
+                if term in asked_terms:
+                    score += 2.0
+                if term in answered_terms:
+                    score += 1.0
+                if term in asked_terms and term in answered_terms:
+                    score += 2.0  # Entity overlap: the topic the exchange was actually about
+                if term in emphasised or any(ch.isdigit() for ch in term) or DEVANAGARI_PATTERN.search(term):
+                    score += 1.0
+                scores[term] = scores.get(term, 0.0) + score * weight
+                order.setdefault(term, len(order))
+
+        # An answer-only term needs a boost (name, formula) to be carried over
+        carried = sorted((term for term, score in scores.items() if score >= 2.0),
+                         key=lambda term: (-scores[term], order[term]))[:self.max_terms]
+        if not carried:
+            return question
+        carried.sort(key=order.get)
+        return f"{question} {' '.join(carried)}"
+
+    def _rewrite_with_llm(self, question: str, recent: List[str]) -> Optional[str]:
+        lines = []
+        for i, entry in enumerate(recent):
+            if i % 2:
+                lines.append(f"Assistant: {entry[:ANSWER_PREVIEW_CHARS]}")
+            else:
+                lines.append(f"User: {entry}")
+        prompt = "Conversation:\n" + "\n".join(lines) + f"\n\nFollow-up question: {question}\n\nStandalone query:"
+
+        try:
+            result = self.llm_handler.query_text(prompt, system_prompt=REWRITE_SYSTEM_PROMPT,
+                                                 max_tokens=self.llm_max_tokens)
+        except Exception as e:
+            logger.warning(f"Query rewrite failed, using extractive condensation: {e}")
+            return None
+
+        if not result.get('success'):
+            return None
+        rewritten = (result.get('answer') or '').strip().splitlines()
+        rewritten = rewritten[0].strip().strip('"\'') if rewritten else ''
+        if not rewritten or len(rewritten) > MAX_REWRITE_CHARS:
+            return None
+        return rewritten
+
+    @staticmethod
+    def _conversation_hash(recent: List[str]) -> str:
+        digest = hashlib.sha256()
+        for entry in recent:
+            digest.update(entry.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()[:16]
@@ -1,15 +1,26 @@
 # src/rag_system.py
 import os
+import time
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Union, Iterator
 from .pdf_processor import PDFProcessor
-# Use ChromaDB for persistent vector storage with proper embeddings
-from .chroma_vector_store import ChromaVectorStore as VectorStore
+# Vector store backend (ChromaDB by default) is selected by Config.VECTOR_STORE_BACKEND
+from .vector_store import create_vector_store
+from .index_maintenance import IndexMaintainer
 from .retriever import SmartRetriever
+from .lexical_index import LexicalIndex
+from .chunk_store import ChunkWindowStore
+from .reranker import CrossEncoderReranker
+from .query_condenser import QueryCondenser
+from .semantic_cache import SemanticAnswerCache
 from .llm_handler import LLMHandler
 from .redis_cache import RedisCacheManager
 from .gemini_vision_handler import GeminiVisionHandler
-
+from .fanout import StageTimings, run_parallel, span
+from .image_manifest import ImageManifestStore, FigureCaptioner, IMAGE_ANALYSIS_PROMPT, caption_key, extract_images
+from .document_registry import DocumentRegistry
+from .single_flight import SingleFlight
+from .span_log import SpanLog
 
 class RAGSystem:
     def __init__(self, config):
@@ -18,23 +29,56 @@ class RAGSystem:
 
         # Initialize components
         self.pdf_processor = PDFProcessor(config)
-        self.vector_store = VectorStore(config)
-        self.retriever = SmartRetriever(self.vector_store, config)
-        self.llm_handler = LLMHandler(config)
-        self.gemini_vision = GeminiVisionHandler(config)
+        self.vector_store = create_vector_store(config)
+        self.lexical_index = LexicalIndex(config, self.vector_store)
+        self.chunk_store = ChunkWindowStore(config)
+        # (user, document) -> stored PDF; uploads from the old flat directory are moved in once
+        self.documents = DocumentRegistry(config)
+        try:
+            self.documents.migrate_flat_uploads(self.vector_store.get_document_owners)
+        except Exception as e:
+            self.logger.error(f"Document registry migration failed (will retry on next start): {e}")
+        self.reranker = CrossEncoderReranker(config)
 
         # Initialize Redis cache (dual support: Upstash + local)
         self.cache = RedisCacheManager(config)
+        # LLM provider health (latency, 429 cooldowns, circuit breakers) is shared through the cache
+        self.llm_handler = LLMHandler(config, cache=self.cache)
+        self.condenser = QueryCondenser(config, llm_fallback_handler=self.llm_handler.fallback_handler)
+        # Near-duplicate questions reuse answers (in-process, partitioned by corpus version)
+        self.semantic_cache = SemanticAnswerCache(config, self.vector_store.embed_queries)
+        # Identical questions in flight at the same time share one pipeline run
+        self.single_flight = SingleFlight(config, self.cache)
+        # Per-request stage spans, appended to JSONL for offline latency analysis
+        self.span_log = SpanLog(config)
+
+        self.retriever = SmartRetriever(self.vector_store, config, lexical_index=self.lexical_index,
+                                        reranker=self.reranker, condenser=self.condenser,
+                                        chunk_store=self.chunk_store, retrieval_cache=self.cache)
+        self.index_maintainer = IndexMaintainer(self.vector_store, config, cache=self.cache)
+        if getattr(config, 'INDEX_MAINTENANCE_ENABLED', True):
+            self.index_maintainer.start()
+        self.gemini_vision = GeminiVisionHandler(config, cache=self.cache)
+        # Which pages have images (built at upload) and their captions (filled in the background)
+        self.image_manifests = ImageManifestStore(config)
+        self.figure_captioner = FigureCaptioner(self.image_manifests, self.gemini_vision, config, cache=self.cache,
+                                                resolve_pdf=self.documents.get_path)
+        if self.gemini_vision.is_available():
+            self.figure_captioner.start()
 
         self.logger.info("RAG System initialized successfully")
         if self.cache.enabled:
             self.logger.info(f"Redis cache enabled: {self.cache.mode}")
 
-    def add_document(self, pdf_path: str, user_id: str = None) -> Dict[str, Any]:
-        """Add a PDF document to the knowledge base with optional user_id"""
+    def add_document(self, pdf_path: str, user_id: str = None, document_name: str = None,
+                     original_filename: str = None) -> Dict[str, Any]:
+        """Add a PDF document to the knowledge base with optional user_id
+
+        On success the file is moved into the document registry's storage.
+        """
         try:
             # Extract document name
-            doc_name = os.path.basename(pdf_path).replace('.pdf', '')
+            doc_name = document_name or os.path.basename(pdf_path).replace('.pdf', '')
 
             self.logger.info(f"Processing document: {doc_name} (user: {user_id})")
 
@@ -45,14 +89,33 @@ class RAGSystem:
                 return {'success': False, 'message': 'No content extracted from PDF'}
 
             # Add to vector store with user_id
-            self.vector_store.add_documents(chunks, doc_name, user_id=user_id)
+            result = self.vector_store.add_documents(chunks, doc_name, user_id=user_id)
+
+            # Keep the user's BM25 index and chunk windows in step with the vector store
+            if result.get('success'):
+                self.lexical_index.add_document(user_id, doc_name, chunks)
+                self.chunk_store.add_document(user_id, doc_name, chunks)
+                self.cache.bump_corpus_version(user_id)
+                pdf_path = self.documents.register(user_id, doc_name, pdf_path,
+                                                   original_filename=original_filename)['path']
+
+            # Image manifest now, captions later (background, throttled)
+            images_indexed = 0
+            if result.get('success'):
+                try:
+                    images_indexed = self.image_manifests.index_document(user_id, doc_name, pdf_path)
+                    if images_indexed:
+                        self.figure_captioner.enqueue(user_id, doc_name)
+                except Exception as e:
+                    self.logger.warning(f"Image manifest failed for {doc_name} (figures analyzed on demand): {e}")
 
             # Get statistics
             stats = {
                 'total_chunks': len(chunks),
                 'text_chunks': len([c for c in chunks if c.chunk_type == 'text']),
                 'table_chunks': len([c for c in chunks if c.chunk_type == 'table']),
-                'image_chunks': len([c for c in chunks if c.chunk_type == 'image'])
+                'image_chunks': len([c for c in chunks if c.chunk_type == 'image']),
+                'images_indexed': images_indexed
             }
 
             self.logger.info(f"Successfully added {doc_name}: {stats}")
@@ -77,17 +140,16 @@ class RAGSystem:
         question_lower = question.lower()
         return any(keyword in question_lower for keyword in image_keywords)
 
-    def _enrich_with_images(self, retrieval_results: Dict[str, Any], document_name: str = None, user_id: str = None) -> Dict[str, Any]:
-        """Extract and analyze images from relevant pages using Gemini Vision with caching"""
-        try:
-            import fitz  # PyMuPDF
-            import hashlib
-
-            # Check if Gemini Vision is available
-            if not self.gemini_vision.is_available():
-                self.logger.warning("Gemini Vision not available - skipping image analysis")
-                return retrieval_results
+    def _enrich_with_images(self, retrieval_results: Dict[str, Any], document_name: str = None, user_id: str = None,
+                            manifest: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Add figure descriptions for the images on the top result pages
 
+        The ingest-time image manifest says which pages have images, so image-free
+        pages cost nothing. Captions come from the background captioner's store
+        (then the shared Redis cache). Only images it hasn't reached yet are
+        analyzed here, concurrently (IMAGE_ANALYSIS_CONCURRENCY).
+        """
+        try:
             # Get unique pages from retrieval results (only closest matches)
             pages_to_extract = set()
             for result in retrieval_results['results'][:3]:  # Only top 3 results to reduce extraction
@@ -95,67 +157,51 @@ class RAGSystem:
                 page_num = int(page_number) - 1  # Convert to 0-indexed
                 pages_to_extract.add(page_num)
 
-            self.logger.info(f"🖼️ Extracting and analyzing images from pages: {sorted(pages_to_extract)}")
-
-            # Find the PDF file
-            pdf_path = self._find_pdf_path(document_name, user_id)
-            if not pdf_path:
-                self.logger.warning("Could not find PDF file for image extraction")
+            manifest = manifest or self.image_manifests.get_manifest(user_id, document_name)
+            if manifest is None:
+                # Indexed before image manifests: build one now (one PDF scan, no vision calls)
+                pdf_path = self._find_pdf_path(document_name, user_id)
+                if not pdf_path:
+                    self.logger.warning("Could not find PDF file for image extraction")
+                    return retrieval_results
+                self.image_manifests.index_document(user_id, document_name, pdf_path)
+                manifest = self.image_manifests.get_manifest(user_id, document_name)
+                self.figure_captioner.enqueue(user_id, document_name)
+
+            images = [(page_num, img_idx, image)
+                      for page_num in sorted(pages_to_extract)
+                      for img_idx, image in enumerate(manifest['pages'].get(page_num, []))]
+            if not images:
+                self.logger.info(f"🖼️ No images on pages {sorted(p + 1 for p in pages_to_extract)} - skipping")
                 return retrieval_results
 
-            # Create cache key for this document's images
-            doc_name_for_cache = document_name or os.path.basename(pdf_path).replace('.pdf', '')
-            image_cache_key = f"images:{doc_name_for_cache}:{','.join(map(str, sorted(pages_to_extract)))}"
+            # Identical images (logos, repeated figures) share one caption
+            image_hashes = list(dict.fromkeys(image['hash'] for _, _, image in images))
+            descriptions = self.image_manifests.get_captions(image_hashes)
+            misses = [h for h in image_hashes if h not in descriptions]
+            if misses:
+                shared = self.cache.get_cached_image_descriptions([caption_key(h) for h in misses])
+                found = {h: shared[caption_key(h)] for h in misses if caption_key(h) in shared}
+                self.image_manifests.save_captions(found)
+                descriptions.update(found)
+                misses = [h for h in misses if h not in found]
+            self.logger.info(f"📸 {len(images)} images: {len(image_hashes) - len(misses)} captioned, "
+                             f"{len(misses)} to analyze")
+
+            if misses and self.gemini_vision.is_available():
+                with span('vision'):
+                    descriptions.update(self._caption_now(manifest, images, misses, document_name, user_id))
 
-            # Check cache first
-            cached_images = self.cache.get_cached_query_result(image_cache_key, None)
-            if cached_images:
-                self.logger.info("✅ Using cached image analyses")
-                retrieval_results['results'].insert(0, cached_images)
-                return retrieval_results
-
-            # Extract and analyze images from those specific pages
-            doc = fitz.open(pdf_path)
             image_analyses = []
-
-            for page_num in sorted(pages_to_extract):
-                if page_num >= len(doc):
-                    continue
-
-                page = doc[page_num]
-                images = page.get_images(full=True)
-
-                if images:
-                    self.logger.info(f"📸 Found {len(images)} images on page {page_num + 1} - analyzing with Gemini Vision...")
-
-                    # Limit to first 2 images per page to save API calls
-                    for img_idx, img in enumerate(images[:2]):
-                        try:
-                            # Extract image data
-                            xref = img[0]
-                            base_image = doc.extract_image(xref)
-                            image_bytes = base_image["image"]
-
-                            # Analyze with Gemini Vision
-                            description = self.gemini_vision.describe_image(
-                                image_bytes,
-                                prompt=f"Analyze this image from page {page_num + 1} of an educational document. Describe all visible content including diagrams, chemical structures, equations, charts, graphs, or text."
-                            )
-
-                            if description:
-                                image_analyses.append(f"""
+            for page_num, img_idx, image in images:
+                description = descriptions.get(image['hash'])
+                if description:
+                    image_analyses.append(f"""
 📷 **Figure on Page {page_num + 1} (Image {img_idx + 1})**:
 {description}
 """)
-                                self.logger.info(f"✅ Successfully analyzed image {img_idx + 1} on page {page_num + 1}")
-                            else:
-                                image_analyses.append(f"\n📷 **Image on Page {page_num + 1}**: Present but could not be analyzed")
-
-                        except Exception as e:
-                            self.logger.warning(f"Could not analyze image {img_idx} on page {page_num + 1}: {e}")
-                            continue
-
-            doc.close()
+                else:
+                    image_analyses.append(f"\n📷 **Image on Page {page_num + 1}**: Present but could not be analyzed")
 
             # Add image analyses to the results
             if image_analyses and retrieval_results['results']:
@@ -171,9 +217,6 @@ class RAGSystem:
                     }
                 }
 
-                # Cache the image result for 1 hour
-                self.cache.cache_query_result(image_cache_key, None, image_result, ttl=3600)
-
                 # Insert at the beginning so LLM sees it first
                 retrieval_results['results'].insert(0, image_result)
                 self.logger.info(f"✅ Added {len(image_analyses)} image analyses to retrieval results")
@@ -184,95 +227,384 @@ class RAGSystem:
             self.logger.error(f"Error extracting images: {e}", exc_info=True)
             return retrieval_results
 
-    def _find_pdf_path(self, document_name: str = None, user_id: str = None) -> str:
-        """Find the PDF file path from uploaded documents"""
-        try:
-            upload_folder = self.config.UPLOAD_FOLDER
-            if not os.path.exists(upload_folder):
+    def _caption_now(self, manifest: Dict[str, Any], images: List[tuple], misses: List[str],
+                     document_name: str, user_id: str) -> Dict[str, str]:
+        """Describe images the background captioner hasn't reached yet, in parallel"""
+        pdf_path = manifest.get('pdf_path')
+        if not pdf_path or not os.path.exists(pdf_path):
+            pdf_path = self._find_pdf_path(document_name, user_id)
+        if not pdf_path:
+            return {}
+
+        xrefs = {}
+        for _, _, image in images:
+            if image['hash'] in misses:
+                xrefs.setdefault(image['hash'], image['xref'])
+        image_bytes = extract_images(pdf_path, list(xrefs.values()))
+
+        def describe(image_hash):
+            try:
+                return self.gemini_vision.describe_image(image_bytes[xrefs[image_hash]], prompt=IMAGE_ANALYSIS_PROMPT)
+            except Exception as e:
+                self.logger.warning(f"Could not analyze image {image_hash[:12]}: {e}")
                 return None
 
-            # If document_name is provided, look for that specific file
-            if document_name:
-                pdf_name = f"{document_name}.pdf"
-                pdf_path = os.path.join(upload_folder, pdf_name)
-                if os.path.exists(pdf_path):
-                    return pdf_path
-
-            # Otherwise, get the most recent PDF
-            pdf_files = [f for f in os.listdir(upload_folder) if f.endswith('.pdf')]
-            if pdf_files:
-                # Get most recently modified PDF
-                pdf_files.sort(key=lambda x: os.path.getmtime(os.path.join(upload_folder, x)), reverse=True)
-                return os.path.join(upload_folder, pdf_files[0])
+        analyzed = run_parallel({h: (lambda h=h: describe(h)) for h in xrefs if xrefs[h] in image_bytes},
+                                max_concurrency=getattr(self.config, 'IMAGE_ANALYSIS_CONCURRENCY', 4))
+        captions = {image_hash: text for image_hash, text in analyzed.items() if text}
+        self.image_manifests.save_captions(captions)
+        self.cache.cache_image_descriptions({caption_key(h): text for h, text in captions.items()},
+                                            ttl=getattr(self.config, 'IMAGE_DESCRIPTION_CACHE_TTL', 2592000))
+        return captions
 
-            return None
+    def _find_pdf_path(self, document_name: str = None, user_id: str = None) -> str:
+        """Find the user's stored PDF for a document (their most recent upload if no name is given)"""
+        try:
+            return self.documents.get_path(user_id, document_name)
         except Exception as e:
             self.logger.error(f"Error finding PDF path: {e}")
             return None
 
-    def query(self, question: str, conversation_history: List[str] = None, document_name: str = None, user_id: str = None) -> Dict[str, Any]:
-        """Query the RAG system with optional document filtering, user filtering, and caching"""
+    def query(self, question: str, conversation_history: List[str] = None, document_name: Union[str, List[str]] = None,
+              user_id: str = None, include_timings: bool = False) -> Dict[str, Any]:
+        """Query the RAG system with optional document (or document set) filtering, user filtering, and caching
+
+        With include_timings the response carries a 'timings' dict: milliseconds per stage
+        (cache lookup, condense, embedding, vector search, rerank, images, prompt build,
+        LLM, total) plus the provider and model that answered. The spans are always
+        written to the span log.
+        """
         try:
             self.logger.info(f"Processing query: {question} (user: {user_id})")
             if document_name:
                 self.logger.info(f"Filtering to document: {document_name}")
 
-            # Build cache key with user_id
-            cache_key_suffix = f"_{user_id}" if user_id else ""
+            timings = StageTimings()
+            with timings.activate():
+                lookup = self._lookup_answer_caches(question, conversation_history, document_name, user_id,
+                                                    timings)
+                if lookup['cached_result']:
+                    response = lookup['cached_result']
+                else:
+                    wait_started = time.perf_counter()
+                    response, shared = self.single_flight.run(
+                        self._flight_key(question, document_name, lookup),
+                        lambda: self._generate_answer(question, conversation_history, document_name, user_id,
+                                                      lookup, timings),
+                        fetch_shared=lambda: self._fetch_shared_answer(question, document_name, lookup)
+                    )
+                    if shared:
+                        self.logger.info("Returning answer computed by an identical in-flight query")
+                        timings.record('coalesced_wait', wait_started)
+                        response['coalesced'] = True
+
+            return self._complete_response(response, 'query', timings, user_id, include_timings)
 
-            # Check cache first (if enabled)
-            cached_result = self.cache.get_cached_query_result(question, document_name, suffix=cache_key_suffix)
-            if cached_result:
-                self.logger.info("Returning cached result")
-                cached_result['cached'] = True
-                return cached_result
-
-            # Retrieve relevant documents with user filtering
-            retrieval_results = self.retriever.retrieve(
-                question, conversation_history, document_filter=document_name, user_id=user_id)
-
-            if not retrieval_results['results']:
-                return {
-                    'answer': "I couldn't find relevant information in the documents to answer your question.",
-                    'sources_used': 0,
-                    'query_type': retrieval_results['query_type'],
-                    'confidence': 0.0,
-                    'cached': False
-                }
-
-            # ON-DEMAND IMAGE EXTRACTION: If question asks about images/figures, extract them now
-            if self._needs_image_extraction(question):
-                self.logger.info("🖼️ Image-related query detected - extracting images on-demand")
-                retrieval_results = self._enrich_with_images(retrieval_results, document_name, user_id)
+        except Exception as e:
+            self.logger.error(f"Error processing query: {e}")
+            return {
+                'answer': "I encountered an error while processing your question. Please try again.",
+                'sources_used': 0,
+                'query_type': 'error',
+                'confidence': 0.0
+            }
 
-            # Generate response
+    def _generate_answer(self, question: str, conversation_history: List[str],
+                         document_name: Union[str, List[str]], user_id: str, lookup: Dict[str, Any],
+                         timings: StageTimings) -> Dict[str, Any]:
+        """Retrieval and generation after an answer-cache miss"""
+        retrieval_results = self._retrieve_for_generation(question, conversation_history, document_name,
+                                                          user_id, lookup['corpus_version'], timings)
+        if not retrieval_results['results']:
+            return self._no_results_response(retrieval_results)
+
+        # Generate response
+        with timings.stage('generation'):
             response = self.llm_handler.generate_response(
                 question,
                 retrieval_results['results'],
                 conversation_history
             )
 
-            # Add retrieval info
-            response['query_type'] = retrieval_results['query_type']
-            response['retrieval_stats'] = {
-                'total_found': retrieval_results['total_found'],
-                'used_for_generation': len(retrieval_results['results'])
-            }
-            response['cached'] = False
-
-            # Cache the result (if enabled) with user_id suffix
-            self.cache.cache_query_result(question, document_name, response, ttl=self.config.QUERY_CACHE_TTL, suffix=cache_key_suffix)
-
-            return response
+        return self._finish_response(response, retrieval_results, question, document_name, user_id,
+                                     lookup, timings)
+
+    def _flight_key(self, question: str, document_name: Union[str, List[str]], lookup: Dict[str, Any]) -> str:
+        """Requests that would share an answer-cache entry share one computation"""
+        return self.cache.query_cache_key(question, document_name, suffix=lookup['cache_key_suffix'],
+                                          corpus_version=lookup['corpus_version'])
+
+    def _fetch_shared_answer(self, question: str, document_name: Union[str, List[str]],
+                             lookup: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The answer another worker's leader wrote to the query cache"""
+        shared = self.cache.get_cached_query_result(question, document_name, suffix=lookup['cache_key_suffix'],
+                                                    corpus_version=lookup['corpus_version'])
+        if shared:
+            shared['cached'] = True
+        return shared
+
+    def query_stream(self, question: str, conversation_history: List[str] = None,
+                     document_name: Union[str, List[str]] = None, user_id: str = None,
+                     include_timings: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of query()
+
+        Yields:
+            {'type': 'metadata', ...} once retrieval is done (before any token),
+            {'type': 'token', 'text': str} per answer delta, then
+            {'type': 'done', 'response': dict} with the same response query() returns.
+            A cache hit, or an answer shared by an identical in-flight query, yields
+            metadata, the whole answer as one token, and done.
+        """
+        try:
+            self.logger.info(f"Processing streaming query: {question} (user: {user_id})")
+            timings = StageTimings()
+            with timings.activate():
+                for event in self._stream_events(question, conversation_history, document_name, user_id, timings):
+                    if event['type'] == 'token' and 'ttft' not in timings.stages:
+                        timings.mark('ttft')
+                    if event['type'] == 'done':
+                        event['response'] = self._complete_response(event['response'], 'query_stream', timings,
+                                                                    user_id, include_timings)
+                    yield event
 
         except Exception as e:
-            self.logger.error(f"Error processing query: {e}")
-            return {
+            self.logger.error(f"Error processing streaming query: {e}")
+            yield {'type': 'done', 'response': {
                 'answer': "I encountered an error while processing your question. Please try again.",
                 'sources_used': 0,
                 'query_type': 'error',
-                'confidence': 0.0
-            }
+                'confidence': 0.0,
+                'error': True
+            }}
+
+    def _stream_events(self, question: str, conversation_history: List[str],
+                       document_name: Union[str, List[str]], user_id: str,
+                       timings: StageTimings) -> Iterator[Dict[str, Any]]:
+        """Answer-cache lookup, then a shared in-flight answer, then a freshly streamed one"""
+        lookup = self._lookup_answer_caches(question, conversation_history, document_name, user_id, timings)
+        if lookup['cached_result']:
+            yield from self._replay(lookup['cached_result'])
+            return
+
+        flight = self.single_flight.begin(self._flight_key(question, document_name, lookup))
+        if not flight.leader:
+            wait_started = time.perf_counter()
+            shared = flight.wait(lambda: self._fetch_shared_answer(question, document_name, lookup))
+            if shared is not None:
+                timings.record('coalesced_wait', wait_started)
+                shared['coalesced'] = True
+                yield from self._replay(shared)
+                return
+
+        try:
+            yield from self._stream_answer(question, conversation_history, document_name, user_id,
+                                           lookup, timings, flight)
+        finally:
+            # Client gone or stream failed: waiting requests compute their own answers
+            flight.finish()
+
+    def _replay(self, response: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """A finished answer as a stream: metadata, the whole answer as one token, done"""
+        yield {'type': 'metadata', **self._stream_metadata(response)}
+        yield {'type': 'token', 'text': response['answer']}
+        yield {'type': 'done', 'response': response}
+
+    def _stream_answer(self, question: str, conversation_history: List[str],
+                       document_name: Union[str, List[str]], user_id: str, lookup: Dict[str, Any],
+                       timings: StageTimings, flight) -> Iterator[Dict[str, Any]]:
+        """Retrieval and streamed generation after an answer-cache miss; publishes the answer to the flight"""
+        retrieval_results = self._retrieve_for_generation(question, conversation_history, document_name,
+                                                          user_id, lookup['corpus_version'], timings)
+        if not retrieval_results['results']:
+            response = self._no_results_response(retrieval_results)
+            flight.finish(response)
+            yield from self._replay(response)
+            return
+
+        yield {
+            'type': 'metadata',
+            'query_type': retrieval_results['query_type'],
+            'sources_used': len(retrieval_results['results']),
+            'sources': [{'document_name': r['metadata'].get('document_name'),
+                         'page_number': r['metadata'].get('page_number')}
+                        for r in retrieval_results['results']],
+            'cached': False,
+            'rerank': retrieval_results.get('rerank'),
+            'context_selection': retrieval_results.get('context_selection'),
+            'retrieval_cached': retrieval_results.get('retrieval_cached', False)
+        }
+
+        generation_started = time.perf_counter()
+        response = None
+        for event in self.llm_handler.stream_response(question, retrieval_results['results'],
+                                                      conversation_history):
+            if event['type'] == 'token':
+                yield event
+            else:
+                response = {key: value for key, value in event.items() if key != 'type'}
+        timings.record('generation', generation_started)
+        if response.get('ttft_ms') is not None:
+            timings.set('llm_ttft', response['ttft_ms'])
+
+        if response.get('error'):
+            # Failed or cut-off answers are not cached
+            response.update(cached=False, query_type=retrieval_results['query_type'])
+            yield {'type': 'done', 'response': response}
+            return
+
+        response = self._finish_response(response, retrieval_results, question, document_name, user_id,
+                                         lookup, timings)
+        flight.finish(response)
+        yield {'type': 'done', 'response': response}
+
+    def _lookup_answer_caches(self, question: str, conversation_history: List[str],
+                              document_name: Union[str, List[str]], user_id: str,
+                              timings: StageTimings) -> Dict[str, Any]:
+        """Exact then semantic answer cache; returns the hit (if any) and the keys to store a new answer under"""
+        # Build cache key with user_id
+        cache_key_suffix = f"_{user_id}" if user_id else ""
+
+        def lookup_exact():
+            # Uploads and deletes bump this, so every cache below invalidates in O(1)
+            version = self.cache.get_corpus_version(user_id)
+            return version, self.cache.get_cached_query_result(question, document_name, suffix=cache_key_suffix,
+                                                               corpus_version=version)
+
+        def prepare_query():
+            # Embedding the search query overlaps the Redis round trips; the store caches it for
+            # the semantic lookup and the retriever
+            with timings.stage('condense'):
+                condensed = self.condenser.condense(question, conversation_history)['query']
+            with timings.stage('embedding'):
+                self.vector_store.embed_queries([condensed])
+            return condensed
+
+        prepared = run_parallel({'cache_lookup': lookup_exact, 'query_prep': prepare_query},
+                                timings, group='prepare')
+        corpus_version, cached_result = prepared['cache_lookup']
+        condensed_query = prepared['query_prep']
+        lookup = {'cached_result': None, 'corpus_version': corpus_version,
+                  'cache_key_suffix': cache_key_suffix, 'semantic_partition': None}
+
+        # Check cache first (if enabled)
+        if cached_result:
+            self.logger.info("Returning cached result")
+            cached_result['cached'] = True
+            lookup['cached_result'] = cached_result
+            return lookup
+
+        # Then a near-duplicate of an answered question over the same corpus
+        if self.semantic_cache.enabled:
+            lookup['semantic_partition'] = self.semantic_cache.partition(user_id, document_name, corpus_version)
+            with timings.stage('semantic_lookup'):
+                semantic_result = self.semantic_cache.lookup(condensed_query, lookup['semantic_partition'])
+            if semantic_result:
+                self.logger.info(f"Semantic cache hit ({semantic_result['semantic_cache']['similarity']})")
+                semantic_result['cached'] = True
+                lookup['cached_result'] = semantic_result
+        return lookup
+
+    def _retrieve_for_generation(self, question: str, conversation_history: List[str],
+                                 document_name: Union[str, List[str]], user_id: str, corpus_version: str,
+                                 timings: StageTimings) -> Dict[str, Any]:
+        """Retrieval plus on-demand image analysis for figure questions"""
+        def retrieve():
+            # Retrieve relevant documents with user filtering
+            return self.retriever.retrieve(
+                question, conversation_history, document_filter=document_name, user_id=user_id,
+                corpus_version=corpus_version)
+
+        needs_images = self._needs_image_extraction(question)
+        calls = {'retrieval': retrieve}
+        if needs_images and isinstance(document_name, str):
+            # Image enrichment starts with retrieval: loading the manifest doesn't depend on the hits
+            calls = {'image_manifest': lambda: self.image_manifests.get_manifest(user_id, document_name), **calls}
+        found = run_parallel(calls, timings)
+        retrieval_results = found['retrieval']
+
+        # ON-DEMAND IMAGE EXTRACTION: If question asks about images/figures, extract them now
+        if retrieval_results['results'] and needs_images:
+            self.logger.info("🖼️ Image-related query detected - extracting images on-demand")
+            # With a document set, look for figures in the document of the best match
+            image_document = document_name if isinstance(document_name, str) else \
+                retrieval_results['results'][0]['metadata'].get('document_name')
+            with timings.stage('images'):
+                retrieval_results = self._enrich_with_images(retrieval_results, image_document, user_id,
+                                                             manifest=found.get('image_manifest'))
+        return retrieval_results
+
+    @staticmethod
+    def _no_results_response(retrieval_results: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'answer': "I couldn't find relevant information in the documents to answer your question.",
+            'sources_used': 0,
+            'query_type': retrieval_results['query_type'],
+            'confidence': 0.0,
+            'cached': False
+        }
+
+    @staticmethod
+    def _stream_metadata(response: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: response.get(key) for key in ('query_type', 'sources_used', 'cached', 'rerank',
+                                                   'context_selection', 'retrieval_cached')}
+
+    def _finish_response(self, response: Dict[str, Any], retrieval_results: Dict[str, Any], question: str,
+                         document_name: Union[str, List[str]], user_id: str, lookup: Dict[str, Any],
+                         timings: StageTimings) -> Dict[str, Any]:
+        """Attach retrieval info to a generated answer and write it to the answer caches"""
+        # Add retrieval info
+        response['query_type'] = retrieval_results['query_type']
+        response['retrieval_stats'] = {
+            'total_found': retrieval_results['total_found'],
+            'used_for_generation': len(retrieval_results['results'])
+        }
+        response['cached'] = False
+        # Streaming bookkeeping isn't part of the cached answer
+        stream_info = {key: response.pop(key) for key in ('provider', 'model', 'ttft_ms') if key in response}
+
+        # Cache the result (if enabled) with user_id suffix; the Redis write and the
+        # semantic-cache insert are independent. Failed answers (provider errors) are never cached.
+        cache_writes = {} if response.get('error') else {
+            'cache_write': lambda: self.cache.cache_query_result(
+                question, document_name, response, ttl=self.config.QUERY_CACHE_TTL,
+                suffix=lookup['cache_key_suffix'], user_id=user_id, corpus_version=lookup['corpus_version'])
+        }
+        if (lookup['semantic_partition'] is not None and not response.get('error')
+                and response.get('confidence', 0) > 0):
+            cache_writes['semantic_store'] = lambda: self.semantic_cache.store(
+                retrieval_results['condensed_query'], lookup['semantic_partition'], response)
+        run_parallel(cache_writes, timings, group='cache_writes')
+
+        # Per-request details (added after caching so cached hits don't replay them)
+        response.update(stream_info)
+        response['rerank'] = retrieval_results.get('rerank')
+        response['context_selection'] = retrieval_results.get('context_selection')
+        response['retrieval_cached'] = retrieval_results.get('retrieval_cached', False)
+
+        return response
+
+    def _complete_response(self, response: Dict[str, Any], kind: str, timings: StageTimings, user_id: str,
+                           include_timings: bool) -> Dict[str, Any]:
+        """Log the request's spans; attach the stage timings only if the caller asked for them"""
+        stages = timings.as_dict()
+        self.logger.info(f"Query stage timings (ms): {stages}")
+        self.span_log.record(
+            kind, timings, user_id=user_id,
+            query_type=response.get('query_type'),
+            cached=response.get('cached', False),
+            coalesced=response.get('coalesced', False),
+            retrieval_cached=response.get('retrieval_cached', False),
+            sources_used=response.get('sources_used', 0),
+            error=bool(response.get('error')),
+            provider=response.get('provider'),
+            model=response.get('model')
+        )
+        if include_timings:
+            response['timings'] = {**stages, 'provider': response.get('provider'), 'model': response.get('model')}
+        else:
+            response.pop('timings', None)
+        return response
 
     def get_system_stats(self) -> Dict[str, Any]:
         """Get system statistics including cache stats"""
@@ -286,7 +618,13 @@ class RAGSystem:
                     'embedding_model': self.config.EMBEDDING_MODEL,
                     'llm_model': self.config.LLM_MODEL
                 },
-                'cache': cache_stats
+                'cache': cache_stats,
+                'semantic_cache': self.semantic_cache.get_stats(),
+                'single_flight': self.single_flight.get_stats(),
+                'span_log': self.span_log.get_stats(),
+                'llm_providers': (self.llm_handler.fallback_handler.get_provider_status()
+                                  if self.llm_handler.fallback_handler else None),
+                'figure_captioning': self.figure_captioner.get_status()
             }
         except Exception as e:
             self.logger.error(f"Error getting stats: {e}")
@@ -296,6 +634,12 @@ class RAGSystem:
         """Delete a specific document from the vector store, optionally filtered by user"""
         try:
             result = self.vector_store.delete_document(document_name, user_id=user_id)
+            if result.get('success'):
+                self.lexical_index.delete_document(user_id, document_name)
+                self.chunk_store.delete_document(user_id, document_name)
+                self.image_manifests.delete_document(user_id, document_name)
+                self.documents.remove(user_id, document_name)
+                self.cache.bump_corpus_version(user_id)
             return result
         except Exception as e:
             self.logger.error(f"Error deleting document: {e}")
@@ -305,6 +649,11 @@ class RAGSystem:
         """Clear all documents from the vector store"""
         try:
             result = self.vector_store.clear_all()
+            self.lexical_index.clear_all()
+            self.chunk_store.clear_all()
+            self.image_manifests.clear_all()
+            self.documents.clear_all()
+            self.cache.bump_global_corpus_version()
             return result
         except Exception as e:
             self.logger.error(f"Error clearing documents: {e}")
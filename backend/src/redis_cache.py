@@ -3,6 +3,7 @@ Redis Cache Manager with Dual Support
 Supports both Upstash (REST API) and local Redis with automatic fallback
 """
 import json
+import uuid
 import hashlib
 import logging
 from typing import Optional, Dict, Any, List
@@ -102,6 +103,13 @@ class RedisCacheManager:
             return self.local_client
         return None
 
+    def _eval(self, script: str, keys: List[str], args: List[Any]) -> Any:
+        """Run a Lua script (Upstash and redis-py take keys and args differently)"""
+        client = self._get_client()
+        if self.mode == "upstash":
+            return client.eval(script, keys=keys, args=[str(arg) for arg in args])
+        return client.eval(script, len(keys), *keys, *args)
+
     def _generate_cache_key(self, prefix: str, data: Any) -> str:
         """
         Generate a cache key from prefix and data
@@ -123,8 +131,21 @@ class RedisCacheManager:
 
     # ========== Query Result Caching ==========
 
+    def query_cache_key(self, question: str, document_name: Optional[str], suffix: str = "",
+                        corpus_version: Optional[str] = None) -> str:
+        """Key a query result is cached under (also identifies identical in-flight queries)"""
+        cache_data = {
+            "question": question,
+            "document_name": document_name,
+            "suffix": suffix
+        }
+        if corpus_version is not None:
+            cache_data["corpus_version"] = corpus_version
+        return self._generate_cache_key("query", cache_data)
+
     def cache_query_result(self, question: str, document_name: Optional[str],
-                          response: Dict[str, Any], ttl: int = 3600, suffix: str = "") -> bool:
+                          response: Dict[str, Any], ttl: int = 3600, suffix: str = "",
+                          user_id: Optional[str] = None, corpus_version: Optional[str] = None) -> bool:
         """
         Cache a query result
 
@@ -134,6 +155,8 @@ class RedisCacheManager:
             response: RAG system response
             ttl: Time to live in seconds (default 1 hour)
             suffix: Optional suffix for cache key (e.g., user_id)
+            user_id: Optional owner; the key is tracked so an account purge can remove it
+            corpus_version: Optional token from get_corpus_version; the entry is unreachable once it changes
 
         Returns:
             True if cached successfully, False otherwise
@@ -143,12 +166,7 @@ class RedisCacheManager:
 
         try:
             client = self._get_client()
-            cache_data = {
-                "question": question,
-                "document_name": document_name,
-                "suffix": suffix
-            }
-            cache_key = self._generate_cache_key("query", cache_data)
+            cache_key = self.query_cache_key(question, document_name, suffix, corpus_version)
 
             # Store result
             client.setex(
@@ -157,6 +175,9 @@ class RedisCacheManager:
                 json.dumps(response)
             )
 
+            if user_id:
+                self.track_user_key(user_id, cache_key, ttl=ttl)
+
             logger.debug(f"Cached query result: {cache_key[:20]}... (TTL: {ttl}s)")
             return True
 
@@ -164,7 +185,8 @@ class RedisCacheManager:
             logger.error(f"Failed to cache query result: {e}")
             return False
 
-    def get_cached_query_result(self, question: str, document_name: Optional[str], suffix: str = "") -> Optional[Dict[str, Any]]:
+    def get_cached_query_result(self, question: str, document_name: Optional[str], suffix: str = "",
+                                corpus_version: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
         Retrieve cached query result
 
@@ -172,6 +194,7 @@ class RedisCacheManager:
             question: User question
             document_name: Optional document filter
             suffix: Optional suffix for cache key (e.g., user_id)
+            corpus_version: Token the entry was cached under (see get_corpus_version)
 
         Returns:
             Cached response or None
@@ -181,12 +204,7 @@ class RedisCacheManager:
 
         try:
             client = self._get_client()
-            cache_data = {
-                "question": question,
-                "document_name": document_name,
-                "suffix": suffix
-            }
-            cache_key = self._generate_cache_key("query", cache_data)
+            cache_key = self.query_cache_key(question, document_name, suffix, corpus_version)
 
             cached = client.get(cache_key)
             if cached:
@@ -202,6 +220,188 @@ class RedisCacheManager:
             logger.error(f"Failed to get cached query: {e}")
             return None
 
+    # ========== Corpus Versions ==========
+
+    def get_corpus_version(self, user_id: Optional[str]) -> str:
+        """
+        Current version token of a user's document set
+
+        Folded into query, retrieval and image cache keys. Uploads and deletes bump
+        the user's counter and clearing every document bumps the global epoch, so
+        entries for an older document set become unreachable in O(1) and simply
+        expire. Both counters are read in one round trip.
+
+        Args:
+            user_id: Document owner (None for shared/legacy documents)
+
+        Returns:
+            '<global epoch>.<user version>' ('0.0' if never bumped or Redis is unavailable)
+        """
+        if not self.enabled:
+            return "0.0"
+
+        try:
+            client = self._get_client()
+            epoch, version = client.mget("corpus_version:global", f"corpus_version:{user_id or 'shared'}")
+            return f"{int(epoch or 0)}.{int(version or 0)}"
+
+        except Exception as e:
+            logger.error(f"Failed to get corpus version: {e}")
+            return "0.0"
+
+    def bump_corpus_version(self, user_id: Optional[str]) -> int:
+        """
+        Advance a user's corpus version after their documents change
+
+        Args:
+            user_id: Document owner (None for shared/legacy documents)
+
+        Returns:
+            New version number (0 if Redis is unavailable)
+        """
+        if not self.enabled:
+            return 0
+
+        try:
+            client = self._get_client()
+            return int(client.incr(f"corpus_version:{user_id or 'shared'}"))
+
+        except Exception as e:
+            logger.error(f"Failed to bump corpus version: {e}")
+            return 0
+
+    def bump_global_corpus_version(self) -> int:
+        """
+        Invalidate every user's cached answers and rankings (after clearing all documents)
+
+        Returns:
+            New global epoch (0 if Redis is unavailable)
+        """
+        if not self.enabled:
+            return 0
+
+        try:
+            client = self._get_client()
+            return int(client.incr("corpus_version:global"))
+
+        except Exception as e:
+            logger.error(f"Failed to bump global corpus version: {e}")
+            return 0
+
+    # ========== Retrieval Result Caching ==========
+
+    def cache_retrieval_result(self, key_data: Dict[str, Any], result: Dict[str, Any],
+                               ttl: int = 3600, user_id: Optional[str] = None) -> bool:
+        """
+        Cache a ranked retrieval (chunk IDs and scores, not chunk text)
+
+        Args:
+            key_data: User, document filter, corpus version and normalised query
+            result: Ranked chunk references from the retriever
+            ttl: Time to live in seconds (default 1 hour)
+            user_id: Optional owner; the key is tracked so an account purge can remove it
+
+        Returns:
+            True if cached successfully, False otherwise
+        """
+        if not self.enabled:
+            return False
+
+        try:
+            client = self._get_client()
+            cache_key = self._generate_cache_key("retrieval", key_data)
+            client.setex(cache_key, ttl, json.dumps(result))
+
+            if user_id:
+                self.track_user_key(user_id, cache_key, ttl=ttl)
+
+            logger.debug(f"Cached retrieval: {cache_key[:24]}... (TTL: {ttl}s)")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to cache retrieval result: {e}")
+            return False
+
+    def get_cached_retrieval_result(self, key_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Retrieve a cached ranked retrieval
+
+        Args:
+            key_data: Same fields as passed to cache_retrieval_result
+
+        Returns:
+            Cached chunk references or None
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            client = self._get_client()
+            cached = client.get(self._generate_cache_key("retrieval", key_data))
+            if cached:
+                return json.loads(cached) if isinstance(cached, str) else cached
+            return None
+
+        except Exception as e:
+            logger.error(f"Failed to get cached retrieval: {e}")
+            return None
+
+    # ========== Image Description Caching ==========
+
+    def cache_image_descriptions(self, descriptions: Dict[str, str], ttl: int = 2592000) -> bool:
+        """
+        Cache vision-model descriptions by image content hash
+
+        The key is derived from the image bytes (and analysis prompt) only, so one
+        analysis serves every page, document and user that contains the same image.
+
+        Args:
+            descriptions: Content hash -> description
+            ttl: Time to live in seconds (default 30 days; content-addressed entries never go stale)
+
+        Returns:
+            True if cached successfully, False otherwise
+        """
+        if not self.enabled or not descriptions:
+            return False
+
+        try:
+            client = self._get_client()
+            for image_hash, description in descriptions.items():
+                client.setex(f"image_desc:{image_hash}", ttl, description)
+            logger.debug(f"Cached {len(descriptions)} image descriptions (TTL: {ttl}s)")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to cache image descriptions: {e}")
+            return False
+
+    def get_cached_image_descriptions(self, image_hashes: List[str]) -> Dict[str, str]:
+        """
+        Look up image descriptions in one round trip
+
+        Args:
+            image_hashes: Content hashes as passed to cache_image_descriptions
+
+        Returns:
+            Content hash -> description for the hashes that are cached
+        """
+        if not self.enabled or not image_hashes:
+            return {}
+
+        try:
+            client = self._get_client()
+            values = client.mget(*[f"image_desc:{image_hash}" for image_hash in image_hashes])
+            found = {}
+            for image_hash, value in zip(image_hashes, values or []):
+                if value:
+                    found[image_hash] = value.decode('utf-8') if isinstance(value, bytes) else value
+            return found
+
+        except Exception as e:
+            logger.error(f"Failed to get cached image descriptions: {e}")
+            return {}
+
     # ========== Session Management ==========
 
     def create_session(self, session_id: str, user_data: Dict[str, Any], ttl: int = 86400) -> bool:
@@ -506,6 +706,309 @@ class RedisCacheManager:
             logger.error(f"Failed to get document metadata: {e}")
             return None
 
+    # ========== Per-User Key Tracking (account purge) ==========
+
+    # Add the key and never shrink the index TTL below the longest-lived tracked key
+    TRACK_USER_KEY_SCRIPT = (
+        "redis.call('sadd', KEYS[1], ARGV[1]) "
+        "if redis.call('ttl', KEYS[1]) < tonumber(ARGV[2]) then redis.call('expire', KEYS[1], ARGV[2]) end "
+        "return 1"
+    )
+
+    def track_user_key(self, user_id: str, key: str, ttl: int = 86400) -> bool:
+        """
+        Remember a hashed cache key as belonging to a user
+
+        Query cache keys are SHA-256 digests, so they cannot be found by pattern
+        later. The tracking set lives at most as long as the keys it indexes.
+
+        Args:
+            user_id: Owner of the key
+            key: Full Redis key
+            ttl: Lifetime of the tracked key in seconds
+
+        Returns:
+            True if tracked successfully
+        """
+        if not self.enabled:
+            return False
+
+        try:
+            # One round trip: each command is a separate HTTP call on Upstash
+            self._eval(self.TRACK_USER_KEY_SCRIPT, [f"user_keys:{user_id}"], [key, ttl])
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to track user key: {e}")
+            return False
+
+    def track_user_audio(self, user_id: str, audio_id: str, ttl: int = 86400) -> bool:
+        """
+        Remember an auto-generated audio file as belonging to a user
+
+        Args:
+            user_id: Owner of the audio
+            audio_id: Audio identifier (file stem without the 'auto_' prefix)
+            ttl: Matches the audio cleanup window (default 24 hours)
+
+        Returns:
+            True if tracked successfully
+        """
+        if not self.enabled:
+            return False
+
+        try:
+            client = self._get_client()
+            audio_key = f"user_audio:{user_id}"
+            client.sadd(audio_key, audio_id)
+            client.expire(audio_key, ttl)
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to track user audio: {e}")
+            return False
+
+    def get_user_audio_ids(self, user_id: str) -> List[str]:
+        """
+        Get audio identifiers generated for a user
+
+        Args:
+            user_id: User identifier
+
+        Returns:
+            List of audio IDs (empty list if none found)
+        """
+        if not self.enabled:
+            return []
+
+        try:
+            client = self._get_client()
+            return list(client.smembers(f"user_audio:{user_id}") or [])
+
+        except Exception as e:
+            logger.error(f"Failed to get user audio ids: {e}")
+            return []
+
+    def get_user_keys(self, user_id: str) -> List[str]:
+        """
+        Get every Redis key that belongs to a user
+
+        Args:
+            user_id: User identifier
+
+        Returns:
+            Tracked query keys plus the fixed per-user keys
+        """
+        keys = [
+            f"conversation:{user_id}",
+            f"rate:query:{user_id}",
+            f"user_audio:{user_id}",
+            f"corpus_version:{user_id}",
+        ]
+        if not self.enabled:
+            return keys
+
+        try:
+            client = self._get_client()
+            tracked = client.smembers(f"user_keys:{user_id}") or []
+            keys.extend(tracked)
+        except Exception as e:
+            logger.error(f"Failed to get user keys: {e}")
+
+        # Index key last so a partial purge can be resumed
+        keys.append(f"user_keys:{user_id}")
+        return keys
+
+    def delete_keys(self, keys: List[str]) -> int:
+        """
+        Delete a batch of keys in a single round trip
+
+        Args:
+            keys: Keys to delete
+
+        Returns:
+            Number of keys removed
+        """
+        if not self.enabled or not keys:
+            return 0
+
+        try:
+            client = self._get_client()
+            return int(client.delete(*keys) or 0)
+
+        except Exception as e:
+            logger.error(f"Failed to delete keys: {e}")
+            return 0
+
+    # ========== Account Purge Jobs ==========
+
+    # Job IDs newest first, so every worker can list recent jobs
+    PURGE_JOBS_INDEX = "purge_jobs"
+
+    def save_purge_job(self, job: Dict[str, Any], ttl: int = 604800, index_size: int = 200) -> bool:
+        """
+        Store an account purge job's progress for all workers
+
+        Args:
+            job: Job snapshot (must contain 'job_id')
+            ttl: Seconds to keep the record after its last update (default 7 days)
+            index_size: Newest job IDs kept in the listing index; 0 skips indexing (progress updates)
+
+        Returns:
+            True if stored successfully
+        """
+        if not self.enabled:
+            return False
+
+        try:
+            client = self._get_client()
+            client.setex(f"purge_job:{job['job_id']}", ttl, json.dumps(job))
+            if index_size:
+                client.lpush(self.PURGE_JOBS_INDEX, job['job_id'])
+                client.ltrim(self.PURGE_JOBS_INDEX, 0, index_size - 1)
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to save purge job: {e}")
+            return False
+
+    def get_purge_jobs(self, job_ids: List[str] = None) -> List[Dict[str, Any]]:
+        """
+        Read purge jobs in one round trip
+
+        Args:
+            job_ids: Jobs to read; None reads every indexed job, newest first
+
+        Returns:
+            Job snapshots that still exist (expired records are skipped)
+        """
+        if not self.enabled:
+            return []
+
+        try:
+            client = self._get_client()
+            if job_ids is None:
+                job_ids = list(client.lrange(self.PURGE_JOBS_INDEX, 0, -1) or [])
+            if not job_ids:
+                return []
+            values = client.mget(*[f"purge_job:{job_id}" for job_id in job_ids])
+            return [json.loads(value) if isinstance(value, (str, bytes)) else value
+                    for value in values or [] if value]
+
+        except Exception as e:
+            logger.error(f"Failed to get purge jobs: {e}")
+            return []
+
+    # ========== LLM Provider Health ==========
+
+    def save_provider_health(self, provider: str, state: Dict[str, Any], ttl: int = 3600) -> bool:
+        """
+        Store one LLM provider's routing state (latency, error rate, circuit) for all workers
+
+        Args:
+            provider: Provider name
+            state: ProviderHealth state dict
+            ttl: Seconds to keep it without updates (default 1 hour; stale health is worse than none)
+
+        Returns:
+            True if stored successfully
+        """
+        if not self.enabled:
+            return False
+
+        try:
+            client = self._get_client()
+            client.setex(f"llm_health:{provider}", ttl, json.dumps(state))
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to save provider health: {e}")
+            return False
+
+    def get_provider_health(self, providers: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Read the shared routing state of several providers in one round trip
+
+        Returns:
+            Provider name -> state for the providers that have one
+        """
+        if not self.enabled or not providers:
+            return {}
+
+        try:
+            client = self._get_client()
+            values = client.mget(*[f"llm_health:{provider}" for provider in providers])
+            found = {}
+            for provider, value in zip(providers, values or []):
+                if value:
+                    found[provider] = json.loads(value) if isinstance(value, (str, bytes)) else value
+            return found
+
+        except Exception as e:
+            logger.error(f"Failed to get provider health: {e}")
+            return {}
+
+    # ========== Distributed Locks ==========
+
+    # Delete the lock only if it still holds our token (it may have expired and been re-acquired)
+    RELEASE_LOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def acquire_lock(self, name: str, ttl: int = 60) -> Optional[str]:
+        """
+        Try to take a short-lived lock shared by every worker (SET NX EX)
+
+        Args:
+            name: Lock name (stored under "lock:{name}")
+            ttl: Seconds until the lock expires on its own if never released
+
+        Returns:
+            A token for release_lock, or None if another holder has the lock.
+            Without Redis (or on errors) the lock is granted, so callers fall back to per-process behaviour.
+        """
+        token = uuid.uuid4().hex
+        if not self.enabled:
+            return token
+
+        try:
+            client = self._get_client()
+            acquired = client.set(f"lock:{name}", token, ex=ttl, nx=True)
+            return token if acquired else None
+
+        except Exception as e:
+            logger.error(f"Failed to acquire lock {name}: {e}")
+            return token
+
+    def release_lock(self, name: str, token: str) -> bool:
+        """
+        Release a lock taken with acquire_lock
+
+        Returns:
+            True if the lock was still ours and is now released
+        """
+        if not self.enabled or not token:
+            return False
+
+        try:
+            released = self._eval(self.RELEASE_LOCK_SCRIPT, [f"lock:{name}"], [token])
+            return bool(released)
+
+        except Exception as e:
+            logger.error(f"Failed to release lock {name}: {e}")
+            return False
+
+    def is_locked(self, name: str) -> bool:
+        """Check whether any worker holds a lock (False without Redis)"""
+        if not self.enabled:
+            return False
+
+        try:
+            client = self._get_client()
+            return bool(client.exists(f"lock:{name}"))
+
+        except Exception as e:
+            logger.error(f"Failed to check lock {name}: {e}")
+            return False
+
     # ========== Cache Management ==========
 
     def clear_all_cache(self) -> bool:
@@ -524,7 +1027,8 @@ class RedisCacheManager:
             # Different approach for Upstash vs local Redis
             if self.mode == "upstash":
                 # Upstash: Delete specific key patterns
-                for prefix in ["query:", "session:", "rate:", "doc_meta:"]:
+                for prefix in ["query:", "retrieval:", "image_desc:", "session:", "rate:", "doc_meta:", "lock:",
+                               "llm_health:"]:
                     keys = client.keys(f"{prefix}*")
                     if keys:
                         for key in keys:
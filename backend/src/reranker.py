@@ -0,0 +1,149 @@
+"""
+Optional CPU cross-encoder reranking with a hard latency budget
+
+Scores (query, chunk) pairs for the top candidates in one batched
+CrossEncoder.predict call. Scores are cached per (query hash, chunk ID), so
+repeated questions and follow-ups over the same chunks cost nothing.
+
+The model runs on a native worker thread. If it doesn't finish within
+RERANKER_TIME_BUDGET_MS, the request keeps the incoming (vector/RRF) order.
+The worker still completes and fills the cache for the next request.
+"""
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from sentence_transformers import CrossEncoder
+    CROSS_ENCODER_AVAILABLE = True
+except ImportError:
+    CROSS_ENCODER_AVAILABLE = False
+
+
+def _native_executor():
+    """A thread pool that really runs in parallel under gevent (monkey-patched threads are greenlets)"""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+            return GeventThreadPoolExecutor(max_workers=1)
+    except ImportError:
+        pass
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='reranker')
+
+
+class CrossEncoderReranker:
+    """Batched cross-encoder reranking with a score cache and time budget"""
+
+    def __init__(self, config):
+        self.enabled = getattr(config, 'RERANKER_ENABLED', False) and CROSS_ENCODER_AVAILABLE
+        self.model_name = getattr(config, 'RERANKER_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+        self.max_candidates = getattr(config, 'RERANKER_MAX_CANDIDATES', 20)
+        self.budget_s = getattr(config, 'RERANKER_TIME_BUDGET_MS', 150) / 1000
+        self.cache_size = getattr(config, 'RERANKER_CACHE_SIZE', 4096)
+
+        if getattr(config, 'RERANKER_ENABLED', False) and not CROSS_ENCODER_AVAILABLE:
+            logger.warning("Reranker enabled but sentence-transformers is not installed - skipping rerank stage")
+
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._executor = _native_executor() if self.enabled else None
+        self._cache: 'OrderedDict[Tuple[str, str], float]' = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _get_model(self):
+        with self._model_lock:
+            if self._model is None:
+                logger.info(f"Loading cross-encoder: {self.model_name}")
+                self._model = CrossEncoder(self.model_name, device='cpu', max_length=512)
+                logger.info("✅ Cross-encoder loaded")
+            return self._model
+
+    def warmup(self):
+        """Load the model ahead of the first request"""
+        if self.enabled:
+            self._get_model()
+
+    def rerank(self, query: str, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Reorder the top candidates by cross-encoder score
+
+        Args:
+            query: User question
+            results: Ranked candidates (dicts with 'id' and 'content')
+
+        Returns:
+            (results, stats): reranked results (or the input order on timeout/error)
+            and per-request stats for response metadata
+        """
+        stats = {'applied': False, 'latency_ms': 0.0, 'candidates': 0, 'cache_hits': 0, 'timed_out': False}
+        if not self.enabled or len(results) < 2:
+            return results, stats
+
+        started = time.perf_counter()
+        candidates = results[:self.max_candidates]
+        query_hash = hashlib.sha256(query.strip().lower().encode('utf-8')).hexdigest()[:16]
+        keys = [(query_hash, r.get('id') or hashlib.sha256(r['content'].encode('utf-8')).hexdigest()[:16])
+                for r in candidates]
+        stats['candidates'] = len(candidates)
+
+        scores = self._cached_scores(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        stats['cache_hits'] = len(candidates) - len(missing)
+
+        if missing:
+            pairs = [(query, candidates[i]['content']) for i in missing]
+            future = self._executor.submit(self._score, pairs, [keys[i] for i in missing])
+            try:
+                remaining = max(0.0, self.budget_s - (time.perf_counter() - started))
+                for i, score in zip(missing, future.result(timeout=remaining)):
+                    scores[i] = score
+            except FutureTimeoutError:
+                stats['timed_out'] = True
+                stats['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+                logger.warning(f"Rerank exceeded {self.budget_s * 1000:.0f}ms budget - keeping vector order")
+                return results, stats
+            except Exception as e:
+                logger.error(f"Rerank failed: {e}")
+                stats['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+                return results, stats
+
+        reranked = [{**r, 'rerank_score': score} for r, score in zip(candidates, scores)]
+        reranked.sort(key=lambda r: r['rerank_score'], reverse=True)
+
+        # Candidates past max_candidates were never scored; they rank below every scored one (in their
+        # incoming order) so MMR doesn't compare cross-encoder logits with RRF or cosine values
+        floor = reranked[-1]['rerank_score']
+        tail = [{**r, 'rerank_score': floor - (i + 1) * 1e-3} for i, r in enumerate(results[len(candidates):])]
+
+        stats['applied'] = True
+        stats['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return reranked + tail, stats
+
+    def _score(self, pairs: List[Tuple[str, str]], keys: List[Tuple[str, str]]) -> List[float]:
+        """Runs on the worker thread; caches scores even if the caller already gave up"""
+        scores = [float(s) for s in self._get_model().predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+        with self._cache_lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return scores
+
+    def _cached_scores(self, keys: List[Tuple[str, str]]) -> List[Any]:
+        with self._cache_lock:
+            scores = []
+            for key in keys:
+                score = self._cache.get(key)
+                if score is not None:
+                    self._cache.move_to_end(key)
+                scores.append(score)
+            return scores
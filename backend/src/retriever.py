@@ -1,33 +1,129 @@
 # src/retriever.py
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Union
 import re
 import numpy as np
 from collections import defaultdict
+from .query_condenser import QueryCondenser
+from .fanout import span
+
+# "page 12", "pages 3-7", "pg. 4 to 6"
+PAGE_REFERENCE_PATTERN = re.compile(r'\b(pages?|pg\.?)\s*(\d+)', re.IGNORECASE)
+# Another page after a page number: "-", "to", "through" make a range; ",", "and", "&" a list.
+# The next number may repeat the keyword ("from page 2 to page 4", "page 3, page 5 and page 7").
+PAGE_CONTINUATION_PATTERN = re.compile(
+    r'\s*(?:(-|–|\bto\b|\bthrough\b)|(,\s*(?:and\b)?|\band\b|&))\s*(pages?\s*|pg\.?\s*)?(\d+)\b', re.IGNORECASE)
+# A word right after a bare listed number means it isn't a page ("page 12 and 2 other examples")
+FOLLOWED_BY_WORD = re.compile(r'\s*[^\W\d]')
+
+# Query types that have a dedicated chunk type in the store
+TYPED_QUERY_CHUNKS = {'table': 'table', 'image': 'image'}
+
+# Ranking fields kept in the retrieval cache next to each chunk ID
+CACHED_SCORE_FIELDS = ('score', 'distance', 'raw_distance', 'rrf_score', 'lexical_score', 'rerank_score')
+
 
 class SmartRetriever:
-    def __init__(self, vector_store, config):
+    def __init__(self, vector_store, config, lexical_index=None, reranker=None, condenser=None,
+                 chunk_store=None, retrieval_cache=None):
         self.vector_store = vector_store
         self.config = config
+        # Small-to-big: ChunkWindowStore used to widen small hits to their neighbouring chunks
+        self.chunk_store = chunk_store if getattr(config, 'SMALL_TO_BIG_ENABLED', True) else None
+        # Turns follow-up questions into short standalone search queries
+        self.condenser = condenser or QueryCondenser(config)
+        # Optional BM25 index fused with vector results (hybrid retrieval)
+        self.lexical_index = lexical_index if getattr(config, 'HYBRID_SEARCH_ENABLED', True) else None
+        # Optional cross-encoder stage (CrossEncoderReranker); disabled rerankers are no-ops
+        self.reranker = reranker
+        # RedisCacheManager holding ranked chunk IDs per (user, documents, corpus version, query)
+        self.retrieval_cache = retrieval_cache if getattr(config, 'RETRIEVAL_CACHE_ENABLED', True) else None
         
-    def retrieve(self, query: str, context_history: List[str] = None, document_filter: str = None, user_id: str = None) -> Dict[str, Any]:
-        """Intelligent retrieval with context awareness and user filtering"""
+    def retrieve(self, query: str, context_history: List[str] = None, document_filter: Union[str, List[str]] = None,
+                 user_id: str = None, corpus_version: str = None) -> Dict[str, Any]:
+        """Intelligent retrieval with context awareness and user filtering
+
+        document_filter may be a single document name or a list (document set).
+        corpus_version is the caller's RedisCacheManager.get_corpus_version token (fetched if omitted).
+        """
 
-        # Enhance query with context if available
-        enhanced_query = self._enhance_query_with_context(query, context_history)
+        # Standalone search query: the question plus the few terms it refers back to
+        with span('condense'):
+            condensed = self.condenser.condense(query, context_history)
+        enhanced_query = condensed['query']
 
         # Detect query type
         query_type = self._detect_query_type(query)
 
+        # Structured predicates are pushed down into the store's query
+        filters = self._build_filters(query, document_filter)
+        single_document = document_filter if isinstance(document_filter, str) else None
+
+        # Same standalone query over the same corpus: skip embedding, search and rerank
+        cache_key = self._retrieval_cache_key(enhanced_query, query_type, filters, document_filter, user_id,
+                                              corpus_version)
+        if cache_key:
+            with span('retrieval_cache'):
+                cached = self._load_cached_retrieval(cache_key)
+            if cached:
+                top_results = cached['results']
+                if self.chunk_store:
+                    with span('window_expansion'):
+                        top_results = self._expand_windows(top_results, user_id)
+                return {
+                    'query': query,
+                    'condensed_query': enhanced_query,
+                    'condense': {key: condensed[key] for key in ('method', 'cached', 'latency_ms')},
+                    'query_type': query_type,
+                    'results': top_results,
+                    'rerank': None,
+                    'context_selection': cached.get('context_selection'),
+                    'retrieval_cached': True,
+                    'total_found': cached.get('total_found', len(top_results))
+                }
+
         # Perform search with user filtering (ChromaDB returns nested lists)
-        search_results = self.vector_store.search(
-            enhanced_query,
-            n_results=self.config.TOP_K_RESULTS * 2,  # Get more for filtering
-            document_filter=document_filter,
-            user_id=user_id
-        )
+        with span('vector_search'):
+            search_results = self.vector_store.search(
+                enhanced_query,
+                n_results=self.config.TOP_K_RESULTS * 2,  # Get more for filtering
+                document_filter=single_document,
+                user_id=user_id,
+                filters=filters
+            )
+
+            # Too few hits on the referenced pages (past the last page, a misread reference) shouldn't
+            # starve the answer: the page hits stay first, topped up from the whole search scope
+            unfiltered_results = None
+            page_keys = [key for key in ('page_range', 'pages') if key in filters]
+            if page_keys and len(search_results['documents'][0]) < self.config.TOP_K_RESULTS:
+                for key in page_keys:
+                    filters.pop(key)
+                unfiltered_results = self.vector_store.search(
+                    enhanced_query,
+                    n_results=self.config.TOP_K_RESULTS * 2,
+                    document_filter=single_document,
+                    user_id=user_id,
+                    filters=filters
+                )
 
         # Flatten ChromaDB nested results if needed
         flattened_results = self._flatten_chroma_results(search_results)
+        if unfiltered_results is not None:
+            flattened_results = self._merge_results(flattened_results,
+                                                    self._flatten_chroma_results(unfiltered_results))
+
+        # Table/image queries fetch matching chunks directly instead of hoping they're in the pool
+        chunk_type = TYPED_QUERY_CHUNKS.get(query_type)
+        if chunk_type:
+            with span('vector_search'):
+                typed_results = self.vector_store.search(
+                    enhanced_query,
+                    n_results=self.config.TOP_K_RESULTS,
+                    document_filter=single_document,
+                    user_id=user_id,
+                    filters={**filters, 'chunk_types': [chunk_type]}
+                )
+            flattened_results = self._merge_results(flattened_results, self._flatten_chroma_results(typed_results))
 
         # Filter and rank results based on query type
         filtered_results = self._filter_by_query_type(flattened_results, query_type)
@@ -35,32 +131,162 @@ class SmartRetriever:
         # Re-rank results
         ranked_results = self._rerank_results(filtered_results, query, query_type)
 
+        # Hybrid: fuse with BM25 hits so exact terms (formulas, section numbers) aren't missed
+        if self.lexical_index and user_id:
+            with span('lexical_search'):
+                lexical_results = self.lexical_index.search(
+                    user_id, enhanced_query,
+                    n_results=self.config.TOP_K_RESULTS * 2,
+                    document_filter=single_document,
+                    filters=filters
+                )
+            if lexical_results:
+                ranked_results = self._fuse_rrf(ranked_results, lexical_results)
+
+        # Cross-encoder rerank of the top candidates (falls back to this order past its time budget)
+        rerank_stats = None
+        if self.reranker:
+            with span('rerank'):
+                ranked_results, rerank_stats = self.reranker.rerank(enhanced_query, ranked_results)
+
+        # Diversify: drop near-duplicate overlapping chunks in favour of new information
+        if getattr(self.config, 'MMR_ENABLED', True):
+            top_results = self._apply_mmr(ranked_results, self.config.TOP_K_RESULTS)
+        else:
+            top_results = ranked_results[:self.config.TOP_K_RESULTS]
+
+        # Adaptive context size: drop chunks under the similarity floor or past the score elbow
+        selection_stats = None
+        if getattr(self.config, 'CONTEXT_SELECTION_ENABLED', True):
+            top_results, selection_stats = self._select_context(top_results)
+
+        # Guarantee the best matching table/image chunk a slot when one exists
+        if chunk_type and top_results and not any(r['metadata'].get('chunk_type') == chunk_type for r in top_results):
+            best_typed = next((r for r in ranked_results if r['metadata'].get('chunk_type') == chunk_type), None)
+            if best_typed:
+                if len(top_results) < self.config.TOP_K_RESULTS:
+                    top_results.append(best_typed)
+                else:
+                    top_results[-1] = best_typed
+
+        # A ranking cut short by the rerank budget isn't worth replaying
+        if cache_key and not (rerank_stats and rerank_stats.get('timed_out')):
+            self._store_cached_retrieval(cache_key, top_results, selection_stats,
+                                         len(flattened_results['documents']), user_id)
+
+        # Small-to-big: hand the LLM each hit's surrounding passage, merged and deduplicated
+        if self.chunk_store:
+            with span('window_expansion'):
+                top_results = self._expand_windows(top_results, user_id)
+
         return {
             'query': query,
+            'condensed_query': enhanced_query,
+            'condense': {key: condensed[key] for key in ('method', 'cached', 'latency_ms')},
             'query_type': query_type,
-            'results': ranked_results[:self.config.TOP_K_RESULTS],
+            'results': top_results,
+            'rerank': rerank_stats,
+            'context_selection': selection_stats,
+            'retrieval_cached': False,
             'total_found': len(flattened_results['documents'])
         }
 
+    def _retrieval_cache_key(self, search_query: str, query_type: str, filters: Dict[str, Any],
+                             document_filter: Union[str, List[str]], user_id: str, corpus_version: str = None):
+        """Key fields for the retrieval cache, or None when caching is off"""
+        if not self.retrieval_cache or not self.retrieval_cache.enabled:
+            return None
+        if corpus_version is None:
+            corpus_version = self.retrieval_cache.get_corpus_version(user_id)
+        return {
+            'user_id': user_id,
+            'documents': sorted(document_filter) if isinstance(document_filter, (list, tuple, set))
+            else document_filter,
+            'corpus_version': corpus_version,
+            'query': ' '.join(search_query.lower().split()).strip(' ?.!।'),
+            'query_type': query_type,
+            'filters': {key: list(value) for key, value in filters.items()}
+        }
+
+    def _load_cached_retrieval(self, cache_key: Dict[str, Any]):
+        """Rebuild cached chunk references from the store; None if any chunk has since gone"""
+        cached = self.retrieval_cache.get_cached_retrieval_result(cache_key)
+        if not cached or not cached.get('results'):
+            return None
+
+        refs = cached['results']
+        try:
+            chunks = self.vector_store.get_chunks([ref['id'] for ref in refs])
+        except Exception:
+            return None
+        if any(doc is None for doc in chunks['documents']):
+            return None
+
+        cached['results'] = [{**ref, 'content': doc, 'metadata': meta}
+                             for ref, doc, meta in zip(refs, chunks['documents'], chunks['metadatas'])]
+        return cached
+
+    def _store_cached_retrieval(self, cache_key: Dict[str, Any], results: List[Dict[str, Any]],
+                                selection_stats: Dict[str, Any], total_found: int, user_id: str):
+        if not results or any(r.get('id') is None for r in results):
+            return
+        refs = [{'id': r['id'], **{field: float(r[field]) for field in CACHED_SCORE_FIELDS if field in r}}
+                for r in results]
+        self.retrieval_cache.cache_retrieval_result(
+            cache_key,
+            {'results': refs, 'context_selection': selection_stats, 'total_found': total_found},
+            ttl=getattr(self.config, 'RETRIEVAL_CACHE_TTL', 3600),
+            user_id=user_id
+        )
+
     def _flatten_chroma_results(self, results: Dict[str, Any]) -> Dict[str, Any]:
         """Flatten ChromaDB nested list results to simple lists"""
         # ChromaDB returns [[doc1, doc2]] format, we need [doc1, doc2]
         if results['documents'] and isinstance(results['documents'][0], list):
-            return {
+            flattened = {
                 'documents': results['documents'][0],
                 'metadatas': results['metadatas'][0],
                 'distances': results['distances'][0]
             }
+            # Chunk IDs let later stages (MMR) fetch embeddings from the store
+            if results.get('ids'):
+                flattened['ids'] = results['ids'][0]
+            return flattened
         return results
-    
-    def _enhance_query_with_context(self, query: str, context_history: List[str]) -> str:
-        """Enhance query with conversation context"""
-        if not context_history:
-            return query
-            
-        # Simple context enhancement - can be made more sophisticated
-        recent_context = ' '.join(context_history[-2:])  # Last 2 exchanges
-        return f"{recent_context} {query}"
+
+    def _build_filters(self, query: str, document_filter: Union[str, List[str]] = None) -> Dict[str, Any]:
+        """Derive structured store filters (page range, document set) from the request"""
+        filters = {}
+
+        pages = parse_page_references(query)
+        if pages:
+            if pages[-1] - pages[0] + 1 == len(pages):
+                filters['page_range'] = (pages[0], pages[-1])
+            else:
+                filters['pages'] = pages
+
+        if isinstance(document_filter, (list, tuple, set)) and document_filter:
+            filters['documents'] = sorted(document_filter)
+
+        return filters
+
+    def _merge_results(self, primary: Dict[str, Any], extra: Dict[str, Any]) -> Dict[str, Any]:
+        """Append results from a filtered pass that the primary pass didn't already return"""
+        merged = {key: list(primary[key]) for key in ('documents', 'metadatas', 'distances')}
+        merged['ids'] = list(self._result_ids(primary))
+        seen = {(meta.get('document_name'), doc) for doc, meta in zip(primary['documents'], primary['metadatas'])}
+
+        for chunk_id, doc, meta, dist in zip(self._result_ids(extra), extra['documents'],
+                                             extra['metadatas'], extra['distances']):
+            key = (meta.get('document_name'), doc)
+            if key not in seen:
+                seen.add(key)
+                merged['ids'].append(chunk_id)
+                merged['documents'].append(doc)
+                merged['metadatas'].append(meta)
+                merged['distances'].append(dist)
+
+        return merged
     
     def _detect_query_type(self, query: str) -> str:
         """Detect the type of query to optimize retrieval"""
@@ -89,6 +315,7 @@ class SmartRetriever:
         if query_type == 'general':
             return search_results
         
+        filtered_ids = list(self._result_ids(search_results))
         filtered_docs = []
         filtered_metadata = []
         filtered_distances = []
@@ -117,16 +344,184 @@ class SmartRetriever:
                 filtered_distances.append(dist)
         
         return {
+            'ids': filtered_ids,
             'documents': filtered_docs,
             'metadatas': filtered_metadata,
-            'distances': filtered_distances
+            'distances': filtered_distances,
+            # Un-boosted distances, for the similarity floor in _select_context
+            'raw_distances': list(search_results['distances'])
         }
+
+    @staticmethod
+    def _result_ids(results: Dict[str, Any]) -> List[str]:
+        """Chunk IDs aligned with results['documents'] (None where a backend didn't return them)"""
+        return results.get('ids') or [None] * len(results['documents'])
     
+    def _fuse_rrf(self, vector_ranked: List[Dict[str, Any]],
+                  lexical_ranked: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Reciprocal-rank fusion of the vector and BM25 rankings
+
+        Vector hits keep their similarity 'score' (used for confidence); lexical-only
+        hits get the weakest vector score so they never inflate confidence.
+        """
+        k = getattr(self.config, 'HYBRID_RRF_K', 60)
+        fused = {}
+
+        for rank, result in enumerate(vector_ranked):
+            key = (result['metadata'].get('document_name'), result['content'])
+            entry = fused.setdefault(key, {**result, 'rrf_score': 0.0})
+            entry['rrf_score'] += 1.0 / (k + rank + 1)
+
+        floor = min((r['score'] for r in vector_ranked), default=0.0)
+        raw_floor = max((r.get('raw_distance', r['distance']) for r in vector_ranked), default=1 - floor)
+        for rank, result in enumerate(lexical_ranked):
+            key = (result['metadata'].get('document_name'), result['content'])
+            entry = fused.setdefault(key, {
+                'id': result.get('id'),
+                'content': result['content'],
+                'metadata': result['metadata'],
+                'score': floor,
+                'distance': 1 - floor,
+                'raw_distance': raw_floor,
+                'rrf_score': 0.0
+            })
+            entry['lexical_score'] = result['score']
+            entry['rrf_score'] += 1.0 / (k + rank + 1)
+
+        return sorted(fused.values(), key=lambda r: r['rrf_score'], reverse=True)
+
+    def _apply_mmr(self, ranked: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+        """Maximal marginal relevance over the ranked pool using chunk embeddings from the store
+
+        Relevance is the pool's ranking score (cross-encoder, else RRF, else similarity) scaled
+        to [0, 1]; redundancy is cosine similarity to the chunks already chosen.
+        MMR_LAMBDA = 1.0 reproduces the plain ranking.
+        """
+        pool = ranked[:k * getattr(self.config, 'MMR_POOL_FACTOR', 4)]
+        ids = [r.get('id') for r in pool]
+        if len(pool) <= k or None in ids:
+            return ranked[:k]
+
+        try:
+            embeddings = self.vector_store.get_embeddings(ids)
+        except Exception:
+            return ranked[:k]
+
+        relevance = np.array([r.get('rerank_score', r.get('rrf_score', r['score'])) for r in pool],
+                             dtype=np.float32)
+        spread = relevance.max() - relevance.min()
+        relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+
+        # All pairwise similarities in one matrix product (embeddings are L2-normalised)
+        similarity = embeddings @ embeddings.T
+        lam = getattr(self.config, 'MMR_LAMBDA', 0.7)
+
+        selected = [0]
+        max_similarity = similarity[0].copy()
+        for _ in range(k - 1):
+            mmr = lam * relevance - (1 - lam) * max_similarity
+            mmr[selected] = -np.inf
+            best = int(np.argmax(mmr))
+            selected.append(best)
+            np.maximum(max_similarity, similarity[best], out=max_similarity)
+
+        return [pool[i] for i in selected]
+
+    def _select_context(self, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Keep only the chunks that clear the similarity floor and the elbow of the score curve
+
+        Similarity is the raw cosine (1 - raw_distance), before the table/image distance boost. Among the
+        chunks above SIMILARITY_THRESHOLD, the largest drop between consecutive sorted
+        similarities is the elbow; if it is at least CONTEXT_ELBOW_MIN_GAP, chunks below it
+        are dropped too. The first CONTEXT_MIN_RESULTS chunks and the strongest BM25 hit
+        (exact terms often embed poorly) are always kept. Order is preserved.
+        """
+        min_results = getattr(self.config, 'CONTEXT_MIN_RESULTS', 2)
+        floor = getattr(self.config, 'SIMILARITY_THRESHOLD', 0.3)
+        min_gap = getattr(self.config, 'CONTEXT_ELBOW_MIN_GAP', 0.1)
+
+        stats = {'candidates': len(results), 'selected': len(results), 'cutoff': None}
+        if len(results) <= min_results:
+            return results, stats
+
+        similarities = np.array([1 - r.get('raw_distance', r['distance']) for r in results], dtype=np.float32)
+        cutoff = floor
+        above_floor = np.sort(similarities[similarities >= floor])[::-1]
+        if len(above_floor) > 1:
+            gaps = above_floor[:-1] - above_floor[1:]
+            elbow = int(np.argmax(gaps))
+            if gaps[elbow] >= min_gap:
+                cutoff = float(above_floor[elbow])
+
+        keep = similarities >= cutoff
+        keep[:min_results] = True
+        lexical = [i for i, r in enumerate(results) if r.get('lexical_score') is not None]
+        if lexical:
+            keep[max(lexical, key=lambda i: results[i]['lexical_score'])] = True
+
+        selected = [r for r, kept in zip(results, keep) if kept]
+        stats.update(selected=len(selected), cutoff=round(float(cutoff), 4))
+        return selected, stats
+
+    def _expand_windows(self, results: List[Dict[str, Any]], user_id: str = None) -> List[Dict[str, Any]]:
+        """Widen each small text hit to CHUNK_WINDOW_RADIUS neighbours on the same page
+
+        Windows that overlap or touch are merged into one passage at the best hit's rank, so
+        no text reaches the prompt twice. Tables, images and chunks indexed before
+        small-to-big (no chunk_index) pass through unchanged.
+        """
+        radius = getattr(self.config, 'CHUNK_WINDOW_RADIUS', 1)
+        windows = defaultdict(list)  # (document, page) -> [start, end, ranks]
+
+        for rank, result in enumerate(results):
+            meta = result['metadata']
+            index = meta.get('chunk_index')
+            if meta.get('chunk_type', 'text') != 'text' or index is None:
+                continue
+            key = (meta.get('document_name'), meta.get('page_number'))
+            stored = self.chunk_store.get_page_indices(user_id, *key)
+            if index in stored:
+                windows[key].append([max(stored[0], index - radius), min(stored[-1], index + radius), [rank]])
+
+        expanded = {}
+        for (document_name, page_number), spans in windows.items():
+            spans.sort()
+            merged = [spans[0]]
+            for start, end, ranks in spans[1:]:
+                if start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                    merged[-1][2].extend(ranks)
+                else:
+                    merged.append([start, end, ranks])
+
+            for start, end, ranks in merged:
+                best = results[min(ranks)]
+                passage = self.chunk_store.get_passage(user_id, document_name, page_number, start, end)
+                if passage is None:
+                    continue
+                expanded[min(ranks)] = {**best, 'content': passage,
+                                        'metadata': {**best['metadata'], 'window': [start, end]}}
+                for rank in ranks:
+                    expanded.setdefault(rank, None)  # Merged into the best hit's passage
+
+        output, seen = [], set()
+        for rank, result in enumerate(results):
+            result = expanded.get(rank, result)
+            if result is None:
+                continue
+            key = (result['metadata'].get('document_name'), result['content'])
+            if key not in seen:
+                seen.add(key)
+                output.append(result)
+        return output
+
     def _rerank_results(self, results: Dict[str, Any], query: str, query_type: str) -> List[Dict[str, Any]]:
         """Re-rank results based on additional criteria"""
         ranked_results = []
         
-        for doc, meta, dist in zip(results['documents'], results['metadatas'], results['distances']):
+        raw_distances = results.get('raw_distances', results['distances'])
+        for chunk_id, doc, meta, dist, raw_dist in zip(self._result_ids(results), results['documents'],
+                                                       results['metadatas'], results['distances'], raw_distances):
             score = 1 - dist  # Convert distance to similarity score
             
             # Boost score based on content relevance
@@ -140,13 +535,45 @@ class SmartRetriever:
                 score *= 1.1
             
             ranked_results.append({
+                'id': chunk_id,
                 'content': doc,
                 'metadata': meta,
                 'score': score,
-                'distance': dist
+                'distance': dist,
+                'raw_distance': raw_dist
             })
         
         # Sort by score (descending)
         ranked_results.sort(key=lambda x: x['score'], reverse=True)
         
         return ranked_results
+
+
+def parse_page_references(query: str) -> List[int]:
+    """Page numbers a query refers to ("pages 3-5 and 9" -> [3, 4, 5, 9]), sorted; empty if none"""
+    pages = set()
+    position = 0
+    while True:
+        match = PAGE_REFERENCE_PATTERN.search(query, position)
+        if not match:
+            break
+        plural = match.group(1).lower() == 'pages'
+        previous = int(match.group(2))
+        pages.add(previous)
+        position = match.end()
+        while True:
+            more = PAGE_CONTINUATION_PATTERN.match(query, position)
+            if not more:
+                break
+            number = int(more.group(4))
+            if more.group(1):
+                low, high = sorted((previous, number))
+                pages.update(range(low, high + 1))
+            else:
+                if (not more.group(3) and not plural and FOLLOWED_BY_WORD.match(query, more.end())
+                        and not PAGE_CONTINUATION_PATTERN.match(query, more.end())):
+                    break
+                pages.add(number)
+            previous = number
+            position = more.end()
+    return sorted(pages)
@@ -0,0 +1,189 @@
+"""
+Semantic answer cache: reuse an answer for a near-duplicate question
+
+The exact query cache hashes the question string, so "what are ketones" and
+"What are ketones?" miss each other. This cache stores the embedding of each
+answered (condensed) question. Entries are partitioned by (user, document
+filter, corpus version), so an upload or delete never serves an answer built
+from an older document set. A lookup returns the nearest stored answer if its
+cosine similarity is at least SEMANTIC_CACHE_THRESHOLD.
+
+Embeddings alone confuse questions that differ only in a formula or number
+("what is H2SO4" vs "what is HNO3"). A near match is therefore also checked for
+content-term overlap. Matches that fail this check are counted as false hits and
+fall through to the full pipeline.
+
+In-process and bounded: at most SEMANTIC_CACHE_MAX_ENTRIES answers, evicted
+least-recently-used first.
+"""
+import copy
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, List
+
+import numpy as np
+
+from .lexical_index import tokenize
+
+
+class SemanticAnswerCache:
+    """Nearest-neighbour answer reuse with LRU eviction and hit/false-hit counters"""
+
+    def __init__(self, config, encode: Callable[[List[str]], np.ndarray]):
+        """
+        Args:
+            config: Config with SEMANTIC_CACHE_* settings
+            encode: Returns L2-normalised embeddings for a list of questions
+        """
+        self.enabled = getattr(config, 'SEMANTIC_CACHE_ENABLED', True)
+        self.threshold = getattr(config, 'SEMANTIC_CACHE_THRESHOLD', 0.92)
+        self.min_term_overlap = getattr(config, 'SEMANTIC_CACHE_MIN_TERM_OVERLAP', 0.5)
+        self.max_entries = getattr(config, 'SEMANTIC_CACHE_MAX_ENTRIES', 2048)
+        self.ttl = getattr(config, 'QUERY_CACHE_TTL', 3600)
+        self.encode = encode
+
+        # entry id -> (partition, question, terms, embedding, response, stored_at); order is LRU
+        self._entries: 'OrderedDict[int, tuple]' = OrderedDict()
+        # partition -> {'ids': [...], 'matrix': stacked embeddings or None (rebuilt lazily)}
+        self._partitions: Dict[tuple, Dict[str, Any]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'hits': 0, 'misses': 0, 'false_hits': 0, 'evictions': 0}
+
+    @staticmethod
+    def partition(user_id: Optional[str], document_filter: Any, corpus_version: int) -> tuple:
+        """Partition key: answers are only shared within one user's document set and corpus version"""
+        if isinstance(document_filter, (list, tuple, set)):
+            document_filter = tuple(sorted(document_filter))
+        return (user_id or '', document_filter, corpus_version)
+
+    def lookup(self, question: str, partition: tuple) -> Optional[Dict[str, Any]]:
+        """
+        Find a cached answer for a near-duplicate question
+
+        Returns:
+            A copy of the cached response with 'semantic_cache' match details, or None
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            self._stats['lookups'] += 1
+            self._expire(partition)
+            empty = partition not in self._partitions
+            if empty:
+                self._stats['misses'] += 1
+        if empty:
+            return None  # Nothing to compare against - don't pay for an embedding
+
+        embedding = self._embed(question)
+        terms = set(tokenize(question))
+        with self._lock:
+            bucket = self._partitions.get(partition)
+            if not bucket:
+                self._stats['misses'] += 1
+                return None
+
+            if bucket['matrix'] is None:
+                bucket['matrix'] = np.stack([self._entries[i][3] for i in bucket['ids']])
+            similarities = bucket['matrix'] @ embedding
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self._stats['misses'] += 1
+                return None
+
+            entry_id = bucket['ids'][best]
+            _, cached_question, cached_terms, _, response, _ = self._entries[entry_id]
+            if not self._terms_agree(terms, cached_terms):
+                self._stats['false_hits'] += 1
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(entry_id)
+            self._stats['hits'] += 1
+            result = copy.deepcopy(response)
+
+        result['semantic_cache'] = {'similarity': round(similarity, 4), 'matched_question': cached_question}
+        return result
+
+    def store(self, question: str, partition: tuple, response: Dict[str, Any]):
+        """Remember an answered question (replaces an identical question in the same partition)"""
+        if not self.enabled:
+            return
+
+        embedding = self._embed(question)
+        entry = (partition, question, set(tokenize(question)), embedding, copy.deepcopy(response), time.time())
+        with self._lock:
+            for entry_id in list(self._partitions.get(partition, {}).get('ids', ())):
+                if self._entries[entry_id][1] == question:
+                    self._remove(entry_id)
+
+            bucket = self._partitions.setdefault(partition, {'ids': [], 'matrix': None})
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            bucket['ids'].append(entry_id)
+            bucket['matrix'] = None
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def delete_user(self, user_id: str):
+        """Drop every answer cached for a user"""
+        with self._lock:
+            for partition in [p for p in self._partitions if p[0] == (user_id or '')]:
+                for entry_id in list(self._partitions[partition]['ids']):
+                    self._remove(entry_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._partitions.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['partitions'] = len(self._partitions)
+        stats['hit_rate'] = round(stats['hits'] / stats['lookups'], 4) if stats['lookups'] else 0.0
+        near_matches = stats['hits'] + stats['false_hits']
+        stats['false_hit_rate'] = round(stats['false_hits'] / near_matches, 4) if near_matches else 0.0
+        stats['threshold'] = self.threshold
+        stats['max_entries'] = self.max_entries
+        return stats
+
+    # ========== Internals ==========
+
+    def _embed(self, question: str) -> np.ndarray:
+        # Same string as the retriever's search query, so the store's query-embedding cache is shared
+        return np.asarray(self.encode([question]), dtype=np.float32).reshape(-1)
+
+    def _terms_agree(self, terms: set, cached_terms: set) -> bool:
+        """Content-term Jaccard overlap; catches near-identical questions about different entities"""
+        if not terms and not cached_terms:
+            return True
+        # Formulas, numbers and section IDs must match exactly ("page 4" is not "page 5")
+        if any(any(ch.isdigit() for ch in term) for term in terms ^ cached_terms):
+            return False
+        return len(terms & cached_terms) / len(terms | cached_terms) >= self.min_term_overlap
+
+    def _expire(self, partition: tuple):
+        """Drop a partition's entries older than QUERY_CACHE_TTL (caller holds the lock)"""
+        bucket = self._partitions.get(partition)
+        if not bucket:
+            return
+        cutoff = time.time() - self.ttl
+        for entry_id in [i for i in bucket['ids'] if self._entries[i][5] < cutoff]:
+            self._remove(entry_id)
+
+    def _remove(self, entry_id: int):
+        """Caller holds the lock"""
+        partition = self._entries.pop(entry_id)[0]
+        bucket = self._partitions[partition]
+        bucket['ids'].remove(entry_id)
+        bucket['matrix'] = None
+        if not bucket['ids']:
+            del self._partitions[partition]
@@ -1,13 +1,14 @@
 # src/simple_vector_store.py
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
 import logging
 import pickle
 import os
+from .vector_store import empty_results, matches_filters
 
 class SimpleVectorStore:
-    """Simple in-memory vector store that works reliably with Streamlit"""
-    
+    """Simple in-memory vector store that works reliably with Streamlit (implements VectorStore)"""
+
     def __init__(self, config):
         self.config = config
         self.logger = logging.getLogger(__name__)
@@ -16,9 +17,9 @@ class SimpleVectorStore:
         self.metadatas = []
         self.ids = []
         self.dim = 384
-        
+
         self.logger.info("✅ Simple vector store initialized")
-    
+
     def _generate_embedding(self, text: str) -> List[float]:
         """Generate simple hash-based embedding"""
         vec = [0.01] * self.dim
@@ -33,71 +34,184 @@ class SimpleVectorStore:
             if norm > 0:
                 vec = [v / norm for v in vec]
         return vec
-    
-    def add_documents(self, chunks: List, document_name: str):
+
+    def add_documents(self, chunks: List, document_name: str, user_id: str = None):
         """Add document chunks to vector store"""
         try:
             self.logger.info(f"Processing {len(chunks)} chunks for {document_name}")
-            
+
             for i, chunk in enumerate(chunks):
-                doc_id = f"{document_name}_{i}"
-                
+                doc_id = f"{user_id}_{document_name}_{i}" if user_id else f"{document_name}_{i}"
+
                 # Generate embedding
                 embedding = self._generate_embedding(chunk.content)
-                
+
                 # Store
-                self.documents.append(chunk.content)
-                self.embeddings.append(embedding)
-                self.metadatas.append({
+                metadata = {
                     'document_name': document_name,
                     'chunk_type': getattr(chunk, 'chunk_type', 'text'),
                     'page_number': getattr(chunk, 'page_number', 1)
-                })
+                }
+                chunk_index = (getattr(chunk, 'metadata', None) or {}).get('chunk_index')
+                if chunk_index is not None:
+                    metadata['chunk_index'] = int(chunk_index)  # Small-to-big window lookups
+                if user_id:
+                    metadata['user_id'] = user_id
+                self.documents.append(chunk.content)
+                self.embeddings.append(embedding)
+                self.metadatas.append(metadata)
                 self.ids.append(doc_id)
-            
+
             self.logger.info(f"✅ Added {len(chunks)} chunks from {document_name}")
             return {'success': True, 'count': len(chunks)}
-            
+
         except Exception as e:
             self.logger.error(f"Failed to add documents: {e}")
             return {'success': False, 'error': str(e)}
-    
-    def search(self, query: str, n_results: int = 5) -> Dict[str, Any]:
+
+    def _matches(self, metadata: Dict[str, Any], document_filter: str = None, user_id: str = None,
+                 filters: Dict[str, Any] = None) -> bool:
+        if user_id and metadata.get('user_id') != user_id:
+            return False
+        if document_filter and metadata.get('document_name') != document_filter:
+            return False
+        return matches_filters(metadata, filters)
+
+    def search(self, query: str, n_results: int = 5, document_filter: str = None, user_id: str = None,
+               filters: Dict[str, Any] = None) -> Dict[str, Any]:
         """Search for relevant documents using cosine similarity"""
+        return self.search_many([query], n_results, document_filter, user_id, filters)[0]
+
+    def search_many(self, queries: List[str], n_results: int = 5, document_filter: str = None,
+                    user_id: str = None, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Search several queries against the same filtered candidate set"""
         try:
-            if not self.documents:
-                return {'documents': [], 'metadatas': [], 'distances': []}
-            
-            # Generate query embedding
-            query_embedding = self._generate_embedding(query)
-            
-            # Calculate cosine similarities
-            similarities = []
-            for emb in self.embeddings:
-                # Cosine similarity
-                dot_product = sum(a * b for a, b in zip(query_embedding, emb))
-                similarities.append(dot_product)
-            
-            # Get top k results
-            top_indices = sorted(range(len(similarities)), 
-                               key=lambda i: similarities[i], 
-                               reverse=True)[:n_results]
-            
-            results = {
-                'documents': [self.documents[i] for i in top_indices],
-                'metadatas': [self.metadatas[i] for i in top_indices],
-                'distances': [1.0 - similarities[i] for i in top_indices]  # Convert similarity to distance
-            }
-            
+            candidates = [i for i, meta in enumerate(self.metadatas)
+                          if self._matches(meta, document_filter, user_id, filters)]
+            if not candidates:
+                return [empty_results() for _ in queries]
+
+            matrix = np.asarray([self.embeddings[i] for i in candidates])
+            query_matrix = np.asarray([self._generate_embedding(q) for q in queries])
+
+            # Cosine similarity (vectors are already normalized)
+            similarities = query_matrix @ matrix.T
+
+            results = []
+            for row in similarities:
+                top = np.argsort(-row)[:n_results]
+                indices = [candidates[j] for j in top]
+                results.append({
+                    'ids': [[self.ids[i] for i in indices]],
+                    'documents': [[self.documents[i] for i in indices]],
+                    'metadatas': [[self.metadatas[i] for i in indices]],
+                    'distances': [[1.0 - float(row[j]) for j in top]]  # Convert similarity to distance
+                })
             return results
-            
+
         except Exception as e:
             self.logger.error(f"Search failed: {e}")
-            return {'documents': [], 'metadatas': [], 'distances': []}
-    
+            return [empty_results() for _ in queries]
+
+    def _delete_where(self, predicate) -> int:
+        keep = [i for i, meta in enumerate(self.metadatas) if not predicate(meta)]
+        deleted = len(self.metadatas) - len(keep)
+        self.documents = [self.documents[i] for i in keep]
+        self.embeddings = [self.embeddings[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self.ids = [self.ids[i] for i in keep]
+        return deleted
+
+    def delete_document(self, document_name: str, user_id: str = None) -> Dict[str, Any]:
+        """Delete all chunks from a specific document"""
+        deleted = self._delete_where(lambda meta: self._matches(meta, document_name, user_id))
+        if not deleted:
+            return {'success': False, 'message': 'Document not found'}
+        return {'success': True, 'deleted_count': deleted}
+
+    def delete_user_vectors(self, user_id: str, batch_size: int = None,
+                            progress_callback: Callable[[int], None] = None) -> Dict[str, Any]:
+        """Delete every chunk owned by a user"""
+        if not user_id:
+            return {'success': False, 'error': 'user_id is required'}
+        deleted = self._delete_where(lambda meta: meta.get('user_id') == user_id)
+        if progress_callback:
+            progress_callback(deleted)
+        return {'success': True, 'deleted_count': deleted}
+
+    def document_has_other_owners(self, document_name: str, user_id: str) -> bool:
+        """Check whether any other user still has chunks for a document name"""
+        return any(meta.get('document_name') == document_name and meta.get('user_id') != user_id
+                   for meta in self.metadatas)
+
+    def get_document_owners(self) -> Dict[str, List[Optional[str]]]:
+        """Document name -> user IDs holding chunks for it"""
+        owners: Dict[str, set] = {}
+        for meta in self.metadatas:
+            owners.setdefault(meta.get('document_name', 'unknown'), set()).add(meta.get('user_id'))
+        return {name: list(users) for name, users in owners.items()}
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Normalised query embeddings"""
+        matrix = np.array([self._generate_embedding(q) for q in queries], dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms > 0, norms, 1)
+
+    def get_embeddings(self, ids: List[str]) -> np.ndarray:
+        """Stored embeddings for chunk IDs, aligned with ids (zero rows for unknown IDs)"""
+        rows = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        matrix = np.zeros((len(ids), self.dim), dtype=np.float32)
+        for row, chunk_id in enumerate(ids):
+            if chunk_id in rows:
+                matrix[row] = self.embeddings[rows[chunk_id]]
+        return matrix
+
+    def get_chunks(self, ids: List[str]) -> Dict[str, List]:
+        """Text and metadata for chunk IDs, aligned with ids (None for unknown IDs)"""
+        rows = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        found = [rows.get(chunk_id) for chunk_id in ids]
+        return {
+            'documents': [self.documents[i] if i is not None else None for i in found],
+            'metadatas': [dict(self.metadatas[i]) if i is not None else None for i in found]
+        }
+
+    def get_user_chunks(self, user_id: str) -> Dict[str, List]:
+        """All of a user's chunks (text and metadata only)"""
+        rows = [i for i, meta in enumerate(self.metadatas) if meta.get('user_id') == user_id]
+        return {
+            'ids': [self.ids[i] for i in rows],
+            'documents': [self.documents[i] for i in rows],
+            'metadatas': [dict(self.metadatas[i]) for i in rows]
+        }
+
+    def clear_all(self) -> Dict[str, Any]:
+        """Clear all documents"""
+        count = len(self.documents)
+        self.documents, self.embeddings, self.metadatas, self.ids = [], [], [], []
+        return {'success': True, 'deleted_count': count}
+
+    def list_documents(self, user_id: str = None) -> List[Dict[str, Any]]:
+        """List all documents with their statistics, optionally filtered by user"""
+        doc_stats = {}
+        for meta in self.metadatas:
+            if not self._matches(meta, user_id=user_id):
+                continue
+            doc_name = meta.get('document_name', 'unknown')
+            stats = doc_stats.setdefault(doc_name, {
+                'name': doc_name,
+                'total_chunks': 0,
+                'text_chunks': 0,
+                'table_chunks': 0,
+                'image_chunks': 0
+            })
+            stats['total_chunks'] += 1
+            stats[f"{meta.get('chunk_type', 'text')}_chunks"] += 1
+        return list(doc_stats.values())
+
     def get_collection_stats(self) -> Dict[str, Any]:
         """Get collection statistics"""
         return {
-            'total_documents': len(self.documents),
+            'total_chunks': len(self.documents),
+            'total_documents': len({m.get('document_name') for m in self.metadatas}),
             'embedding_model': 'Simple Hash Embedder'
         }
@@ -0,0 +1,220 @@
+"""
+Single-flight coalescing of identical concurrent queries
+
+The answer cache is only written once an answer is finished. Until then,
+every identical request misses the cache and runs the whole
+embed-search-LLM pipeline again. Here the first request for a key becomes
+the leader and computes the answer; the others wait for it.
+
+The key is the answer-cache key, which includes the user ID (answers depend
+on the user's own corpus and conversation). So what coalesces is one user
+repeating a question while the first copy is still running: a
+double-submitted form, a retry after a client timeout, or several open tabs.
+Different users asking the same question of a shared document still compute
+separately.
+
+- In-process: followers wait on the leader's event and get a copy of its
+  result. threading.Event is gevent-aware once the worker is monkey-patched,
+  so this works across greenlets as well as threads.
+- Across workers: the leader also holds a Redis lock ("lock:flight:{key}",
+  SET NX EX). A worker that finds the lock taken polls until it is released,
+  then reads the answer from the query cache. Only one request per worker
+  polls; the rest of that worker's requests wait on it in-process.
+
+Followers give up after SINGLE_FLIGHT_TIMEOUT seconds and compute the answer
+themselves. The Redis lock expires after the same time, so a crashed leader
+cannot block anyone for longer.
+"""
+import copy
+import time
+import logging
+import threading
+from typing import Callable, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """One in-flight computation in this process"""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+class Flight:
+    """
+    One request's part in a single-flight group
+
+    Roles:
+        leader: computes the answer and must call finish()
+        local_follower: waits for the leader in this process
+        remote_follower: waits for a leader in another worker (other requests here wait on it)
+        solo: computes without sharing (coalescing disabled, or a follower gave up)
+    """
+
+    def __init__(self, group: 'SingleFlight', key: str, call: Optional[_Call], role: str,
+                 lock_token: Optional[str] = None):
+        self.group = group
+        self.key = key
+        self.call = call
+        self.role = role
+        self.lock_token = lock_token
+
+    @property
+    def leader(self) -> bool:
+        return self.role in ('leader', 'solo')
+
+    def wait(self, fetch_shared: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """
+        Wait for the leader's answer
+
+        Args:
+            fetch_shared: Reads the answer another worker stored (the query cache lookup)
+
+        Returns:
+            The shared answer, or None if this request has to compute it (and is now the leader or solo)
+
+        Raises:
+            The leader's exception, if the in-process leader failed
+        """
+        if self.role == 'local_follower':
+            if not self.call.done.wait(self.group.timeout):
+                self.group._count('timeouts')
+                self.role = 'solo'
+                return None
+            if self.call.error is not None:
+                raise self.call.error
+            if self.call.result is None:
+                self.role = 'solo'
+                return None
+            self.group._count('coalesced')
+            return copy.deepcopy(self.call.result)
+
+        if self.role == 'remote_follower':
+            shared = self._wait_remote(fetch_shared)
+            if shared is not None:
+                self.group._count('coalesced')
+                self.finish(shared)
+                return shared
+            # The other worker stored nothing usable (or is stuck): compute here, still leading locally
+            self.lock_token = self.group.cache.acquire_lock(self.group.lock_name(self.key), self.group.lock_ttl)
+            self.role = 'leader'
+        return None
+
+    def finish(self, result: Optional[Dict[str, Any]] = None, error: Optional[BaseException] = None):
+        """
+        Publish the answer and release the key; idempotent
+
+        With no result, or a failed one (result['error'] set, e.g. every LLM
+        provider down), followers compute their own answers.
+        """
+        if self.role not in ('leader', 'remote_follower') or self.call is None:
+            return
+        if result is not None and result.get('error'):
+            result = None
+        self.call.result = copy.deepcopy(result) if result is not None else None
+        self.call.error = error
+        self.group._release(self.key, self.call)
+        self.call.done.set()
+        if self.lock_token:
+            self.group.cache.release_lock(self.group.lock_name(self.key), self.lock_token)
+        self.role = 'finished'
+
+    def _wait_remote(self, fetch_shared: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        deadline = time.monotonic() + self.group.timeout
+        lock_name = self.group.lock_name(self.key)
+        while time.monotonic() < deadline:
+            time.sleep(self.group.poll_interval)
+            if not self.group.cache.is_locked(lock_name):
+                return fetch_shared()
+        self.group._count('timeouts')
+        return None
+
+
+class SingleFlight:
+    """Coalesces identical concurrent computations within a process and across workers"""
+
+    def __init__(self, config, cache):
+        """
+        Args:
+            config: Config with SINGLE_FLIGHT_* settings
+            cache: RedisCacheManager providing the cross-worker lock
+        """
+        self.enabled = getattr(config, 'SINGLE_FLIGHT_ENABLED', True)
+        self.timeout = getattr(config, 'SINGLE_FLIGHT_TIMEOUT', 60.0)
+        self.poll_interval = getattr(config, 'SINGLE_FLIGHT_POLL_INTERVAL', 0.25)
+        self.lock_ttl = max(1, int(self.timeout))
+        self.cache = cache
+
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'local_followers': 0, 'remote_followers': 0, 'coalesced': 0, 'timeouts': 0}
+
+    @staticmethod
+    def lock_name(key: str) -> str:
+        return f"flight:{key}"
+
+    def begin(self, key: str) -> Flight:
+        """
+        Join the flight for a key
+
+        A leader (flight.leader) computes and must call flight.finish(); anyone
+        else calls flight.wait() first and computes only if it returns None.
+        """
+        if not self.enabled:
+            return Flight(self, key, None, 'solo')
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats['local_followers'] += 1
+                return Flight(self, key, call, 'local_follower')
+            call = _Call()
+            self._calls[key] = call
+
+        token = self.cache.acquire_lock(self.lock_name(key), self.lock_ttl)
+        role = 'leader' if token else 'remote_follower'
+        self._count('leaders' if token else 'remote_followers')
+        return Flight(self, key, call, role, lock_token=token)
+
+    def run(self, key: str, compute: Callable[[], Dict[str, Any]],
+            fetch_shared: Callable[[], Optional[Dict[str, Any]]]) -> Tuple[Dict[str, Any], bool]:
+        """
+        Compute once per key across concurrent callers
+
+        Returns:
+            (result, shared) - shared is True if another request computed it
+        """
+        flight = self.begin(key)
+        if not flight.leader:
+            shared = flight.wait(fetch_shared)
+            if shared is not None:
+                return shared, True
+
+        try:
+            result = compute()
+        except Exception as e:
+            flight.finish(error=e)
+            raise
+        flight.finish(result)
+        return result, False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        stats['enabled'] = self.enabled
+        return stats
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _release(self, key: str, call: _Call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
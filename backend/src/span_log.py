@@ -0,0 +1,109 @@
+"""
+Append-only log of per-request stage spans for offline latency analysis
+
+Every answered query produces one JSON line: the stage totals (what the
+response's 'timings' shows), the individual spans with their start offsets,
+and request facts useful for slicing (query type, cache/coalesce flags,
+provider and model). Question text and user IDs are not written; the user
+is a short hash, so one account's requests can still be grouped.
+
+Lines go through a queue to a writer thread, so requests never wait on disk.
+Each worker writes its own file, rotated daily:
+SPAN_LOG_PATH/spans-YYYYMMDD-{pid}.jsonl. SPAN_LOG_SAMPLE_RATE keeps a
+fraction of requests on busy deployments. When the queue is full, records
+are dropped (and counted) rather than slowing requests down.
+"""
+import os
+import json
+import time
+import queue
+import random
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SpanLog:
+    """Background JSONL writer for request spans"""
+
+    MAX_QUEUED = 10000
+
+    def __init__(self, config):
+        self.enabled = getattr(config, 'SPAN_LOG_ENABLED', True)
+        self.log_dir = getattr(config, 'SPAN_LOG_PATH', './data/spans')
+        self.sample_rate = getattr(config, 'SPAN_LOG_SAMPLE_RATE', 1.0)
+
+        self._queue: 'queue.Queue[Dict[str, Any]]' = queue.Queue(maxsize=self.MAX_QUEUED)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.stats = {'written': 0, 'dropped': 0, 'sampled_out': 0}
+
+    def record(self, kind: str, timings, user_id: Optional[str] = None, **fields):
+        """
+        Queue one request's spans
+
+        Args:
+            kind: Request kind ('query', 'query_stream')
+            timings: The request's StageTimings
+            user_id: Hashed before writing
+            **fields: JSON-serialisable request facts (query_type, cached, provider, ...)
+        """
+        if not self.enabled:
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.stats['sampled_out'] += 1
+            return
+
+        entry = {
+            'ts': round(time.time(), 3),
+            'kind': kind,
+            'user': hashlib.sha256((user_id or '').encode('utf-8')).hexdigest()[:12],
+            **fields,
+            'timings': timings.as_dict(),
+            'spans': list(timings.spans)
+        }
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.stats['dropped'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'queued': self._queue.qsize(), 'enabled': self.enabled,
+                'sample_rate': self.sample_rate, 'path': self.log_dir}
+
+    # ========== Writer ==========
+
+    def _ensure_writer(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._thread = threading.Thread(target=self._write_loop, name='span-log', daemon=True)
+            self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # Drain what's already waiting so a burst is one open/write
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            day = time.strftime('%Y%m%d', time.gmtime())
+            path = os.path.join(self.log_dir, f"spans-{day}-{os.getpid()}.jsonl")
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    for entry in batch:
+                        f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+                self.stats['written'] += len(batch)
+            except Exception as e:
+                self.stats['dropped'] += len(batch)
+                logger.warning(f"Span log write failed ({len(batch)} records dropped): {e}")
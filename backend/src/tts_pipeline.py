@@ -0,0 +1,190 @@
+"""
+Sentence-pipelined TTS: speak an answer while the LLM is still writing it
+
+Streamed LLM text is cut at sentence boundaries: the Devanagari danda (।, ॥),
+"!" and "?", or "." followed by whitespace (so "3.14" and "e.g." don't split).
+Each finished sentence goes to MultilingualTTSHandler straight away on a small
+worker pool. The encoded segments come back in sentence order, so the first
+sentence can play while later ones are being generated and synthesized.
+
+- Sentences shorter than TTS_SENTENCE_MIN_CHARS are merged with the next one
+  (very short clips sound choppy and cost a TTS round trip each)
+- Text that runs past TTS_SENTENCE_MAX_CHARS without a boundary is cut at the
+  last comma or space, so a long list doesn't hold back the audio
+- With language='auto' the language is detected once, on the first sentence,
+  so every segment uses the same voice
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Sentence end: danda / double danda / ! / ? anywhere, "." only when followed by whitespace
+BOUNDARY_PATTERN = re.compile(r"[।॥!?]+[\"')\]]*\s*|\.+[\"')\]]*\s+|\n\s*\n")
+# Words before "." that don't end a sentence
+ABBREVIATIONS = frozenset("e.g i.e etc vs dr mr mrs ms prof fig eq no approx ca st".split())
+SOFT_BREAK_PATTERN = re.compile(r"[,;:।]\s|\s")
+
+AUDIO_MIME_TYPES = {'.mp3': 'audio/mpeg', '.wav': 'audio/wav'}
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor(max_workers: int) -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tts-sentence')
+    return _executor
+
+
+class SentenceSplitter:
+    """Incremental sentence splitter for streamed text"""
+
+    def __init__(self, min_chars: int = 24, max_chars: int = 250):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ''
+        self._pending = ''  # Complete but too-short sentences waiting to be merged
+
+    def feed(self, text: str) -> List[str]:
+        """Add streamed text; returns the sentences it completed"""
+        self._buffer += text
+        sentences = []
+        position = 0
+        for match in BOUNDARY_PATTERN.finditer(self._buffer):
+            if match.group().startswith('.') and self._is_abbreviation(self._buffer[position:match.start()]):
+                continue
+            sentences.extend(self._emit(self._buffer[position:match.end()]))
+            position = match.end()
+        self._buffer = self._buffer[position:]
+
+        while len(self._buffer) > self.max_chars:
+            breaks = [m.end() for m in SOFT_BREAK_PATTERN.finditer(self._buffer, 0, self.max_chars)]
+            cut = breaks[-1] if breaks else self.max_chars
+            sentences.extend(self._emit(self._buffer[:cut], force=True))
+            self._buffer = self._buffer[cut:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        """End of stream: whatever is left is the last sentence"""
+        remainder = (self._pending + ' ' + self._buffer).strip()
+        self._pending = self._buffer = ''
+        return [remainder] if remainder else []
+
+    def _emit(self, sentence: str, force: bool = False) -> List[str]:
+        text = f"{self._pending} {sentence.strip()}".strip() if self._pending else sentence.strip()
+        if not text:
+            return []
+        if len(text) < self.min_chars and not force:
+            self._pending = text
+            return []
+        self._pending = ''
+        return [text]
+
+    @staticmethod
+    def _is_abbreviation(sentence: str) -> bool:
+        words = sentence.split()
+        if not words:
+            return False
+        last = words[-1].lower().strip('(')
+        return last in ABBREVIATIONS or (len(last) == 1 and last.isalpha())
+
+
+class SentenceTTSPipeline:
+    """
+    Feed streamed text in, get encoded audio segments out in sentence order
+
+    Usage:
+        pipeline = SentenceTTSPipeline(tts_handler, language='auto')
+        for token in tokens:
+            pipeline.feed(token)
+            for segment in pipeline.ready():   # non-blocking
+                send(segment)
+        pipeline.close()
+        for segment in pipeline.drain():       # waits for the rest
+            send(segment)
+
+    Each segment is a dict with 'seq', 'text', 'audio' (bytes), 'mime',
+    'engine' and 'latency_ms' (submit to done). A sentence whose synthesis
+    fails is skipped.
+    """
+
+    def __init__(self, tts_handler, language: str = 'auto', config=None):
+        self.tts_handler = tts_handler
+        self.language = language
+        self.splitter = SentenceSplitter(
+            min_chars=getattr(config, 'TTS_SENTENCE_MIN_CHARS', 24),
+            max_chars=getattr(config, 'TTS_SENTENCE_MAX_CHARS', 250)
+        )
+        self.executor = _get_executor(getattr(config, 'TTS_PIPELINE_WORKERS', 2))
+
+        self._queue: 'deque[Future]' = deque()
+        self._seq = 0
+        self._stream_id = f"{time.time_ns():x}"
+
+    def feed(self, text: str):
+        for sentence in self.splitter.feed(text):
+            self._submit(sentence)
+
+    def close(self):
+        for sentence in self.splitter.flush():
+            self._submit(sentence)
+
+    def ready(self) -> Iterator[Dict[str, Any]]:
+        """Segments that are done, in order, without waiting"""
+        while self._queue and self._queue[0].done():
+            segment = self._queue.popleft().result()
+            if segment:
+                yield segment
+
+    def drain(self) -> Iterator[Dict[str, Any]]:
+        """All remaining segments, in order, waiting for each"""
+        while self._queue:
+            segment = self._queue.popleft().result()
+            if segment:
+                yield segment
+
+    def cancel(self):
+        """Client went away: drop sentences that haven't started"""
+        while self._queue:
+            self._queue.popleft().cancel()
+
+    def _submit(self, sentence: str):
+        if not re.search(r"\w", sentence):
+            return  # Punctuation only
+        if self.language == 'auto':
+            self.language = self.tts_handler.detect_language(sentence)
+        self._queue.append(self.executor.submit(self._synthesize, self._seq, sentence, self.language,
+                                                time.perf_counter()))
+        self._seq += 1
+
+    def _synthesize(self, seq: int, sentence: str, language: str, submitted: float) -> Optional[Dict[str, Any]]:
+        name = f"sentence_{self._stream_id}_{seq}_{hashlib.md5(sentence.encode()).hexdigest()[:8]}"
+        try:
+            result = self.tts_handler.synthesize(sentence, language=language, output_filename=name)
+            audio_path = result['audio_path']
+            with open(audio_path, 'rb') as f:
+                audio = f.read()
+            # Segments are delivered inline; don't leave per-sentence files behind
+            try:
+                os.remove(audio_path)
+            except OSError:
+                pass
+        except Exception as e:
+            logger.error(f"Sentence TTS failed (segment {seq}): {e}")
+            return None
+
+        return {
+            'seq': seq,
+            'text': sentence,
+            'audio': audio,
+            'mime': AUDIO_MIME_TYPES.get(os.path.splitext(audio_path)[1].lower(), 'application/octet-stream'),
+            'engine': result.get('engine', 'unknown'),
+            'latency_ms': round((time.perf_counter() - submitted) * 1000, 2)
+        }
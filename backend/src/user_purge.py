@@ -0,0 +1,253 @@
+"""
+Background purge of all data owned by a user (GDPR account deletion)
+
+Removes, in batches:
+1. Vector store chunks (IDs only, never full payloads), the BM25 index and chunk windows
+2. Uploaded PDFs that no other user still references
+3. Auto-generated audio files
+4. Redis cache keys (conversation, rate limits, tracked query results) and semantic cache entries
+
+Each job reports per-stage progress and throughput so admins can watch
+large accounts drain without blocking the request that triggered it.
+Progress is written to Redis after every batch, so any gunicorn worker can
+answer a status request and finished jobs survive restarts. Without Redis,
+only the worker running a job knows about it. A job whose worker died keeps
+its last 'running' snapshot; 'updated_at' shows when it stopped moving.
+"""
+import os
+import glob
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class UserDataPurger:
+    """Runs account purge jobs on a small background thread pool"""
+
+    STAGES = ('vectors', 'pdfs', 'audio', 'cache')
+
+    # Files and cache keys removed per batch
+    BATCH_SIZE = 100
+
+    # Finished jobs kept in memory (and listed from Redis) for status lookups
+    MAX_FINISHED_JOBS = 200
+
+    # Seconds a job record stays in Redis after its last update
+    JOB_TTL_S = 7 * 86400
+
+    def __init__(self, rag_system, upload_folder: str, audio_folder: str, max_workers: int = 1):
+        """
+        Initialize the purger
+
+        Args:
+            rag_system: RAGSystem instance (provides vector_store and cache)
+            upload_folder: Directory holding uploaded PDFs
+            audio_folder: Directory holding generated audio
+            max_workers: Concurrent purge jobs (1 keeps disk and Chroma load low)
+        """
+        self.rag_system = rag_system
+        self.upload_folder = upload_folder
+        self.audio_folder = audio_folder
+        self.cache = getattr(rag_system, 'cache', None)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='purge-worker')
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def start(self, user_id: str) -> str:
+        """
+        Queue a purge job for a user
+
+        Args:
+            user_id: User whose data should be removed
+
+        Returns:
+            Job ID for status lookups
+        """
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            'job_id': job_id,
+            'user_id': user_id,
+            'status': 'queued',
+            'created_at': time.time(),
+            'updated_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'stages': {
+                stage: {'status': 'pending', 'deleted': 0, 'total': None,
+                        'elapsed_s': 0.0, 'items_per_s': 0.0}
+                for stage in self.STAGES
+            },
+            'errors': []
+        }
+
+        with self._lock:
+            self._prune_finished_jobs()
+            self._jobs[job_id] = job
+
+        self._persist(job_id, new=True)
+        self.executor.submit(self._run, job_id)
+        logger.info(f"🧹 Queued purge job {job_id} for user {user_id}")
+        return job_id
+
+    def get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a snapshot of a job's progress (from Redis if another worker runs it)"""
+        snapshot = self._snapshot(job_id)
+        if snapshot:
+            return snapshot
+        if self.cache:
+            stored = self.cache.get_purge_jobs([job_id])
+            if stored:
+                return stored[0]
+        return None
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """Get snapshots of all known jobs across workers, newest first"""
+        jobs = {job['job_id']: job for job in (self.cache.get_purge_jobs() if self.cache else [])}
+        with self._lock:
+            local_ids = list(self._jobs)
+        for job_id in local_ids:
+            snapshot = self._snapshot(job_id)
+            if snapshot:
+                jobs[job_id] = snapshot
+        return sorted(jobs.values(), key=lambda job: job['created_at'], reverse=True)
+
+    # ========== Job Execution ==========
+
+    def _run(self, job_id: str):
+        job = self._jobs[job_id]
+        user_id = job['user_id']
+        self._update(job_id, status='running', started_at=time.time())
+
+        stage_funcs = {
+            'vectors': lambda: self._purge_vectors(job_id, user_id),
+            'pdfs': lambda: self._purge_pdfs(job_id, user_id),
+            'audio': lambda: self._purge_audio(job_id, user_id),
+            'cache': lambda: self._purge_cache(job_id, user_id),
+        }
+
+        for stage in self.STAGES:
+            started = time.time()
+            self._update_stage(job_id, stage, status='running')
+            try:
+                stage_funcs[stage]()
+                status = 'done'
+            except Exception as e:
+                self._record_error(job_id, stage, e)
+                status = 'failed'
+            self._finish_stage(job_id, stage, status, time.time() - started)
+
+        failed = any(s['status'] == 'failed' for s in self._jobs[job_id]['stages'].values())
+        self._update(job_id, status='failed' if failed else 'done', finished_at=time.time())
+
+        summary = ', '.join(
+            f"{name}={stage['deleted']} ({stage['items_per_s']:.0f}/s)"
+            for name, stage in self._jobs[job_id]['stages'].items()
+        )
+        logger.info(f"🧹 Purge job {job_id} for user {user_id} finished: {summary}")
+
+    def _purge_vectors(self, job_id: str, user_id: str):
+        result = self.rag_system.vector_store.delete_user_vectors(
+            user_id,
+            progress_callback=lambda deleted: self._update_stage(job_id, 'vectors', deleted=deleted)
+        )
+        if not result.get('success'):
+            raise RuntimeError(result.get('error', 'vector purge failed'))
+        self.rag_system.lexical_index.delete_user(user_id)
+        self.rag_system.chunk_store.delete_user(user_id)
+        self.rag_system.image_manifests.delete_user(user_id)
+        self._update_stage(job_id, 'vectors', total=result['deleted_count'])
+
+    def _purge_pdfs(self, job_id: str, user_id: str):
+        # Stored files are shared by content - only those no other user references come back
+        paths = self.rag_system.documents.remove_user(user_id, delete_files=False)
+        self._delete_files(job_id, 'pdfs', paths)
+
+    def _purge_audio(self, job_id: str, user_id: str):
+        paths = []
+        for audio_id in self.rag_system.cache.get_user_audio_ids(user_id):
+            paths.extend(glob.glob(os.path.join(self.audio_folder, f"auto_{audio_id}.*")))
+
+        self._delete_files(job_id, 'audio', paths)
+
+    def _purge_cache(self, job_id: str, user_id: str):
+        self.rag_system.semantic_cache.delete_user(user_id)
+        keys = self.rag_system.cache.get_user_keys(user_id)
+        self._update_stage(job_id, 'cache', total=len(keys))
+
+        deleted = 0
+        for i in range(0, len(keys), self.BATCH_SIZE):
+            deleted += self.rag_system.cache.delete_keys(keys[i:i + self.BATCH_SIZE])
+            self._update_stage(job_id, 'cache', deleted=deleted)
+
+    def _delete_files(self, job_id: str, stage: str, paths: List[str]):
+        self._update_stage(job_id, stage, total=len(paths))
+
+        deleted = 0
+        for i in range(0, len(paths), self.BATCH_SIZE):
+            for path in paths[i:i + self.BATCH_SIZE]:
+                try:
+                    os.remove(path)
+                    deleted += 1
+                except FileNotFoundError:
+                    continue
+                except Exception as e:
+                    logger.warning(f"Failed to delete {path}: {e}")
+            self._update_stage(job_id, stage, deleted=deleted)
+
+    # ========== Progress Bookkeeping ==========
+
+    def _snapshot(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            snapshot = dict(job)
+            snapshot['stages'] = {name: dict(stage) for name, stage in job['stages'].items()}
+            snapshot['errors'] = list(job['errors'])
+            return snapshot
+
+    def _persist(self, job_id: str, new: bool = False):
+        """Publish the job to Redis (only new jobs are added to the listing index)"""
+        with self._lock:
+            self._jobs[job_id]['updated_at'] = time.time()
+        if not self.cache:
+            return
+        self.cache.save_purge_job(self._snapshot(job_id), ttl=self.JOB_TTL_S,
+                                  index_size=self.MAX_FINISHED_JOBS if new else 0)
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+        self._persist(job_id)
+
+    def _update_stage(self, job_id: str, stage: str, **fields):
+        with self._lock:
+            self._jobs[job_id]['stages'][stage].update(fields)
+        self._persist(job_id)
+
+    def _finish_stage(self, job_id: str, stage: str, status: str, elapsed: float):
+        with self._lock:
+            stage_info = self._jobs[job_id]['stages'][stage]
+            stage_info['status'] = status
+            stage_info['elapsed_s'] = round(elapsed, 3)
+            stage_info['items_per_s'] = round(stage_info['deleted'] / elapsed, 1) if elapsed > 0 else 0.0
+        self._persist(job_id)
+
+    def _record_error(self, job_id: str, stage: str, error: Exception):
+        logger.error(f"Purge job {job_id} stage '{stage}' failed: {error}")
+        with self._lock:
+            self._jobs[job_id]['errors'].append({'stage': stage, 'error': str(error)})
+        self._persist(job_id)
+
+    def _prune_finished_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in ('done', 'failed')]
+        if len(finished) <= self.MAX_FINISHED_JOBS:
+            return
+        finished.sort(key=lambda j: self._jobs[j]['created_at'])
+        for job_id in finished[:len(finished) - self.MAX_FINISHED_JOBS]:
+            del self._jobs[job_id]
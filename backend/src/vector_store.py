@@ -0,0 +1,222 @@
+"""
+Common VectorStore protocol and backend factory
+
+Every backend returns search results in ChromaDB's nested-list shape
+({'ids': [[...]], 'documents': [[...]], 'metadatas': [[...]], 'distances': [[...]]})
+with cosine distances, so SmartRetriever works unchanged whichever backend
+Config.VECTOR_STORE_BACKEND selects.
+
+Searches accept structured `filters` that each backend pushes into its own
+query (Chroma `where`, FAISS ID selector):
+    {'chunk_types': ['table'], 'page_range': (3, 7), 'pages': [3, 9], 'documents': ['a', 'b']}
+All keys are optional; page_range bounds are inclusive and either may be None.
+'pages' lists individual pages (non-contiguous references such as "pages 3 and 9").
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Protocol, List, Dict, Any, Callable, Optional, runtime_checkable
+
+import numpy as np
+
+
+@runtime_checkable
+class VectorStore(Protocol):
+    """Interface implemented by ChromaVectorStore, FaissVectorStore and SimpleVectorStore"""
+
+    def add_documents(self, chunks: List, document_name: str, user_id: str = None) -> Dict[str, Any]:
+        """Embed and store document chunks"""
+        ...
+
+    def search(self, query: str, n_results: int = 5, document_filter: str = None,
+               user_id: str = None, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Nearest-neighbour search for one query"""
+        ...
+
+    def search_many(self, queries: List[str], n_results: int = 5, document_filter: str = None,
+                    user_id: str = None, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Nearest-neighbour search for several queries with one batched embedding call"""
+        ...
+
+    def delete_document(self, document_name: str, user_id: str = None) -> Dict[str, Any]:
+        """Delete all chunks of a document"""
+        ...
+
+    def delete_user_vectors(self, user_id: str, batch_size: int = None,
+                            progress_callback: Callable[[int], None] = None) -> Dict[str, Any]:
+        """Delete all chunks owned by a user"""
+        ...
+
+    def document_has_other_owners(self, document_name: str, user_id: str) -> bool:
+        """Check whether another user still references a document name"""
+        ...
+
+    def get_document_owners(self) -> Dict[str, List[Optional[str]]]:
+        """Document name -> user IDs holding chunks for it (full scan; used by one-off migrations)"""
+        ...
+
+    def get_embeddings(self, ids: List[str]) -> np.ndarray:
+        """Stored (L2-normalised) embeddings for chunk IDs as a float32 matrix; zero rows for unknown IDs"""
+        ...
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """L2-normalised query embeddings as a float32 matrix (shares the search path's embedding cache)"""
+        ...
+
+    def get_user_chunks(self, user_id: str) -> Dict[str, List]:
+        """All of a user's chunks as flat 'ids', 'documents', 'metadatas' lists (no embeddings)"""
+        ...
+
+    def get_chunks(self, ids: List[str]) -> Dict[str, List]:
+        """Text and metadata for chunk IDs as 'documents', 'metadatas' lists aligned with ids (None if unknown)"""
+        ...
+
+    def clear_all(self) -> Dict[str, Any]:
+        """Remove every chunk"""
+        ...
+
+    def list_documents(self, user_id: str = None) -> List[Dict[str, Any]]:
+        """List documents with per-type chunk counts"""
+        ...
+
+    def get_collection_stats(self) -> Dict[str, Any]:
+        """Backend statistics"""
+        ...
+
+
+@runtime_checkable
+class CompactableVectorStore(VectorStore, Protocol):
+    """Backends whose index accumulates tombstones and can be rebuilt in the background"""
+
+    query_activity: 'QueryActivity'
+
+    def get_index_metrics(self) -> Dict[str, Any]:
+        """Index size and fragmentation (live vectors, tombstones, bytes)"""
+        ...
+
+    def compact(self, throttle: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """Rebuild the index from live vectors and swap it in"""
+        ...
+
+
+class QueryActivity:
+    """Counts in-flight searches so background maintenance can yield to them"""
+
+    def __init__(self):
+        self._active = 0
+        self._last_finished = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._last_finished = time.monotonic()
+
+    def idle_for(self) -> float:
+        """Seconds since the last search finished (0 while one is running)"""
+        with self._lock:
+            if self._active:
+                return 0.0
+            return time.monotonic() - self._last_finished
+
+
+class QueryEmbeddingCache:
+    """
+    Small LRU of query embeddings
+
+    The retriever may search the same query several times with different
+    filters (e.g. a table-only pass next to the general one); this keeps the
+    embedding model from running more than once per query.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[str, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed(self, queries: List[str], encode: Callable[[List[str]], Any]) -> List[Any]:
+        """Return one embedding per query, encoding only the cache misses in a single batch"""
+        # Vectors for this call are collected locally: another thread may evict them from the LRU meanwhile
+        vectors: Dict[str, Any] = {}
+        with self._lock:
+            for query in dict.fromkeys(queries):
+                if query in self._entries:
+                    self._entries.move_to_end(query)
+                    vectors[query] = self._entries[query]
+        missing = [q for q in dict.fromkeys(queries) if q not in vectors]
+        if missing:
+            encoded = encode(missing)
+            with self._lock:
+                for query, vector in zip(missing, encoded):
+                    vectors[query] = vector
+                    self._entries[query] = vector
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+        return [vectors[query] for query in queries]
+
+
+def matches_filters(metadata: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate structured search filters against one chunk's metadata"""
+    if not filters:
+        return True
+
+    chunk_types = filters.get('chunk_types')
+    if chunk_types and metadata.get('chunk_type') not in chunk_types:
+        return False
+
+    documents = filters.get('documents')
+    if documents and metadata.get('document_name') not in documents:
+        return False
+
+    page_range = filters.get('page_range')
+    if page_range:
+        low, high = page_range
+        page = metadata.get('page_number', 1)
+        if (low is not None and page < low) or (high is not None and page > high):
+            return False
+
+    pages = filters.get('pages')
+    if pages and metadata.get('page_number', 1) not in pages:
+        return False
+
+    return True
+
+
+def empty_results() -> Dict[str, Any]:
+    """Empty search result in the shared nested-list shape"""
+    return {
+        'ids': [[]],
+        'documents': [[]],
+        'metadatas': [[]],
+        'distances': [[]]
+    }
+
+
+def create_vector_store(config) -> VectorStore:
+    """
+    Instantiate the backend selected by config.VECTOR_STORE_BACKEND
+
+    Backends are imported lazily so unused optional dependencies
+    (chromadb, faiss) don't need to be installed.
+    """
+    backend = getattr(config, 'VECTOR_STORE_BACKEND', 'chroma').lower()
+
+    if backend == 'chroma':
+        from .chroma_vector_store import ChromaVectorStore
+        return ChromaVectorStore(config)
+    elif backend == 'faiss':
+        from .faiss_vector_store import FaissVectorStore
+        return FaissVectorStore(config)
+    elif backend == 'simple':
+        from .simple_vector_store import SimpleVectorStore
+        return SimpleVectorStore(config)
+
+    raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {backend} (expected chroma, faiss or simple)")
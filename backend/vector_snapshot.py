@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Vector Index Snapshot CLI
+Save the ChromaDB collection to a checksummed archive, or restore it without re-embedding.
+
+Usage:
+    python vector_snapshot.py snapshot [path]            # Write snapshot (default: VECTOR_SNAPSHOT_PATH)
+    python vector_snapshot.py restore [path]             # Upsert snapshot into the collection
+    python vector_snapshot.py restore [path] --replace   # Clear the collection first
+"""
+import sys
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """Main CLI function"""
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if not args or args[0] not in ('snapshot', 'restore'):
+        logger.info(__doc__)
+        sys.exit(1)
+
+    from config.config import Config
+    from src.chroma_vector_store import ChromaVectorStore
+
+    config = Config()
+    # Never auto-restore here - the command decides what happens to the collection
+    config.RESTORE_SNAPSHOT_ON_STARTUP = False
+    store = ChromaVectorStore(config)
+
+    path = args[1] if len(args) > 1 else config.VECTOR_SNAPSHOT_PATH
+
+    if args[0] == 'snapshot':
+        result = store.snapshot(path)
+    else:
+        result = store.restore_snapshot(path, replace='--replace' in sys.argv)
+
+    if not result['success']:
+        logger.error(f"❌ {args[0]} failed: {result.get('error')}")
+        sys.exit(1)
+
+    logger.info(f"✅ {args[0]} complete: {result}")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()